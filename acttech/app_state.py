@@ -0,0 +1,200 @@
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Sequence, Tuple
+
+from config import SETTINGS
+import repo_store
+
+
+# ----------------------------
+# In-process state cache
+# ----------------------------
+#
+# web_app routes read the same state over and over (status polling, plan,
+# apply). AppState keeps the parsed objects in memory:
+#   - JSON docs in STATE_DIR (diff, patches, last_apply_log, ...) are keyed by
+#     the file's (mtime_ns, size): a changed file is re-parsed once, an
+#     unchanged one never. put() updates memory at once and writes the file
+#     behind (STATE_WRITE_BEHIND_SEC, 0 = synchronous); the written file's
+#     stat is remembered so our own writes do not trigger a re-parse.
+#   - repo maps / snapshot ids from repo_store are keyed by the stat of the
+#     SQLite file and its WAL, so a new scan (by any process) invalidates them.
+#   - derived values that cost a directory walk (plan cache / backup store
+#     stats) are kept for DERIVED_TTL_SEC; jobs that change them drop them.
+# Returned objects are shared: treat them as read-only.
+
+StatKey = Tuple[int, int]
+
+DERIVED_TTL_SEC = 10.0
+
+
+def _stat_key(p: Path) -> Optional[StatKey]:
+    try:
+        st = p.stat()
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+class AppState:
+    def __init__(self, repo_root: Path):
+        self.repo_root = repo_root
+        self.dir = repo_root / SETTINGS.STATE_DIR
+        self.delay = float(getattr(SETTINGS, "STATE_WRITE_BEHIND_SEC", 0.25))
+        self._lock = threading.RLock()
+        self._docs: Dict[str, Tuple[Optional[StatKey], Any]] = {}
+        self._dirty: Dict[str, Any] = {}
+        self._store: Dict[Any, Tuple[Any, Any]] = {}
+        self._derived: Dict[str, Tuple[float, Any]] = {}
+        self._wake = threading.Condition(self._lock)
+        self._writer: Optional[threading.Thread] = None
+        self._closed = False
+        self.stats = {"hits": 0, "loads": 0, "writes": 0}
+
+    def path(self, name: str) -> Path:
+        return self.dir / f"{name}.json"
+
+    # ----------------------------
+    # JSON docs
+    # ----------------------------
+
+    def get(self, name: str, default: Any = None) -> Any:
+        p = self.path(name)
+        with self._lock:
+            if name in self._dirty:
+                self.stats["hits"] += 1
+                return self._dirty[name]
+            key = _stat_key(p)
+            cached = self._docs.get(name)
+            if cached is not None and key is not None and cached[0] == key:
+                self.stats["hits"] += 1
+                return cached[1]
+        if key is None:
+            return default
+        try:
+            obj = json.loads(p.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return default
+        with self._lock:
+            if name not in self._dirty:
+                # key taken before the read: a write in between shows up as a miss next time
+                self._docs[name] = (key, obj)
+            self.stats["loads"] += 1
+        return obj
+
+    def put(self, name: str, obj: Any) -> None:
+        with self._lock:
+            self._dirty[name] = obj
+            if self.delay <= 0 or self._closed:
+                self._flush_locked()
+                return
+            self._ensure_writer()
+            self._wake.notify()
+
+    def flush(self) -> None:
+        with self._lock:
+            self._flush_locked()
+
+    def close(self) -> None:
+        with self._lock:
+            self._closed = True
+            self._flush_locked()
+            self._wake.notify()
+
+    def _flush_locked(self) -> None:
+        dirty, self._dirty = self._dirty, {}
+        items = list(dirty.items())
+        for i, (name, obj) in enumerate(items):
+            p = self.path(name)
+            tmp = p.with_suffix(f".json.{os.getpid()}.tmp")
+            try:
+                p.parent.mkdir(parents=True, exist_ok=True)
+                tmp.write_text(json.dumps(obj, indent=2), encoding="utf-8")
+                tmp.replace(p)
+            except BaseException:
+                # this doc and the ones after it stay dirty (served from
+                # memory, retried by the next flush) unless put() replaced them
+                for n, o in items[i:]:
+                    self._dirty.setdefault(n, o)
+                tmp.unlink(missing_ok=True)
+                raise
+            self._docs[name] = (_stat_key(p), obj)
+            self.stats["writes"] += 1
+
+    def _ensure_writer(self) -> None:
+        if self._writer is not None and self._writer.is_alive():
+            return
+        self._writer = threading.Thread(target=self._write_loop, name="app-state-writer", daemon=True)
+        self._writer.start()
+
+    def _write_loop(self) -> None:
+        with self._lock:
+            while not self._closed:
+                if not self._dirty:
+                    self._wake.wait()
+                    continue
+                # batch writes arriving within the delay into one flush
+                self._wake.wait(self.delay)
+                try:
+                    self._flush_locked()
+                except Exception:
+                    # keep serving from memory; retry later (or on the next put)
+                    self._wake.wait(max(self.delay, 1.0))
+
+    # ----------------------------
+    # Repo store (snapshots)
+    # ----------------------------
+
+    def _store_key(self) -> Tuple[Optional[StatKey], Optional[StatKey]]:
+        db = repo_store.store_path(self.repo_root)
+        return (_stat_key(db), _stat_key(db.with_name(db.name + "-wal")))
+
+    def _store_cached(self, key: Any, load: Any) -> Any:
+        skey = self._store_key()
+        with self._lock:
+            hit = self._store.get(key)
+            if hit is not None and hit[0] == skey:
+                self.stats["hits"] += 1
+                return hit[1]
+        value = load()
+        with self._lock:
+            self._store[key] = (skey, value)
+            self.stats["loads"] += 1
+        return value
+
+    def snapshot_id(self, label: str) -> Optional[int]:
+        return self._store_cached(("sid", label), lambda: repo_store.latest_snapshot_id(self.repo_root, label))
+
+    def has_snapshot(self, label: str) -> bool:
+        return self.snapshot_id(label) is not None
+
+    def repo_map(self, label: str, columns: Optional[Sequence[str]] = None) -> Optional[Dict[str, Any]]:
+        cols = tuple(columns) if columns else None
+        return self._store_cached(("map", label, cols), lambda: repo_store.load_repo_map(self.repo_root, label, columns=cols))
+
+    # ----------------------------
+    # Derived values (TTL)
+    # ----------------------------
+
+    def derived(self, name: str, load: Callable[[], Any], ttl: float = DERIVED_TTL_SEC) -> Any:
+        now = time.monotonic()
+        with self._lock:
+            hit = self._derived.get(name)
+            if hit is not None and now - hit[0] < ttl:
+                self.stats["hits"] += 1
+                return hit[1]
+        value = load()
+        with self._lock:
+            self._derived[name] = (now, value)
+            self.stats["loads"] += 1
+        return value
+
+    def invalidate(self, *names: str) -> None:
+        with self._lock:
+            for name in names:
+                self._derived.pop(name, None)
@@ -0,0 +1,268 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+import zlib
+from pathlib import Path
+from typing import Dict, Any, Iterable, List, Optional
+
+from config import SETTINGS
+
+
+# ----------------------------
+# Layout
+# ----------------------------
+#
+# BACKUP_DIR/objects/<sha[:2]>/<sha>      file content (raw), or
+# BACKUP_DIR/objects/<sha[:2]>/<sha>.z    the same content zlib-compressed
+# BACKUP_DIR/runs/<run_id>.json           manifest: rel path -> blob sha
+#
+# The sha256 is taken over the raw bytes, so a file that is backed up again
+# unchanged costs one stat() and no copy. A manifest entry with sha=None means
+# the file did not exist before the run (restore deletes it).
+
+_GC_GRACE_SEC = 3600  # unreferenced objects younger than this survive gc (in-flight runs)
+
+_lock = threading.Lock()
+
+
+def _sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def _write_atomic(path: Path, data: bytes, mode: Optional[int] = None) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=str(path.parent), prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as fh:
+            fh.write(data)
+        if mode is not None:
+            os.chmod(tmp, mode)
+        os.replace(tmp, path)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+
+
+class BackupStore:
+    """
+    Content-addressed backups for apply runs in BACKUP_DIR. Blobs are shared
+    between runs; each run is a small manifest. gc() keeps the newest
+    BACKUP_KEEP_RUNS manifests and drops objects no manifest references.
+    """
+
+    def __init__(self, repo_root: Path):
+        self.repo_root = repo_root
+        self.root = repo_root / SETTINGS.BACKUP_DIR
+        self.objects = self.root / "objects"
+        self.runs = self.root / "runs"
+        self.compress = bool(getattr(SETTINGS, "BACKUP_COMPRESS", True))
+
+    # ----------------------------
+    # Objects
+    # ----------------------------
+
+    def _object_paths(self, sha: str) -> List[Path]:
+        base = self.objects / sha[:2] / sha
+        return [base.with_name(sha + ".z"), base]
+
+    def put_bytes(self, data: bytes) -> str:
+        sha = _sha256(data)
+        for p in self._object_paths(sha):
+            if p.exists():
+                try:
+                    os.utime(p, None)  # fresh mtime = protected by the gc grace period
+                except OSError:
+                    pass
+                return sha
+        z, raw = self._object_paths(sha)
+        if self.compress:
+            packed = zlib.compress(data, 6)
+            if len(packed) < len(data):
+                _write_atomic(z, packed)
+                return sha
+        _write_atomic(raw, data)
+        return sha
+
+    def get_bytes(self, sha: str) -> bytes:
+        z, raw = self._object_paths(sha)
+        if z.exists():
+            data = zlib.decompress(z.read_bytes())
+        elif raw.exists():
+            data = raw.read_bytes()
+        else:
+            raise FileNotFoundError(f"backup object {sha} is missing")
+        if _sha256(data) != sha:
+            raise ValueError(f"backup object {sha} is corrupt")
+        return data
+
+    # ----------------------------
+    # Runs
+    # ----------------------------
+
+    def new_run(self, run_id: str, meta: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Empty manifest; run_id gets a numeric suffix if that name is taken.
+        """
+        rid, n = run_id, 2
+        while (self.runs / f"{rid}.json").exists():
+            rid, n = f"{run_id}_{n}", n + 1
+        return {"run_id": rid, "created": time.time(), "meta": meta or {}, "files": {}}
+
+    def add_file(self, manifest: Dict[str, Any], rel: str) -> None:
+        """
+        Records rel's current content (or its absence) in manifest. The first
+        state recorded for a path wins.
+        """
+        if rel in manifest["files"]:
+            return
+        p = self.repo_root / rel
+        if not p.is_file():
+            manifest["files"][rel] = {"sha": None}
+            return
+        st = p.stat()
+        sha = self.put_bytes(p.read_bytes())
+        manifest["files"][rel] = {"sha": sha, "size": st.st_size, "mode": st.st_mode & 0o7777}
+
+    def save_run(self, manifest: Dict[str, Any]) -> Path:
+        p = self.runs / f"{manifest['run_id']}.json"
+        with _lock:
+            _write_atomic(p, json.dumps(manifest, indent=2).encode("utf-8"))
+        return p
+
+    def load_run(self, run_id: str) -> Dict[str, Any]:
+        if not run_id or "/" in run_id or "\\" in run_id or run_id.startswith("."):
+            raise ValueError(f"bad run id: {run_id!r}")
+        p = self.runs / f"{run_id}.json"
+        if not p.exists():
+            raise FileNotFoundError(f"no backup run {run_id!r}")
+        return json.loads(p.read_text(encoding="utf-8"))
+
+    def list_runs(self) -> List[Dict[str, Any]]:
+        """
+        Newest first: run_id, created, meta, file count, original bytes.
+        """
+        out: List[Dict[str, Any]] = []
+        for p in self._manifests():
+            try:
+                m = json.loads(p.read_text(encoding="utf-8"))
+            except Exception:
+                continue
+            files = m.get("files") or {}
+            out.append({
+                "run_id": m.get("run_id", p.stem),
+                "created": m.get("created", 0),
+                "meta": m.get("meta") or {},
+                "files": len(files),
+                "bytes": sum(int(e.get("size") or 0) for e in files.values()),
+            })
+        out.sort(key=lambda r: r["created"], reverse=True)
+        return out
+
+    def _manifests(self) -> Iterable[Path]:
+        if not self.runs.exists():
+            return iter(())
+        return self.runs.glob("*.json")
+
+    # ----------------------------
+    # Restore
+    # ----------------------------
+
+    def restore_file(self, rel: str, entry: Dict[str, Any]) -> str:
+        """
+        Puts one manifest entry back in place (atomic rename). Returns
+        "restored", or "removed" for a file the run had created.
+        """
+        p = self.repo_root / rel
+        if entry.get("sha") is None:
+            p.unlink(missing_ok=True)
+            return "removed"
+        _write_atomic(p, self.get_bytes(entry["sha"]), entry.get("mode"))
+        return "restored"
+
+    def restore(self, run_id: str, paths: Optional[List[str]] = None) -> Dict[str, Any]:
+        """
+        Puts files back as they were before run_id (all, or only paths).
+        The current state is backed up first as a "restore" run, so a
+        restore can itself be undone.
+        """
+        manifest = self.load_run(run_id)
+        entries: Dict[str, Dict[str, Any]] = manifest.get("files") or {}
+        wanted = list(entries) if paths is None else [p for p in paths if p in entries]
+
+        undo = self.new_run(time.strftime("%Y%m%d_%H%M%S"), meta={"kind": "restore", "of": run_id})
+        for rel in wanted:
+            self.add_file(undo, rel)
+        self.save_run(undo)
+
+        results: List[Dict[str, Any]] = []
+        for rel in wanted:
+            try:
+                status = self.restore_file(rel, entries[rel])
+                results.append({"file": rel, "status": status})
+            except Exception as ex:
+                results.append({"file": rel, "status": "failed", "reason": str(ex)})
+        missing = [p for p in (paths or []) if p not in entries]
+        results.extend({"file": p, "status": "skipped", "reason": "not in this run"} for p in missing)
+        return {"run_id": run_id, "undo_run_id": undo["run_id"], "results": results}
+
+    # ----------------------------
+    # GC / stats
+    # ----------------------------
+
+    def gc(self, keep: Optional[int] = None) -> Dict[str, int]:
+        """
+        Keeps the newest `keep` runs (BACKUP_KEEP_RUNS; 0 = keep all), then
+        deletes objects referenced by no remaining manifest.
+        """
+        keep = int(getattr(SETTINGS, "BACKUP_KEEP_RUNS", 20) if keep is None else keep)
+        runs_removed = objects_removed = bytes_freed = 0
+        with _lock:
+            runs = self.list_runs()
+            if keep > 0:
+                for r in runs[keep:]:
+                    (self.runs / f"{r['run_id']}.json").unlink(missing_ok=True)
+                    runs_removed += 1
+
+            live = set()
+            for p in self._manifests():
+                try:
+                    m = json.loads(p.read_text(encoding="utf-8"))
+                except Exception:
+                    return {"runs_removed": runs_removed, "objects_removed": 0, "bytes_freed": 0}  # don't sweep blind
+                live.update(e["sha"] for e in (m.get("files") or {}).values() if e.get("sha"))
+
+            now = time.time()
+            for p in self._objects():
+                sha = p.name[:-2] if p.name.endswith(".z") else p.name
+                if sha in live:
+                    continue
+                try:
+                    st = p.stat()
+                    if now - st.st_mtime < _GC_GRACE_SEC:
+                        continue
+                    p.unlink()
+                except OSError:
+                    continue
+                objects_removed += 1
+                bytes_freed += st.st_size
+        return {"runs_removed": runs_removed, "objects_removed": objects_removed, "bytes_freed": bytes_freed}
+
+    def _objects(self) -> Iterable[Path]:
+        if not self.objects.exists():
+            return iter(())
+        return (p for p in self.objects.glob("??/*") if not p.name.startswith("."))
+
+    def stats(self) -> Dict[str, int]:
+        n = size = 0
+        for p in self._objects():
+            try:
+                size += p.stat().st_size
+                n += 1
+            except OSError:
+                pass
+        return {"runs": sum(1 for _ in self._manifests()), "objects": n, "object_bytes": size}
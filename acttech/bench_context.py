@@ -0,0 +1,78 @@
+# bench_context.py - micro-benchmark for context_builder._score_content
+# Usage: python bench_context.py [--lines 20000] [--repeat 5]
+from __future__ import annotations
+
+import argparse
+import random
+import re
+import time
+from typing import List
+
+from context_builder import _score_content, _tokenize_goal
+
+
+def _score_content_legacy(text: str, goal_tokens: List[str]) -> float:
+    """
+    Previous implementation (one regex compile + findall per token, full lower()).
+    """
+    if not text or not goal_tokens:
+        return 0.0
+    lo = text.lower()
+    score = 0.0
+    for t in goal_tokens:
+        hits = len(re.findall(rf"(?<![a-z0-9_]){re.escape(t)}(?![a-z0-9_])", lo))
+        if hits:
+            score += min(10, hits) * 1.4
+        else:
+            sub = lo.count(t)
+            if sub:
+                score += min(6, sub) * 0.6
+    return score
+
+
+def _synthetic_file(lines: int, seed: int = 7) -> str:
+    rnd = random.Random(seed)
+    words = [
+        "def", "return", "self", "request", "response", "handler", "scan_repo", "repo_map",
+        "config", "Settings", "json", "path", "value", "health", "router", "apiKey", "items",
+    ]
+    out = []
+    for i in range(lines):
+        n = rnd.randint(3, 10)
+        out.append("    " + " ".join(rnd.choice(words) for _ in range(n)) + f"  # line {i}\n")
+    return "".join(out)
+
+
+def _timeit(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--lines", type=int, default=20000)
+    ap.add_argument("--repeat", type=int, default=5)
+    args = ap.parse_args()
+
+    goal = "Add a /health endpoint to the router, read apiKey from Settings and update scan_repo handler json response"
+    tokens = _tokenize_goal(goal)
+
+    for lines in (args.lines // 10, args.lines, args.lines * 5):
+        text = _synthetic_file(lines)
+        legacy = _score_content_legacy(text, tokens)
+        new = _score_content(text, tokens)
+        t_old = _timeit(lambda: _score_content_legacy(text, tokens), args.repeat)
+        t_new = _timeit(lambda: _score_content(text, tokens), args.repeat)
+        print(
+            f"{lines:>7} lines {len(text) / 1e6:6.2f} MB  tokens={len(tokens)}  "
+            f"legacy={t_old * 1000:8.2f} ms  single-pass={t_new * 1000:8.2f} ms  "
+            f"speedup={t_old / t_new:5.2f}x  same_score={abs(legacy - new) < 1e-9}"
+        )
+
+
+if __name__ == "__main__":
+    main()
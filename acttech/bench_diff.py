@@ -0,0 +1,92 @@
+# bench_diff.py - text_diff (patience/Myers opcodes, one pass) vs difflib unified_diff + ndiff
+# Usage: python bench_diff.py [--sizes 10000,100000] [--legacy-max-lines 20000]
+from __future__ import annotations
+
+import argparse
+import difflib
+import random
+import time
+from typing import Callable, List, Tuple
+
+from text_diff import diff_texts
+
+
+def _legacy(rel: str, before: str, after: str) -> Tuple[str, int]:
+    """
+    Previous patch_apply implementation (unified_diff + a separate ndiff count).
+    """
+    a = before.splitlines(True)
+    b = after.splitlines(True)
+    text = "".join(difflib.unified_diff(a, b, fromfile=f"a/{rel}", tofile=f"b/{rel}", n=3))
+    changed = sum(1 for _ in difflib.ndiff(before.splitlines(), after.splitlines())
+                  if _.startswith("+ ") or _.startswith("- "))
+    return text, changed
+
+
+def _source(lines: int, rnd: random.Random) -> List[str]:
+    out = []
+    for i in range(lines):
+        if i % 12 == 0:
+            out.append(f"def handler_{i}(request, response):\n")
+        elif i % 12 == 11:
+            out.append("\n")
+        else:
+            out.append(f"    value_{rnd.randint(0, 50)} = compute(request.items[{i % 7}], {rnd.randint(0, 999)})\n")
+    return out
+
+
+def _scenarios(lines: int, seed: int = 7) -> List[Tuple[str, str, str]]:
+    rnd = random.Random(seed)
+    base = _source(lines, rnd)
+    before = "".join(base)
+
+    local = list(base)
+    mid = lines // 2
+    local[mid:mid + 5] = ["    patched = True\n"] * 8
+
+    scattered = list(base)
+    for i in sorted(rnd.sample(range(lines), max(1, lines // 100)), reverse=True):
+        scattered[i] = f"    edited_{i} = {rnd.randint(0, 9)}\n"
+
+    # regenerated file: half of the lines differ, order mostly kept
+    rewrite = [ln if rnd.random() < 0.5 else f"    gen_{i}_{rnd.randint(0, 10**6)} = None\n" for i, ln in enumerate(base)]
+
+    return [
+        ("local edit", before, "".join(local)),
+        ("1% scattered", before, "".join(scattered)),
+        ("50% rewrite", before, "".join(rewrite)),
+    ]
+
+
+def _time(fn: Callable[[], Tuple[str, int]], repeat: int) -> Tuple[float, int]:
+    best = float("inf")
+    changed = 0
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        _, changed = fn()
+        best = min(best, time.perf_counter() - t0)
+    return best, changed
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", default="10000,100000")
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--legacy-max-lines", type=int, default=20000,
+                    help="skip difflib above this size (ndiff is near-quadratic on rewrites)")
+    args = ap.parse_args()
+
+    print(f"{'lines':>8} {'scenario':<14} {'text_diff':>11} {'changed':>8} {'difflib':>11} {'changed':>8} {'speedup':>8}")
+    for size in (int(s) for s in args.sizes.split(",") if s.strip()):
+        for name, before, after in _scenarios(size):
+            new_t, new_c = _time(lambda: diff_texts("f.py", before, after), args.repeat)
+            if size <= args.legacy_max_lines:
+                old_t, old_c = _time(lambda: _legacy("f.py", before, after), 1)
+                old = f"{old_t * 1000:>9.1f}ms {old_c:>8} {old_t / new_t:>7.1f}x"
+            else:
+                old = f"{'skipped':>11} {'':>8} {'':>8}"
+            print(f"{size:>8} {name:<14} {new_t * 1000:>9.1f}ms {new_c:>8} {old}")
+
+
+if __name__ == "__main__":
+    main()
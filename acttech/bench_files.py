@@ -0,0 +1,83 @@
+# bench_files.py - FileIndex.search (ranked fuzzy, paged) on a synthetic repo listing
+# Usage: python bench_files.py [--files 100000] [--repeat 5]
+from __future__ import annotations
+
+import argparse
+import random
+import time
+from pathlib import Path
+from typing import Callable, List
+
+from file_index import FileIndex
+
+_WORDS = ("src lib core utils api web app models views tests components hooks "
+          "services store auth user order payment config").split()
+_SUFFIXES = ("", "_helper", "Service", "_test", "Controller")
+_EXTS = (".py", ".ts", ".tsx", ".js", ".md")
+
+_QUERIES = ["a", "usr", "zzz", "paymentservice", "auth ctl", "src/api/user", "uhts"]
+_TYPING = ["p", "pa", "pay", "paym", "payms", "paymse", "paymser"]
+
+
+def _paths(n: int, seed: int = 1) -> List[str]:
+    rnd = random.Random(seed)
+    out = set()
+    while len(out) < n:
+        d = "/".join(rnd.choice(_WORDS) for _ in range(rnd.randint(1, 5)))
+        out.add(f"{d}/{rnd.choice(_WORDS)}{rnd.choice(_SUFFIXES)}{rnd.choice(_EXTS)}")
+    return sorted(out)
+
+
+def _index(paths: List[str]) -> FileIndex:
+    idx = FileIndex(Path("."))
+    with idx._lock:
+        idx._paths = paths
+        idx._built = time.monotonic()
+        idx.live = True  # no walks: the listing is synthetic
+        idx._changed()
+    return idx
+
+
+def _cold(idx: FileIndex) -> None:
+    idx._results.clear()
+    idx._last = (-1, "", [])
+
+
+def _time(fn: Callable[[], None], repeat: int, before: Callable[[], None]) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        before()
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--files", type=int, default=100_000)
+    ap.add_argument("--repeat", type=int, default=5)
+    args = ap.parse_args()
+
+    idx = _index(_paths(args.files))
+    idx.search("warm")  # builds the lowercased copy once
+
+    print(f"{idx.stats()['files']} paths")
+    print(f"{'query':<16} {'matches':>8} {'cold':>10} {'next page':>10}  top result")
+    for q in _QUERIES:
+        cold = _time(lambda: idx.search(q, 0, 200), args.repeat, lambda: _cold(idx))
+        page = _time(lambda: idx.search(q, 200, 200), args.repeat, lambda: None)
+        res = idx.search(q, 0, 1)
+        top = res["results"][0]["path"] if res["results"] else "-"
+        print(f"{q!r:<16} {res['total']:>8} {cold * 1000:>8.1f}ms {page * 1000:>8.1f}ms  {top}")
+
+    print("\ntyping (each keystroke narrows the previous candidates)")
+    _cold(idx)
+    for q in _TYPING:
+        t0 = time.perf_counter()
+        res = idx.search(q, 0, 200)
+        print(f"{q!r:<16} {res['total']:>8} {(time.perf_counter() - t0) * 1000:>8.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+# bench_planner.py - offline load test of plan -> dry-run apply against mock_llm_server.py
+# Usage:
+#   python mock_llm_server.py --port 8799 --latency 0.5 --malformed-rate 0.2 &
+#   python bench_planner.py --base-url http://127.0.0.1:8799/v1 --requests 40 --concurrency 8 [--candidates 3]
+from __future__ import annotations
+
+import argparse
+import asyncio
+import shutil
+import statistics
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+from config import SETTINGS
+from llm_planner import plan_candidates_async
+from patch_apply import score_plan
+
+
+def _make_repo(root: Path, files: int) -> List[str]:
+    rels = []
+    for i in range(files):
+        rel = f"pkg/mod_{i}.py"
+        p = root / rel
+        p.parent.mkdir(parents=True, exist_ok=True)
+        p.write_text("".join(f"def f_{i}_{j}(x):\n    return x + {j}\n\n" for j in range(40)), encoding="utf-8")
+        rels.append(rel)
+    return rels
+
+
+def _context(root: Path, rel: str) -> str:
+    txt = (root / rel).read_text(encoding="utf-8")
+    return f"--- FILE: {rel} (lines={txt.count(chr(10))}, size={len(txt)}) ---\n{txt}"
+
+
+def _pct(xs: List[float], q: float) -> float:
+    xs = sorted(xs)
+    return xs[min(len(xs) - 1, int(q * len(xs)))] if xs else 0.0
+
+
+async def _run(root: Path, rels: List[str], n_requests: int, concurrency: int, candidates: int) -> List[Dict[str, Any]]:
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one(i: int) -> Dict[str, Any]:
+        rel = rels[i % len(rels)]
+        first_token: List[float] = []
+        async with sem:
+            t0 = time.perf_counter()
+
+            def progress(msg: str) -> None:
+                if not first_token and "first token" in msg:
+                    first_token.append(time.perf_counter() - t0)
+
+            try:
+                plan, _ = await plan_candidates_async(
+                    f"bench request {i}: touch {rel}", _context(root, rel), candidates,
+                    evaluate=lambda p: score_plan(root, p), on_progress=progress,
+                )
+                planned = time.perf_counter() - t0
+                score = await asyncio.to_thread(score_plan, root, plan)
+                err = ""
+            except Exception as e:
+                planned, score, err = time.perf_counter() - t0, {"ok": False}, str(e)
+            return {
+                "latency": planned,
+                "first_token": first_token[0] if first_token else None,
+                "ok": bool(score.get("ok")),
+                "error": err,
+            }
+
+    return await asyncio.gather(*(one(i) for i in range(n_requests)))
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--base-url", default="http://127.0.0.1:8799/v1")
+    ap.add_argument("--requests", type=int, default=40)
+    ap.add_argument("--concurrency", type=int, default=8)
+    ap.add_argument("--candidates", type=int, default=1)
+    ap.add_argument("--files", type=int, default=20)
+    args = ap.parse_args()
+
+    SETTINGS.OPENAI_BASE_URL = args.base_url
+    SETTINGS.OPENAI_API_KEY = SETTINGS.OPENAI_API_KEY or "mock"
+
+    root = Path(tempfile.mkdtemp(prefix="bench_planner_"))
+    try:
+        rels = _make_repo(root, args.files)
+        t0 = time.perf_counter()
+        rows = asyncio.run(_run(root, rels, args.requests, args.concurrency, args.candidates))
+        wall = time.perf_counter() - t0
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+    lat = [r["latency"] for r in rows]
+    ttft = [r["first_token"] for r in rows if r["first_token"] is not None]
+    ok = sum(1 for r in rows if r["ok"])
+    errors = [r["error"] for r in rows if r["error"]]
+    print(f"requests={len(rows)} concurrency={args.concurrency} candidates={args.candidates}")
+    print(f"wall:        {wall:.2f}s  ({len(rows) / wall:.1f} plans/s)")
+    print(f"latency:     p50={_pct(lat, 0.5):.3f}s  p95={_pct(lat, 0.95):.3f}s  mean={statistics.mean(lat):.3f}s")
+    if ttft:
+        print(f"first token: p50={_pct(ttft, 0.5):.3f}s  p95={_pct(ttft, 0.95):.3f}s")
+    print(f"applies cleanly: {ok}/{len(rows)}  errors: {len(errors)}" + (f"  (first: {errors[0]})" if errors else ""))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,279 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import signal
+import sys
+import time
+import uuid
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+# ----------------------------
+# Async command runner
+# ----------------------------
+#
+# Commands run as asyncio subprocesses (shell=True, like before) in their own
+# process group. stdout/stderr are read concurrently and every complete line
+# is handed to on_output as soon as it arrives (web_app writes it to the
+# terminal log, which the SSE stream pushes to the UI). A job is a list of
+# commands run in order; it is started in the background and its id returned
+# at once. Per command: timeout (SIGTERM, then SIGKILL after a grace period)
+# and, on POSIX, an address-space cap via RLIMIT_AS.
+
+_KILL_GRACE_SEC = 3.0
+_CHUNK = 4096
+_MAX_JOBS = 50  # finished jobs kept for status queries
+
+_IS_POSIX = os.name == "posix"
+
+
+def _limit_memory(mb: int) -> Optional[Callable[[], None]]:
+    if not mb or not _IS_POSIX:
+        return None  # Windows: no RLIMIT_AS; the timeout still applies
+
+    def preexec() -> None:
+        import resource
+        cap = int(mb) * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (cap, cap))
+    return preexec
+
+
+@dataclass
+class RunJob:
+    id: str
+    cmds: List[str]
+    status: str = "queued"  # queued, running, ok, failed, timeout, cancelled
+    results: List[Dict[str, Any]] = field(default_factory=list)
+    current: Optional[str] = None
+    started: float = 0.0
+    finished: float = 0.0
+    cancel_requested: bool = False
+    task: Optional["asyncio.Task[None]"] = None
+    proc: Optional[asyncio.subprocess.Process] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        end = self.finished or time.time()
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "done": self.status not in ("queued", "running"),
+            "ok": self.status == "ok",
+            "cmds": self.cmds,
+            "current": self.current,
+            "elapsed_sec": round(end - self.started, 3) if self.started else 0.0,
+            "results": self.results,
+        }
+
+
+class CommandRunner:
+    """
+    Registry of command jobs for one process. start() must be called from
+    the event loop that will run the job.
+    """
+
+    def __init__(self) -> None:
+        self.jobs: Dict[str, RunJob] = {}
+
+    def get(self, job_id: str) -> Optional[RunJob]:
+        return self.jobs.get(job_id)
+
+    def start(
+        self,
+        cmds: List[str],
+        cwd: Path,
+        on_output: Callable[[str], None],
+        timeout: Optional[float] = None,
+        memory_mb: int = 0,
+        stop_on_fail: bool = True,
+        capture_chars: int = 100_000,
+    ) -> RunJob:
+        job = RunJob(id=uuid.uuid4().hex[:12], cmds=list(cmds))
+        self.jobs[job.id] = job
+        self._prune()
+        job.task = asyncio.get_running_loop().create_task(
+            self._run_job(job, cwd, on_output, timeout, memory_mb, stop_on_fail, capture_chars)
+        )
+        return job
+
+    async def wait(self, job: RunJob) -> RunJob:
+        if job.task is not None:
+            await asyncio.shield(job.task)
+        return job
+
+    async def cancel(self, job_id: str) -> Optional[RunJob]:
+        job = self.jobs.get(job_id)
+        if job is None or job.status not in ("queued", "running"):
+            return job
+        job.cancel_requested = True
+        if job.proc is not None:
+            await self._kill(job.proc)
+        if job.task is not None:
+            await asyncio.wait({job.task}, timeout=_KILL_GRACE_SEC)  # report the settled status
+        return job
+
+    def _prune(self) -> None:
+        done = [j for j in self.jobs.values() if j.status not in ("queued", "running")]
+        for j in sorted(done, key=lambda j: j.finished)[: max(0, len(self.jobs) - _MAX_JOBS)]:
+            self.jobs.pop(j.id, None)
+
+    # ----------------------------
+    # Execution
+    # ----------------------------
+
+    async def _run_job(self, job: RunJob, cwd: Path, on_output: Callable[[str], None], timeout: Optional[float],
+                       memory_mb: int, stop_on_fail: bool, capture_chars: int) -> None:
+        job.status = "running"
+        job.started = time.time()
+        try:
+            for cmd in job.cmds:
+                if job.cancel_requested:
+                    break
+                job.current = cmd
+                on_output(f"[{time.strftime('%H:%M:%S')}] $ {cmd}\n")
+                res = await self._run_one(job, cmd, cwd, on_output, timeout, memory_mb, capture_chars)
+                job.results.append(res)
+                on_output(f"[{time.strftime('%H:%M:%S')}] exit={res['returncode']} elapsed={res['elapsed_sec']}s"
+                          + (f" ({res['ended']})" if res["ended"] != "exited" else "") + "\n")
+                if res["returncode"] != 0 and stop_on_fail:
+                    break
+        except Exception as e:  # spawn failure etc.
+            on_output(f"[{time.strftime('%H:%M:%S')}] runner error: {e}\n")
+            job.results.append({"cmd": job.current, "returncode": -1, "ended": "error", "error": str(e),
+                                "elapsed_sec": 0.0, "stdout": "", "stderr": ""})
+        finally:
+            job.current = None
+            job.proc = None
+            job.finished = time.time()
+            ends = [r.get("ended") for r in job.results]
+            if job.cancel_requested:
+                job.status = "cancelled"
+            elif "timeout" in ends:
+                job.status = "timeout"
+            elif any(r.get("returncode") != 0 for r in job.results):
+                job.status = "failed"
+            else:
+                job.status = "ok"
+
+    async def _run_one(self, job: RunJob, cmd: str, cwd: Path, on_output: Callable[[str], None],
+                       timeout: Optional[float], memory_mb: int, capture_chars: int) -> Dict[str, Any]:
+        t0 = time.time()
+        kwargs: Dict[str, Any] = {}
+        if _IS_POSIX:
+            kwargs["start_new_session"] = True  # own process group: kill takes the children too
+            pre = _limit_memory(memory_mb)
+            if pre is not None:
+                kwargs["preexec_fn"] = pre
+        elif sys.platform == "win32":
+            import subprocess
+            kwargs["creationflags"] = subprocess.CREATE_NEW_PROCESS_GROUP
+
+        proc = await asyncio.create_subprocess_shell(
+            cmd, cwd=str(cwd), stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE, **kwargs
+        )
+        job.proc = proc
+        captured = {"stdout": [], "stderr": []}
+        sizes = {"stdout": 0, "stderr": 0}
+
+        def keep(name: str, text: str) -> None:
+            buf = captured[name]
+            buf.append(text)
+            sizes[name] += len(text)
+            while sizes[name] > capture_chars and len(buf) > 1:
+                sizes[name] -= len(buf.pop(0))
+
+        async def pump(stream: Optional[asyncio.StreamReader], name: str) -> None:
+            if stream is None:
+                return
+            pending = b""
+            while True:
+                chunk = await stream.read(_CHUNK)
+                if not chunk:
+                    break
+                pending += chunk
+                cut = pending.rfind(b"\n")
+                if cut < 0 and len(pending) < _CHUNK:
+                    continue  # wait for the end of the line
+                if cut < 0:
+                    cut = len(pending) - 1  # very long line: emit what we have
+                text = pending[:cut + 1].decode("utf-8", errors="replace")
+                pending = pending[cut + 1:]
+                keep(name, text)
+                on_output(text)
+            if pending:
+                text = pending.decode("utf-8", errors="replace") + "\n"
+                keep(name, text)
+                on_output(text)
+
+        ended = "exited"
+        # shielded: on timeout the pumps keep draining what the killed process left
+        running = asyncio.gather(pump(proc.stdout, "stdout"), pump(proc.stderr, "stderr"), proc.wait())
+        try:
+            await asyncio.wait_for(asyncio.shield(running), timeout=timeout or None)
+        except asyncio.TimeoutError:
+            ended = "timeout"
+            on_output(f"[{time.strftime('%H:%M:%S')}] timeout after {timeout}s, stopping\n")
+            await self._kill(proc)
+        finally:
+            if not running.done():
+                await self._kill(proc)
+                try:
+                    await asyncio.wait_for(asyncio.shield(running), timeout=_KILL_GRACE_SEC)
+                except (asyncio.TimeoutError, asyncio.CancelledError):
+                    running.cancel()  # a detached child still holds the pipe
+        if job.cancel_requested and ended == "exited":
+            ended = "cancelled"
+
+        return {
+            "cmd": cmd,
+            "returncode": proc.returncode,
+            "ended": ended,
+            "elapsed_sec": round(time.time() - t0, 3),
+            "stdout": "".join(captured["stdout"]),
+            "stderr": "".join(captured["stderr"]),
+        }
+
+    @staticmethod
+    async def _kill(proc: asyncio.subprocess.Process) -> None:
+        """
+        SIGTERM to the process group, SIGKILL to whatever is left of the
+        group after the grace period.
+        """
+        if not _IS_POSIX:
+            if proc.returncode is None:
+                try:
+                    proc.kill()
+                except OSError:
+                    return
+                try:
+                    await asyncio.wait_for(proc.wait(), timeout=_KILL_GRACE_SEC)
+                except asyncio.TimeoutError:
+                    pass
+            return
+        # signal the group even if the shell exited; its children may not have
+        try:
+            os.killpg(proc.pid, signal.SIGTERM)
+        except OSError:
+            return  # group already gone
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + _KILL_GRACE_SEC
+        try:
+            await asyncio.wait_for(proc.wait(), timeout=_KILL_GRACE_SEC)
+        except asyncio.TimeoutError:
+            pass
+        # the shell exiting says nothing about the rest of the group
+        while loop.time() < deadline:
+            try:
+                os.killpg(proc.pid, 0)
+            except OSError:
+                return  # every process of the group has exited
+            await asyncio.sleep(0.05)
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except OSError:
+            return
+        try:
+            await asyncio.wait_for(proc.wait(), timeout=_KILL_GRACE_SEC)
+        except asyncio.TimeoutError:
+            pass
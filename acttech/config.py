@@ -1,7 +1,7 @@
 from __future__ import annotations
 
 from dataclasses import dataclass, field
-from typing import Set
+from typing import List, Set
 
 @dataclass
 class Settings:
@@ -13,6 +13,24 @@ class Settings:
     # Put your key here OR leave empty and set environment variable OPENAI_API_KEY
     OPENAI_API_KEY: str = ""
     MODEL: str = "gpt-5"
+    # Optional API base URL, e.g. "http://127.0.0.1:8799/v1" for mock_llm_server.py
+    OPENAI_BASE_URL: str = ""
+    # Stream the planner response (AsyncOpenAI) and log progress as it arrives
+    PLANNER_STREAM: bool = True
+    # Reuse plans for identical requests (same model/instructions/schema/prompt).
+    # Stored in STATE_DIR/plan_cache; bypass per request with {"no_cache": true}.
+    PLAN_CACHE: bool = True
+    PLAN_CACHE_MAX_AGE_SEC: int = 7 * 24 * 3600
+    PLAN_CACHE_MAX_MB: float = 20
+    # Planner attempts (first call + fragment repairs), with jittered exponential backoff
+    PLANNER_MAX_ATTEMPTS: int = 4
+    PLANNER_BACKOFF_BASE_SEC: float = 0.25
+    PLANNER_BACKOFF_MAX_SEC: float = 4.0
+    # >1: plan N candidates concurrently, dry-run each and keep the valid one
+    # with the fewest changed lines (override per request: {"candidates": N}).
+    PLANNER_CANDIDATES: int = 1
+    # Optional per-candidate temperatures (leave empty for reasoning models)
+    PLANNER_CANDIDATE_TEMPERATURES: List[float] = field(default_factory=list)
 
     # ===== WEB UI =====
     WEB_HOST: str = "127.0.0.1"
@@ -25,6 +43,21 @@ class Settings:
     MAX_FILES_TO_SHOW: int = 10
     MAX_CHARS_PER_FILE: int = 6000
     MAX_TOTAL_CONTEXT_CHARS: int = 26000
+    # Token budget for file snippets (0 = derive from MAX_TOTAL_CONTEXT_CHARS).
+    # Counted with tiktoken when installed, else len/CHARS_PER_TOKEN.
+    MAX_CONTEXT_TOKENS: int = 8000
+    CHARS_PER_TOKEN: float = 3.6
+    # Large code files are offered as goal-ranked symbol chunks (def/class/block)
+    # instead of head+tail peeks; chunks longer than this are split.
+    SNIPPET_MAX_CHUNK_LINES: int = 120
+    SNIPPET_MAX_CHUNKS: int = 6
+    # Prefix snippet lines with "  12| " so line-range ops can be planned.
+    SNIPPET_LINE_NUMBERS: bool = True
+    # Weight of the BM25 content match (search index) vs. path heuristics
+    BM25_WEIGHT: float = 20.0
+    # Import-neighbor expansion: how many hops, and whether importers count too
+    IMPORT_HOPS: int = 2
+    IMPORT_REVERSE: bool = True
 
     # ===== SCAN RULES =====
     IGNORE_DIRS: Set[str] = field(default_factory=lambda: {
@@ -40,6 +73,61 @@ class Settings:
 
     MAX_FILE_MB: int = 2
 
+    # Reuse entries of unchanged files (same size/mtime/inode) from the last scan
+    SCAN_CACHE: bool = True
+    # "auto" = use the git index on git checkouts (only dirty/untracked files are read), "git", "walk"
+    SCAN_BACKEND: str = "auto"
+    # Parallel scan: 0 = auto, 1 = serial
+    SCAN_WORKERS: int = 0
+    # >0 moves symbol extraction to a process pool of this size (CPU-bound)
+    SCAN_SYMBOL_PROCESSES: int = 0
+
+    # ===== LIVE WATCHER =====
+    # Keeps the repo map up to date in the background; /api/scan then only
+    # re-reads files that changed. Backend: "auto" (inotify on Linux), "inotify", "poll"
+    WATCH_REPO: bool = True
+    WATCH_BACKEND: str = "auto"
+    WATCH_DEBOUNCE_SEC: float = 0.3
+    WATCH_POLL_SEC: float = 2.0
+
+    # ===== APPLY =====
+    # All-or-nothing multi-file apply: new contents are staged as temp files
+    # next to their targets and committed together with os.replace(); any
+    # failure (bad op, conflict, write error) leaves the repo untouched.
+    # Skipped entries (missing/unsafe path, file not found) do not abort.
+    APPLY_TRANSACTIONAL: bool = True
+    # Threads computing new contents + diffs per file (1 = serial)
+    APPLY_WORKERS: int = 8
+    # Files changed since the last scan: "rebase" (content-matched ops run on
+    # the current text, line-range ops conflict), "reject" or "ignore"
+    APPLY_CONFLICT_POLICY: str = "rebase"
+
+    # ===== BACKUPS =====
+    # Apply backups are content-addressed blobs in BACKUP_DIR/objects shared
+    # by all runs; each run is a manifest in BACKUP_DIR/runs. Older runs past
+    # BACKUP_KEEP_RUNS are dropped after each apply (0 = keep all).
+    BACKUP_COMPRESS: bool = True
+    BACKUP_KEEP_RUNS: int = 20
+
+    # ===== RUN COMMANDS (/api/run, /api/run_plan) =====
+    # Per-command limits: timeout in seconds (0 = none) and, on POSIX, an
+    # address-space cap in MB (0 = none; node/JVM reserve a lot of virtual
+    # memory, so leave headroom when setting it)
+    RUN_TIMEOUT_SEC: float = 900
+    RUN_MEMORY_MB: int = 0
+    STOP_ON_RUN_FAIL: bool = True
+
+    # ===== WEB APP STATE =====
+    # State JSON (diff, patches, apply log) is served from memory; writes go
+    # to STATE_DIR this many seconds later, batched (0 = write immediately)
+    STATE_WRITE_BEHIND_SEC: float = 0.25
+    # Worker threads for scan/diff/plan/apply jobs. Jobs for the same repo
+    # still run one at a time; more workers only help with several repos
+    JOB_WORKERS: int = 2
+    # Sidebar file list: without the watcher, re-walked in the background
+    # once it is older than this (scans, saves and applies refresh it too)
+    FILE_INDEX_MAX_AGE_SEC: float = 30
+
     # ===== OUTPUT DIRS (created inside REPO_ROOT) =====
     STATE_DIR: str = ".autoupdater_state"
     BACKUP_DIR: str = ".autoupdater_backups"
@@ -1,11 +1,17 @@
 # context_builder.py (REPLIT-LIKE++ IMPROVED)
 from __future__ import annotations
 
+import math
 import re
+from functools import lru_cache
 from pathlib import Path
 from typing import Dict, Any, List, Tuple, Set, Optional
 
 from config import SETTINGS
+from search_index import bm25_scores
+from import_graph import ImportGraph
+from context_pack import Snippet, pack_snippets, budget_report
+from snippets import chunk_file, rank_chunks, render_chunks, render_lines
 
 # ----------------------------
 # Heuristics / constants
@@ -42,12 +48,6 @@ _RUNFILES_HINTS = [
 _CORE_DIR_BONUS = ("/src/", "/app/", "/api/", "/server/", "/backend/", "/frontend/", "/web/")
 _PENALTY_DIRS = ("/tests/", "/test/", "/migrations/", "/dist/", "/build/", "/.next/", "/node_modules/")
 
-# Regex for imports (Python + JS/TS)
-_RE_PY_FROM = re.compile(r"^\s*from\s+([a-zA-Z0-9_\.]+)\s+import\s+", re.MULTILINE)
-_RE_PY_IMPORT = re.compile(r"^\s*import\s+([a-zA-Z0-9_\.]+)", re.MULTILINE)
-_RE_JS_IMPORT = re.compile(r"^\s*import\s+.*?\s+from\s+['\"]([^'\"]+)['\"]", re.MULTILINE)
-_RE_JS_REQ = re.compile(r"require\(\s*['\"]([^'\"]+)['\"]\s*\)", re.MULTILINE)
-
 # ----------------------------
 # Utilities
 # ----------------------------
@@ -87,13 +87,7 @@ def _read_text(repo_root: Path, rel_path: str) -> str:
         return ""
 
 
-def _read_snippet(repo_root: Path, rel_path: str, max_chars: int) -> str:
-    """
-    Replit-like peek:
-    - small file => full
-    - large file => head+tail
-    """
-    txt = _read_text(repo_root, rel_path)
+def _head_tail(txt: str, max_chars: int) -> str:
     if not txt:
         return ""
     if len(txt) <= max_chars:
@@ -158,22 +152,63 @@ def _score_path(rel: str, goal_tokens: List[str]) -> float:
     return s
 
 
+_WORD_CHARS = frozenset("abcdefghijklmnopqrstuvwxyz0123456789_")
+
+
+@lru_cache(maxsize=256)
+def _goal_matcher(goal_tokens: Tuple[str, ...]) -> Tuple["re.Pattern[str]", Dict[str, Tuple[str, ...]]]:
+    """
+    Compiled once per goal and reused across requests:
+    - one lookahead alternation (longest tokens first), so a single scan
+      reports the longest token starting at each position
+    - for each token, the goal tokens that are prefixes of it (they match at
+      the same position too)
+    """
+    toks = sorted(set(goal_tokens), key=len, reverse=True)
+    rx = re.compile("(?=(" + "|".join(re.escape(t) for t in toks) + "))")
+    prefixes = {t: tuple(p for p in toks if t.startswith(p)) for t in toks}
+    return rx, prefixes
+
+
 def _score_content(text: str, goal_tokens: List[str]) -> float:
     """
     Cheap content scoring with word-boundary-ish matching.
+    Single pass over the text for all tokens; counts match per-token
+    non-overlapping findall/count semantics.
+    (One lower() is kept on purpose: it is far cheaper than a re.IGNORECASE scan.)
     """
     if not text or not goal_tokens:
         return 0.0
+    rx, prefixes = _goal_matcher(tuple(goal_tokens))
     lo = text.lower()
+    n = len(lo)
+    word = _WORD_CHARS
+
+    hits: Dict[str, int] = {}
+    subs: Dict[str, int] = {}
+    hit_end: Dict[str, int] = {}
+    sub_end: Dict[str, int] = {}
+    for m in rx.finditer(lo):
+        s = m.start()
+        left_ok = s == 0 or lo[s - 1] not in word
+        for t in prefixes[m.group(1)]:
+            e = s + len(t)
+            if s >= sub_end.get(t, 0):
+                subs[t] = subs.get(t, 0) + 1
+                sub_end[t] = e
+            if left_ok and s >= hit_end.get(t, 0) and (e == n or lo[e] not in word):
+                hits[t] = hits.get(t, 0) + 1
+                hit_end[t] = e
+
     score = 0.0
     for t in goal_tokens:
         # treat tokens like identifiers; cap contribution
-        hits = len(re.findall(rf"(?<![a-z0-9_]){re.escape(t)}(?![a-z0-9_])", lo))
-        if hits:
-            score += min(10, hits) * 1.4
+        h = hits.get(t, 0)
+        if h:
+            score += min(10, h) * 1.4
         else:
             # fallback substring count (less weight)
-            sub = lo.count(t)
+            sub = subs.get(t, 0)
             if sub:
                 score += min(6, sub) * 0.6
     return score
@@ -256,95 +291,38 @@ def _detect_entrypoints(all_files: List[str]) -> List[str]:
     return out[:6]
 
 
-def _resolve_python_module_to_path(module: str, all_set: Set[str]) -> List[str]:
-    """
-    Map 'foo.bar' to possible repo file paths:
-      foo/bar.py
-      foo/bar/__init__.py
-    """
-    mod = module.strip().lstrip(".")
-    if not mod:
-        return []
-    parts = mod.split(".")
-    candidates = []
-    candidates.append("/".join(parts) + ".py")
-    candidates.append("/".join(parts) + "/__init__.py")
-
-    # only keep if exists
-    return [c for c in candidates if c in all_set]
-
-
-def _resolve_js_import_to_paths(spec: str, rel_from: str, all_set: Set[str]) -> List[str]:
-    """
-    Resolve relative JS imports like './utils' from 'src/app.ts'
-    Try extensions and index files.
-    """
-    s = spec.strip()
-    if not s.startswith("."):
-        return []  # ignore npm packages
-
-    base_dir = str(Path(rel_from).parent).replace("\\", "/")
-    raw = str((Path(base_dir) / s).as_posix())
-
-    # try direct
-    cand = []
-    for ext in (".ts", ".tsx", ".js", ".jsx", ".json"):
-        cand.append(raw + ext)
-    cand.append(raw + "/index.ts")
-    cand.append(raw + "/index.tsx")
-    cand.append(raw + "/index.js")
-    cand.append(raw + "/index.jsx")
-
-    return [c for c in cand if c in all_set]
-
-
 def _expand_neighbors_by_imports(
     repo_root: Path,
     chosen: List[str],
     all_files: List[str],
     meta: Dict[str, Dict[str, Any]],
-    max_new: int = 10
+    max_new: int = 10,
+    graph: Optional[ImportGraph] = None
 ) -> List[str]:
     """
     Replit-like: open a file, then also pull its “neighbors” (local imports).
     This dramatically improves patch quality because the LLM sees the referenced helpers.
+    Neighbors come from the cached import graph (see import_graph.py):
+    up to IMPORT_HOPS away, optionally including importers, nearest and most
+    central first.
     """
-    all_set = set(all_files)
-    added: List[str] = []
-    seen = set(chosen)
+    if graph is None:
+        graph = ImportGraph.load(repo_root, all_files)
+    hops = int(getattr(SETTINGS, "IMPORT_HOPS", 2))
+    reverse = bool(getattr(SETTINGS, "IMPORT_REVERSE", True))
 
-    def maybe_add(p: str):
-        if p in seen:
-            return
-        if not _is_text_allowed(p):
-            return
+    added: List[str] = []
+    for p, _dist in graph.neighbors(chosen, hops=hops, reverse=reverse):
+        if len(added) >= max_new:
+            break
+        if p in chosen or not _is_text_allowed(p):
+            continue
         # avoid huge files unless small-ish
         m = meta.get(p, {})
         if int(m.get("lines", 0)) > 2500:
-            return
-        seen.add(p)
+            continue
         added.append(p)
 
-    for rel in chosen:
-        if len(added) >= max_new:
-            break
-        suf = _suffix(rel)
-        if suf == ".py":
-            txt = _read_text(repo_root, rel)
-            for mod in _RE_PY_FROM.findall(txt) + _RE_PY_IMPORT.findall(txt):
-                for p in _resolve_python_module_to_path(mod, all_set):
-                    maybe_add(p)
-                    if len(added) >= max_new:
-                        break
-        elif suf in (".js", ".jsx", ".ts", ".tsx"):
-            txt = _read_text(repo_root, rel)
-            specs = _RE_JS_IMPORT.findall(txt) + _RE_JS_REQ.findall(txt)
-            for spec in specs:
-                for p in _resolve_js_import_to_paths(spec, rel, all_set):
-                    maybe_add(p)
-                    if len(added) >= max_new:
-                        break
-
     return chosen + added
 
 
@@ -352,16 +330,23 @@ def _expand_neighbors_by_imports(
 # Selection
 # ----------------------------
 
-def choose_files_for_context(repo_map: Dict[str, Any], diff: Dict[str, Any], goal: str) -> List[str]:
+def choose_files_for_context(
+    repo_map: Dict[str, Any],
+    diff: Dict[str, Any],
+    goal: str,
+    content_scores: Optional[Dict[str, float]] = None
+) -> List[str]:
     """
     Replit-like selection pipeline:
     1) Always include changed files (modified/added)
     2) Always include likely entrypoints + run/config files
-    3) Score remaining by path relevance + (cheap) content relevance
+    3) Score every file by path relevance + content relevance (BM25 from the
+       repo index, see search_index.py; empty if no index yet)
     4) Expand neighbors via local imports
     """
     goal_tokens = _tokenize_goal(goal)
     meta = _file_meta_index(repo_map)
+    content_scores = content_scores or {}
 
     all_files = [f.get("path") for f in repo_map.get("files", []) if f.get("path")]
     all_files = [p.replace("\\", "/") for p in all_files if isinstance(p, str)]
@@ -395,35 +380,26 @@ def choose_files_for_context(repo_map: Dict[str, Any], diff: Dict[str, Any], goa
             runfiles2.append(p)
     runfiles = runfiles2[:6]
 
-    # 4) Score everything
-    scored: List[Tuple[float, str]] = []
-    for rel in all_files:
-        m = meta.get(rel, {})
-        s = _score_path(rel, goal_tokens) + _prefer_small(m)
-        scored.append((s, rel))
-    scored.sort(reverse=True, key=lambda x: x[0])
+    # 4) Score everything: path + size + normalized BM25 content relevance
+    bm25_weight = float(getattr(SETTINGS, "BM25_WEIGHT", 20.0))
+    top_content = max(content_scores.values(), default=0.0)
+    changed_set, entry_set, run_set = set(changed), set(entrypoints), set(runfiles)
 
-    # 5) Add content scoring for top candidates (cheap, bounded)
-    top_for_content = [r for _, r in scored[:120]]
     rescored: List[Tuple[float, str]] = []
-    for rel in top_for_content:
+    for rel in all_files:
         m = meta.get(rel, {})
         base = _score_path(rel, goal_tokens) + _prefer_small(m)
 
         # changed bump
-        if rel in changed:
+        if rel in changed_set:
             base += 15.0
-        if rel in entrypoints:
+        if rel in entry_set:
             base += 8.0
-        if rel in runfiles:
+        if rel in run_set:
             base += 6.0
 
-        # only scan content for reasonably sized files
-        size = int(m.get("size", 0))
-        if goal_tokens and size <= 140_000:
-            # NOTE: repo_root is not available here; content scoring will be done in build_llm_context phase
-            # We'll keep base as-is.
-            pass
+        if top_content > 0:
+            base += bm25_weight * content_scores.get(rel, 0.0) / top_content
 
         rescored.append((base, rel))
     rescored.sort(reverse=True, key=lambda x: x[0])
@@ -453,20 +429,95 @@ def choose_files_for_context(repo_map: Dict[str, Any], diff: Dict[str, Any], goa
 # Context builder
 # ----------------------------
 
+def _relevance(rel: str, txt: str, meta: Dict[str, Any], diff: Dict[str, Any], goal_tokens: List[str]) -> float:
+    base = _score_path(rel, goal_tokens) + _prefer_small(meta)
+
+    # changed bump
+    if rel in (diff.get("modified", []) or []):
+        base += 12.0
+    if rel in (diff.get("added", []) or []):
+        base += 10.0
+
+    size = int(meta.get("size", 0))
+    if goal_tokens and size <= 140_000:
+        base += _score_content(txt, goal_tokens)
+    return base
+
+
+_CODE_EXT = (".py", ".js", ".jsx", ".ts", ".tsx")
+
+
+def _snippet_variants(
+    rel: str,
+    txt: str,
+    meta: Dict[str, Any],
+    value: float,
+    goal_tokens: List[str]
+) -> List[Snippet]:
+    """
+    Alternative views of one file for the packer:
+    - the whole file
+    - code: the top-k symbol chunks for the goal (see snippets.py), worth the
+      share of the file's goal relevance they carry
+    - other text: head+tail peeks of decreasing size, worth less as they show less
+    """
+    hdr = f"\n--- FILE: {rel} (lines={meta.get('lines','?')}, size={meta.get('size','?')}) ---\n"
+    lines = txt.splitlines(True)
+    out = [Snippet(rel, "full", hdr + render_lines(lines, 1, len(lines)) + "\n", value)]
+    if not txt or len(txt) <= SETTINGS.MAX_CHARS_PER_FILE // 2:
+        return out
+
+    if _suffix(rel) in _CODE_EXT:
+        chunks = chunk_file(rel, txt)
+        if len(chunks) > 1:
+            ranked = rank_chunks(chunks, lines, goal_tokens, _score_content)
+            weights = [c.score + 0.5 for c in ranked]
+            total = sum(weights)
+            max_k = int(getattr(SETTINGS, "SNIPPET_MAX_CHUNKS", 6))
+            for k in range(1, min(max_k, len(ranked) - 1) + 1):
+                top = ranked[:k]
+                covered = sum(c.end - c.start + 1 for c in top) / max(1, len(lines))
+                share = sum(weights[:k]) / total
+                text = hdr + f"[top {k} of {len(ranked)} symbols for the goal]\n" + render_chunks(top, lines) + "\n"
+                if len(text) >= len(out[0].text):
+                    break
+                out.append(Snippet(rel, f"symbols:{k}", text, value * (0.85 * share + 0.15 * covered)))
+            return out
+
+    for variant, max_chars in (("peek", SETTINGS.MAX_CHARS_PER_FILE), ("peek_small", SETTINGS.MAX_CHARS_PER_FILE // 2)):
+        if len(txt) <= max_chars:
+            break
+        coverage = max_chars / len(txt)
+        out.append(Snippet(rel, variant, hdr + _head_tail(txt, max_chars) + "\n", value * math.sqrt(coverage)))
+    return out
+
+
 def build_llm_context(
     repo_root: Path,
     repo_map: Dict[str, Any],
     diff: Dict[str, Any],
     goal: str
 ) -> Tuple[str, List[str]]:
+    text, chosen, _report = build_llm_context_with_report(repo_root, repo_map, diff, goal)
+    return text, chosen
+
+
+def build_llm_context_with_report(
+    repo_root: Path,
+    repo_map: Dict[str, Any],
+    diff: Dict[str, Any],
+    goal: str
+) -> Tuple[str, List[str], Dict[str, Any]]:
     """
     Replit-like LLM context:
     - Project Overview
     - Run/Entrypoint hint
     - Diff summary
     - Selected files list (like tabs)
-    - Snippets with “peek” head+tail
+    - Snippets (whole files or goal-ranked symbol chunks with line numbers)
+      packed into a token budget (see context_pack.py)
     - Neighbor expansion via imports (local)
+    Also returns the per-file budget report.
     """
     meta = _file_meta_index(repo_map)
     all_files = [f.get("path") for f in repo_map.get("files", []) if f.get("path")]
@@ -475,30 +526,18 @@ def build_llm_context(
 
     goal_tokens = _tokenize_goal(goal)
 
-    # Base selection (path-based)
-    chosen = choose_files_for_context(repo_map, diff, goal)
+    # Base selection (path + indexed content relevance over all files)
+    content_scores = bm25_scores(repo_root, goal_tokens)
+    chosen = choose_files_for_context(repo_map, diff, goal, content_scores=content_scores)
 
     # Re-score chosen using real content now (bounded)
-    rescored: List[Tuple[float, str]] = []
+    texts: Dict[str, str] = {}
+    relevance: Dict[str, float] = {}
     for rel in chosen:
-        m = meta.get(rel, {})
-        base = _score_path(rel, goal_tokens) + _prefer_small(m)
-
-        # changed bump
-        if rel in (diff.get("modified", []) or []):
-            base += 12.0
-        if rel in (diff.get("added", []) or []):
-            base += 10.0
-
-        size = int(m.get("size", 0))
-        if goal_tokens and size <= 140_000:
-            txt = _read_text(repo_root, rel)
-            base += _score_content(txt, goal_tokens)
-
-        rescored.append((base, rel))
+        texts[rel] = _read_text(repo_root, rel)
+        relevance[rel] = _relevance(rel, texts[rel], meta.get(rel, {}), diff, goal_tokens)
 
-    rescored.sort(reverse=True, key=lambda x: x[0])
-    chosen = [r for _, r in rescored][: SETTINGS.MAX_FILES_TO_SHOW]
+    chosen = sorted(chosen, key=lambda r: relevance[r], reverse=True)[: SETTINGS.MAX_FILES_TO_SHOW]
 
     # Import neighbor expansion (very Replit-like)
     chosen = _expand_neighbors_by_imports(
@@ -508,6 +547,10 @@ def build_llm_context(
         meta=meta,
         max_new=12,
     )
+    for rel in chosen:
+        if rel not in relevance:
+            texts[rel] = _read_text(repo_root, rel)
+            relevance[rel] = _relevance(rel, texts[rel], meta.get(rel, {}), diff, goal_tokens)
 
     # Compact repo list (sidebar-like)
     short_list = all_files[:300]
@@ -545,25 +588,31 @@ def build_llm_context(
     parts.append("- Use minimal edits: replace_range / replace_text / insert_after / insert_before.")
     parts.append("- If the goal is unclear or unsafe, output {\"files\": []}.")
     parts.append("- Do NOT invent filenames, folders, dependencies, or commands.")
+    parts.append("- Snippet lines are prefixed with their line number (`  12| `); the prefix is not part of the file.")
+    parts.append("- Use those line numbers for replace_range / delete_range.")
     parts.append("")
 
     parts.append("=== OPEN FILES (selected for context) ===")
     parts.append("\n".join(chosen))
     parts.append("")
 
-    # File snippets (tabs-like)
-    total = 0
-    parts.append("=== FILE SNIPPETS (peek) ===")
-    for rel in chosen:
-        m = meta.get(rel, {})
-        hdr = f"\n--- FILE: {rel} (lines={m.get('lines','?')}, size={m.get('size','?')}) ---\n"
-        snippet = _read_snippet(repo_root, rel, SETTINGS.MAX_CHARS_PER_FILE)
-        chunk = hdr + (snippet or "") + "\n"
-
-        if total + len(chunk) > SETTINGS.MAX_TOTAL_CONTEXT_CHARS:
-            parts.append("\n[CONTEXT BUDGET HIT: remaining files omitted]\n")
-            break
-        parts.append(chunk)
-        total += len(chunk)
+    # File snippets (tabs-like), packed by relevance into the token budget
+    budget = int(getattr(SETTINGS, "MAX_CONTEXT_TOKENS", 0) or 0)
+    if budget <= 0:
+        budget = int(SETTINGS.MAX_TOTAL_CONTEXT_CHARS / 3.6)
+    groups = [
+        _snippet_variants(rel, texts.get(rel, ""), meta.get(rel, {}), max(1.0, relevance.get(rel, 0.0)), goal_tokens)
+        for rel in chosen
+    ]
+    picked, used = pack_snippets(groups, budget)
+    report = budget_report(groups, picked, budget, used)
 
-    return "\n".join(parts), chosen
+    parts.append("=== FILE SNIPPETS (peek) ===")
+    for s in picked:
+        if s is not None:
+            parts.append(s.text)
+    omitted = [g[0].path for g, s in zip(groups, picked) if g and s is None]
+    if omitted:
+        parts.append("\n[CONTEXT BUDGET HIT: omitted " + ", ".join(omitted) + "]\n")
+
+    return "\n".join(parts), chosen, report
@@ -0,0 +1,152 @@
+from __future__ import annotations
+
+import math
+from dataclasses import dataclass
+from typing import Dict, Any, List, Optional, Tuple
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None  # optional: falls back to a chars-per-token estimate
+
+from config import SETTINGS
+
+
+# ----------------------------
+# Token counting
+# ----------------------------
+
+_ENCODER: Any = None
+_ENCODER_LOADED = False
+
+
+def _encoder() -> Any:
+    global _ENCODER, _ENCODER_LOADED
+    if not _ENCODER_LOADED:
+        _ENCODER_LOADED = True
+        if tiktoken is not None:
+            for name in ("o200k_base", "cl100k_base"):
+                try:
+                    _ENCODER = tiktoken.get_encoding(name)
+                    break
+                except Exception:
+                    # encoding files may be unavailable offline
+                    continue
+    return _ENCODER
+
+
+def tokenizer_name() -> str:
+    enc = _encoder()
+    return enc.name if enc is not None else f"estimate({_chars_per_token()} chars/token)"
+
+
+def _chars_per_token() -> float:
+    # ~3.6 chars/token is typical for source code with GPT-4o-class tokenizers
+    return max(1.0, float(getattr(SETTINGS, "CHARS_PER_TOKEN", 3.6)))
+
+
+def count_tokens(text: str) -> int:
+    if not text:
+        return 0
+    enc = _encoder()
+    if enc is not None:
+        return len(enc.encode(text, disallowed_special=()))
+    return int(math.ceil(len(text) / _chars_per_token()))
+
+
+# ----------------------------
+# Candidates + knapsack
+# ----------------------------
+
+@dataclass
+class Snippet:
+    """
+    One way of showing (part of) a file. Snippets of the same file are
+    alternatives: at most one per file is packed.
+    """
+    path: str
+    variant: str
+    text: str
+    value: float
+    tokens: int = 0
+
+
+def pack_snippets(
+    groups: List[List[Snippet]],
+    budget_tokens: int
+) -> Tuple[List[Optional[Snippet]], int]:
+    """
+    Multiple-choice knapsack: choose at most one snippet per group so the
+    summed value is maximal and the summed tokens fit the budget.
+    Returns (choice per group, tokens used).
+    """
+    for g in groups:
+        for s in g:
+            if not s.tokens:
+                s.tokens = count_tokens(s.text)
+
+    budget_tokens = max(0, int(budget_tokens))
+    # keep the DP table small: weights are rounded up to `unit` tokens
+    unit = max(1, budget_tokens // 2000)
+    cap = budget_tokens // unit
+
+    neg = float("-inf")
+    best = [0.0] + [neg] * cap
+    picks: List[List[int]] = []
+
+    for g in groups:
+        nxt = list(best)
+        pick = [-1] * (cap + 1)
+        for si, s in enumerate(g):
+            w = int(math.ceil(s.tokens / unit))
+            if w > cap or s.value <= 0:
+                continue
+            for c in range(cap, w - 1, -1):
+                prev = best[c - w]
+                if prev == neg:
+                    continue
+                v = prev + s.value
+                if v > nxt[c]:
+                    nxt[c] = v
+                    pick[c] = si
+        best = nxt
+        picks.append(pick)
+
+    # backtrack from the best reachable capacity
+    c = max(range(cap + 1), key=lambda i: best[i])
+    chosen: List[Optional[Snippet]] = [None] * len(groups)
+    for gi in range(len(groups) - 1, -1, -1):
+        si = picks[gi][c]
+        if si >= 0:
+            s = groups[gi][si]
+            chosen[gi] = s
+            c -= int(math.ceil(s.tokens / unit))
+
+    used = sum(s.tokens for s in chosen if s is not None)
+    return chosen, used
+
+
+def budget_report(
+    groups: List[List[Snippet]],
+    chosen: List[Optional[Snippet]],
+    budget_tokens: int,
+    used: int
+) -> Dict[str, Any]:
+    files = []
+    for g, s in zip(groups, chosen):
+        if not g:
+            continue
+        files.append({
+            "path": g[0].path,
+            "variant": s.variant if s is not None else "omitted",
+            "tokens": s.tokens if s is not None else 0,
+            "largest_variant_tokens": max(x.tokens for x in g),
+            "value": round(s.value, 3) if s is not None else 0.0,
+            "budget_share": round((s.tokens / budget_tokens) if (s is not None and budget_tokens) else 0.0, 4),
+        })
+    return {
+        "tokenizer": tokenizer_name(),
+        "budget_tokens": budget_tokens,
+        "used_tokens": used,
+        "files": files,
+    }
@@ -0,0 +1,336 @@
+from __future__ import annotations
+
+import operator
+import os
+import re
+import threading
+import time
+from bisect import bisect_left
+from collections import OrderedDict
+from itertools import compress, repeat
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from config import SETTINGS
+from repo_scan import is_scannable_rel
+
+
+# ----------------------------
+# Cached file listing + fuzzy search
+# ----------------------------
+#
+# The sidebar listing is a sorted list of repo-relative text file paths kept
+# in memory. It is built by one walk and then kept current by:
+#   - the repo watcher (apply_changes() is registered as its listener)
+#   - scans, saves and applies (web_app calls rebuild()/apply_changes())
+#   - without a watcher, a walk in the background once the list is older
+#     than FILE_INDEX_MAX_AGE_SEC (the stale list is served meanwhile)
+#
+# search() ranks paths fuzzily: every space-separated term must match as a
+# subsequence. Candidates are filtered with one regex per term run through
+# map()/compress() (no Python code per non-matching path), narrowing the
+# previous query's candidates while the user types; only candidates are
+# scored. A term scores highest as a substring of the file name, then as
+# a substring elsewhere, then as a subsequence, with bonuses for matches at
+# segment starts (after / _ - . or a camelCase hump) and for consecutive
+# characters. Ranked results are cached per (index version, query), so
+# paging through one query scores it once.
+
+_SEGMENT_SEPS = "/_-. "
+_RESULT_CACHE = 16
+_MAX_SCORED = 5000  # broad queries (1-2 chars): beyond this, only the order is approximate
+
+
+def walk_repo_files(root: Path) -> List[str]:
+    out: List[str] = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [d for d in dirnames if d not in SETTINGS.IGNORE_DIRS]
+        for fn in filenames:
+            if Path(fn).suffix.lower() in SETTINGS.TEXT_EXT:
+                out.append((Path(dirpath) / fn).relative_to(root).as_posix())
+    out.sort()
+    return out
+
+
+def _boundary(path: str, k: int) -> bool:
+    if k == 0 or path[k - 1] in _SEGMENT_SEPS:
+        return True
+    return path[k - 1].islower() and path[k].isupper()
+
+
+def _score_term(term: str, path: str, low: str, base: int, positions: Optional[List[int]] = None) -> Optional[int]:
+    """
+    Score of one lowercase term in path, or None if it does not match. low
+    is path.lower(); base is where the file name starts. Matched character
+    positions are appended to positions when given (only done for the page
+    being returned).
+    """
+    n = len(term)
+    i = low.find(term, base)
+    if i >= 0:
+        score = 100 + 8 * n
+        if i == base:
+            score += 40
+            if len(low) - base == n or low.startswith(".", base + n):
+                score += 20  # whole file name (with or without extension)
+    else:
+        i = low.find(term)
+        if i < 0:
+            return _score_subsequence(term, path, low, base, positions)
+        score = 60 + 6 * n + (20 if _boundary(path, i) else 0)
+    if positions is not None:
+        positions.extend(range(i, i + n))
+    return score
+
+
+def _score_subsequence(term: str, path: str, low: str, base: int, positions: Optional[List[int]]) -> Optional[int]:
+    # leftmost match inside the file name if there is one, else in the whole path
+    pos: List[int] = []
+    for start in ((base, 0) if base else (0,)):
+        pos.clear()
+        k = start - 1
+        for ch in term:
+            k = low.find(ch, k + 1)
+            if k < 0:
+                break
+            pos.append(k)
+        else:
+            break
+    else:
+        return None
+    score = 30 if pos[0] >= base else 0  # all of it inside the file name
+    prev = -2
+    for k in pos:
+        score += 3 if k >= base else 1
+        if k == 0 or path[k - 1] in _SEGMENT_SEPS or (path[k - 1].islower() and path[k].isupper()):
+            score += 6
+        if k == prev + 1:
+            score += 4
+        elif prev >= 0:
+            score -= min(3, k - prev - 1)
+        prev = k
+    if positions is not None:
+        positions.extend(pos)
+    return score
+
+
+def _subsequence_re(term: str) -> "re.Pattern[str]":
+    # "abc" -> [^a]*a[^b]*b[^c]*c, used with match(): takes the earliest
+    # occurrence of each char, so it is one linear pass per path
+    return re.compile("".join(f"[^{re.escape(ch)}]*{re.escape(ch)}" for ch in term))
+
+
+class FileIndex:
+    def __init__(self, repo_root: Path):
+        self.root = repo_root
+        self.max_age = float(getattr(SETTINGS, "FILE_INDEX_MAX_AGE_SEC", 30))
+        self.live = False  # a watcher keeps it current: no age-based walks
+        self.version = 0
+        self.source = ""
+        self._lock = threading.RLock()
+        self._paths: List[str] = []
+        self._built = 0.0  # monotonic time of the last full walk (0 = never)
+        self._stale = False
+        self._walking = False
+        self._lows: Tuple[int, List[str]] = (-1, [])  # (version, lowercased paths)
+        self._last: Tuple[int, str, List[int]] = (-1, "", [])  # (version, query, candidate ids)
+        self._results: "OrderedDict[Tuple[int, str], List[Tuple[int, int, int]]]" = OrderedDict()
+
+    # ----------------------------
+    # Updates
+    # ----------------------------
+
+    def rebuild(self, source: str = "walk") -> None:
+        paths = walk_repo_files(self.root)
+        with self._lock:
+            self._paths = paths
+            self._built = time.monotonic()
+            self._stale = False
+            self.source = source
+            self._changed()
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._stale = True
+
+    def apply_changes(self, paths: Optional[Iterable[str]], dirs: Iterable[str] = ()) -> None:
+        """
+        Re-checks the given paths (and everything under dirs) on disk.
+        paths=None marks the whole index stale instead.
+        """
+        if paths is None:
+            self.invalidate()
+            return
+        check: Set[str] = set(paths)
+        with self._lock:
+            for d in dirs:
+                prefix = d + "/"
+                lo = bisect_left(self._paths, prefix)
+                hi = bisect_left(self._paths, prefix + "\uffff")
+                check.update(self._paths[lo:hi])
+        for d in dirs:
+            if (self.root / d).is_dir():
+                check.update(f"{d}/{p}" for p in walk_repo_files(self.root / d))
+
+        changed = False
+        with self._lock:
+            for rel in check:
+                exists = is_scannable_rel(rel) and (self.root / rel).is_file()
+                i = bisect_left(self._paths, rel)
+                present = i < len(self._paths) and self._paths[i] == rel
+                if exists and not present:
+                    self._paths.insert(i, rel)
+                    changed = True
+                elif present and not exists:
+                    del self._paths[i]
+                    changed = True
+            if changed:
+                self._changed()
+
+    def _changed(self) -> None:
+        self.version += 1
+        self._results.clear()
+
+    # ----------------------------
+    # Reads
+    # ----------------------------
+
+    def _ensure_fresh(self) -> None:
+        with self._lock:
+            if not self._built:
+                self.rebuild()
+                return
+            old = not self.live and self.max_age > 0 and time.monotonic() - self._built > self.max_age
+            if not (self._stale or old) or self._walking:
+                return
+            self._walking = True
+
+        def walk() -> None:
+            try:
+                self.rebuild()
+            finally:
+                self._walking = False
+        threading.Thread(target=walk, name="file-index-walk", daemon=True).start()
+
+    def paths(self) -> List[str]:
+        self._ensure_fresh()
+        with self._lock:
+            return list(self._paths)
+
+    def __len__(self) -> int:
+        self._ensure_fresh()
+        return len(self._paths)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "files": len(self._paths),
+                "version": self.version,
+                "source": self.source,
+                "live": self.live,
+                "age_sec": round(time.monotonic() - self._built, 1) if self._built else None,
+                "stale": self._stale,
+            }
+
+    def _lowered(self) -> List[str]:
+        # caller holds the lock
+        if self._lows[0] != self.version:
+            self._lows = (self.version, [p.lower() for p in self._paths])
+        return self._lows[1]
+
+    def _candidates(self, terms: List[str]) -> List[int]:
+        """
+        Ids of paths containing every term as a subsequence. The per-path
+        regex runs through map/compress, so no Python code runs per path.
+        While typing, a query that extends the previous one only re-filters
+        that query's candidates.
+        """
+        lows = self._lowered()
+        query = " ".join(terms)
+        version, last_q, last_ids = self._last
+        if version == self.version and last_q and query.startswith(last_q):
+            ids: Iterable[int] = last_ids
+        else:
+            ids = range(len(lows))
+        for t in terms:
+            ids = list(compress(ids, map(_subsequence_re(t).match, map(lows.__getitem__, ids))))
+        ids = list(ids)
+        self._last = (self.version, query, ids)
+        return ids
+
+    def _ranked(self, terms: List[str]) -> List[Tuple[int, int, int]]:
+        """
+        (-score, path length, id) per match, best first. With more than
+        _MAX_SCORED candidates, those containing the longest term as a
+        substring are scored first and the unscored rest follows in path
+        order; the total stays exact.
+        """
+        # caller holds the lock
+        lows, paths = self._lowered(), self._paths
+        ids = self._candidates(terms)
+        rest: List[int] = []
+        if len(ids) > _MAX_SCORED:
+            longest = max(terms, key=len)
+            flags = list(map(str.__contains__, map(lows.__getitem__, ids), repeat(longest)))
+            ids = list(compress(ids, flags)) + list(compress(ids, map(operator.not_, flags)))
+            ids, rest = ids[:_MAX_SCORED], sorted(ids[_MAX_SCORED:])
+
+        ranked: List[Tuple[int, int, int]] = []
+        for i in ids:
+            path, low = paths[i], lows[i]
+            base = low.rfind("/") + 1
+            total = 0
+            for t in terms:
+                s = _score_term(t, path, low, base)
+                if s is None:
+                    break
+                total += s
+            else:
+                ranked.append((-total, len(low), i))
+        ranked.sort()
+        ranked.extend((0, len(lows[i]), i) for i in rest)
+        return ranked
+
+    def _hit(self, terms: List[str], neg_score: int, i: int) -> Dict[str, Any]:
+        path, low = self._paths[i], self._lowered()[i]
+        pos: List[int] = []
+        for t in terms:
+            _score_term(t, path, low, low.rfind("/") + 1, pos)
+        return {"path": path, "score": -neg_score, "positions": sorted(set(pos))}
+
+    def search(self, q: str, offset: int = 0, limit: int = 100) -> Dict[str, Any]:
+        """
+        One page of paths matching q, best first. Empty q pages through all
+        paths in order. Each result has path, score and the matched positions.
+        """
+        t0 = time.perf_counter()
+        self._ensure_fresh()
+        terms = [t for t in q.lower().split() if t]
+        offset, limit = max(0, offset), max(1, limit)
+        with self._lock:
+            if not terms:
+                page = [{"path": p, "score": 0, "positions": []} for p in self._paths[offset:offset + limit]]
+                total = len(self._paths)
+            else:
+                key = (self.version, " ".join(terms))
+                ranked = self._results.get(key)
+                if ranked is None:
+                    ranked = self._ranked(terms)
+                    self._results[key] = ranked
+                    while len(self._results) > _RESULT_CACHE:
+                        self._results.popitem(last=False)
+                else:
+                    self._results.move_to_end(key)
+                page = [self._hit(terms, s, i) for s, _, i in ranked[offset:offset + limit]]
+                total = len(ranked)
+            return {
+                "q": q,
+                "total": total,
+                "offset": offset,
+                "limit": limit,
+                "results": page,
+                "count": len(self._paths),
+                "version": self.version,
+                "source": self.source,
+                "took_ms": round((time.perf_counter() - t0) * 1000, 2),
+            }
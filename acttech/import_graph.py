@@ -0,0 +1,288 @@
+from __future__ import annotations
+
+import json
+import re
+import threading
+from collections import deque
+from pathlib import Path
+from typing import Dict, Any, List, Set, Optional, Iterable, Tuple
+
+from config import SETTINGS
+
+# ----------------------------
+# Import extraction (Python + JS/TS)
+# ----------------------------
+
+_RE_PY_FROM = re.compile(r"^\s*from\s+([a-zA-Z0-9_\.]+)\s+import\s+", re.MULTILINE)
+_RE_PY_IMPORT = re.compile(r"^\s*import\s+([a-zA-Z0-9_\.]+)", re.MULTILINE)
+_RE_JS_IMPORT = re.compile(r"^\s*import\s+.*?\s+from\s+['\"]([^'\"]+)['\"]", re.MULTILINE)
+_RE_JS_REQ = re.compile(r"require\(\s*['\"]([^'\"]+)['\"]\s*\)", re.MULTILINE)
+
+_PY_EXT = (".py",)
+_JS_EXT = (".js", ".jsx", ".ts", ".tsx")
+
+_GRAPH_VERSION = 2  # 2: resolved edges + centrality are persisted too
+
+
+def _resolve_python_module_to_path(module: str, all_set: Set[str]) -> List[str]:
+    """
+    Map 'foo.bar' to possible repo file paths:
+      foo/bar.py
+      foo/bar/__init__.py
+    """
+    mod = module.strip().lstrip(".")
+    if not mod:
+        return []
+    parts = mod.split(".")
+    candidates = []
+    candidates.append("/".join(parts) + ".py")
+    candidates.append("/".join(parts) + "/__init__.py")
+
+    # only keep if exists
+    return [c for c in candidates if c in all_set]
+
+
+def _resolve_js_import_to_paths(spec: str, rel_from: str, all_set: Set[str]) -> List[str]:
+    """
+    Resolve relative JS imports like './utils' from 'src/app.ts'
+    Try extensions and index files.
+    """
+    s = spec.strip()
+    if not s.startswith("."):
+        return []  # ignore npm packages
+
+    base_dir = str(Path(rel_from).parent).replace("\\", "/")
+    raw = str((Path(base_dir) / s).as_posix())
+
+    # try direct
+    cand = []
+    for ext in (".ts", ".tsx", ".js", ".jsx", ".json"):
+        cand.append(raw + ext)
+    cand.append(raw + "/index.ts")
+    cand.append(raw + "/index.tsx")
+    cand.append(raw + "/index.js")
+    cand.append(raw + "/index.jsx")
+
+    return [c for c in cand if c in all_set]
+
+
+def _extract_specs(rel: str, text: str) -> List[str]:
+    """
+    Raw import specs of a file (module names for Python, specifiers for JS/TS).
+    Stored per sha so unchanged files are never re-parsed.
+    """
+    suf = Path(rel).suffix.lower()
+    if suf in _PY_EXT:
+        return _RE_PY_FROM.findall(text) + _RE_PY_IMPORT.findall(text)
+    if suf in _JS_EXT:
+        return _RE_JS_IMPORT.findall(text) + _RE_JS_REQ.findall(text)
+    return []
+
+
+def _resolve(rel: str, specs: Iterable[str], all_set: Set[str]) -> List[str]:
+    suf = Path(rel).suffix.lower()
+    out: List[str] = []
+    for spec in specs:
+        if suf in _PY_EXT:
+            targets = _resolve_python_module_to_path(spec, all_set)
+        else:
+            targets = _resolve_js_import_to_paths(spec, rel, all_set)
+        for t in targets:
+            if t != rel and t not in out:
+                out.append(t)
+    return out
+
+
+def _read_text(repo_root: Path, rel_path: str) -> str:
+    try:
+        return (repo_root / rel_path).read_text(encoding="utf-8", errors="replace")
+    except Exception:
+        return ""
+
+
+# ----------------------------
+# Persistence (STATE_DIR/import_graph.json)
+# ----------------------------
+#
+# Everything a query needs is computed once per scan and persisted:
+#   files:     {path: {sha256, specs}}  raw import specs (re-parsed only when
+#              the file's sha256 changes)
+#   imports:   {path: [path]}  resolved edges against the scanned file list
+#   importers: {path: [path]}  the same edges reversed
+#   rank:      {path: float}   PageRank over the edges
+# Requests only look these up; nothing is read or parsed on the request path.
+
+def graph_path(repo_root: Path) -> Path:
+    return repo_root / SETTINGS.STATE_DIR / "import_graph.json"
+
+
+def _load_graph(repo_root: Path) -> Dict[str, Any]:
+    try:
+        data = json.loads(graph_path(repo_root).read_text(encoding="utf-8"))
+    except Exception:
+        return {}
+    if not isinstance(data, dict) or data.get("version") != _GRAPH_VERSION:
+        return {}
+    return data
+
+
+def _load_specs(repo_root: Path) -> Dict[str, Dict[str, Any]]:
+    files = _load_graph(repo_root).get("files")
+    return files if isinstance(files, dict) else {}
+
+
+def _pagerank(out: Dict[str, List[str]], iterations: int = 20, d: float = 0.85) -> Dict[str, float]:
+    """
+    PageRank over import edges: files many others (transitively) depend on rank high.
+    """
+    nodes = list(dict.fromkeys([n for n in out] + [t for ts in out.values() for t in ts]))
+    if not nodes:
+        return {}
+    n_nodes = len(nodes)
+    rank = {n: 1.0 / n_nodes for n in nodes}
+    for _ in range(iterations):
+        nxt = {n: (1.0 - d) / n_nodes for n in nodes}
+        dangling = sum(rank[n] for n in nodes if not out.get(n))
+        for n, targets in out.items():
+            if targets:
+                share = d * rank[n] / len(targets)
+                for dst in targets:
+                    nxt[dst] += share
+        spread = d * dangling / n_nodes
+        rank = {n: v + spread for n, v in nxt.items()}
+    return rank
+
+
+def update_import_graph(repo_root: Path, repo_map: Dict[str, Any]) -> Dict[str, int]:
+    """
+    Called once per scan: re-parses imports only for files whose sha256
+    changed, drops vanished files, resolves edges (both directions) and
+    centrality against the scanned file list and persists all of it.
+    """
+    root = repo_root.resolve()
+    old = _load_specs(root)
+    new: Dict[str, Dict[str, Any]] = {}
+    all_set: Set[str] = set()
+    parsed = 0
+    for f in repo_map.get("files", []):
+        rel = f.get("path")
+        if not rel:
+            continue
+        all_set.add(rel)
+        if Path(rel).suffix.lower() not in _PY_EXT + _JS_EXT:
+            continue
+        sha = f.get("sha256")
+        prev = old.get(rel)
+        if prev is not None and prev.get("sha256") == sha:
+            new[rel] = prev
+            continue
+        new[rel] = {"sha256": sha, "specs": _extract_specs(rel, _read_text(root, rel))}
+        parsed += 1
+
+    imports: Dict[str, List[str]] = {}
+    importers: Dict[str, List[str]] = {}
+    for src, entry in new.items():
+        targets = _resolve(src, entry.get("specs") or [], all_set)
+        if targets:
+            imports[src] = targets
+            for dst in targets:
+                importers.setdefault(dst, []).append(src)
+    rank = _pagerank(imports)
+
+    p = graph_path(root)
+    p.parent.mkdir(parents=True, exist_ok=True)
+    tmp = p.with_suffix(p.suffix + ".tmp")
+    data = {"version": _GRAPH_VERSION, "files": new, "imports": imports, "importers": importers, "rank": rank}
+    tmp.write_text(json.dumps(data, separators=(",", ":")), encoding="utf-8")
+    tmp.replace(p)
+    return {"nodes": len(new), "parsed": parsed, "reused": len(new) - parsed,
+            "edges": sum(len(t) for t in imports.values())}
+
+
+# ----------------------------
+# Graph queries
+# ----------------------------
+
+# parsed import_graph.json per repo, keyed by the file's (mtime_ns, size)
+_LOADED: Dict[str, Tuple[Tuple[int, int], Dict[str, Any]]] = {}
+_LOADED_LOCK = threading.Lock()
+
+
+def _cached_graph(repo_root: Path) -> Dict[str, Any]:
+    p = graph_path(repo_root)
+    try:
+        st = p.stat()
+    except OSError:
+        return {}
+    key = (st.st_mtime_ns, st.st_size)
+    with _LOADED_LOCK:
+        hit = _LOADED.get(str(p))
+        if hit is not None and hit[0] == key:
+            return hit[1]
+    data = _load_graph(repo_root)
+    with _LOADED_LOCK:
+        _LOADED[str(p)] = (key, data)
+    return data
+
+
+class ImportGraph:
+    """
+    Read-only view of the import graph persisted by the last scan. Queries
+    are dict lookups; files the scan did not see have no edges. all_files
+    (optional) hides paths that are no longer in the repo file list.
+    """
+
+    def __init__(self, data: Dict[str, Any], all_files: Optional[Iterable[str]] = None):
+        self._imports: Dict[str, List[str]] = data.get("imports") or {}
+        self._importers: Dict[str, List[str]] = data.get("importers") or {}
+        self._rank: Dict[str, float] = data.get("rank") or {}
+        self.all_set: Optional[Set[str]] = set(all_files) if all_files is not None else None
+
+    @classmethod
+    def load(cls, repo_root: Path, all_files: Optional[Iterable[str]] = None) -> "ImportGraph":
+        return cls(_cached_graph(repo_root), all_files)
+
+    def _known(self, paths: List[str]) -> List[str]:
+        if self.all_set is None:
+            return paths
+        return [p for p in paths if p in self.all_set]
+
+    def imports_of(self, rel: str) -> List[str]:
+        return self._known(self._imports.get(rel, []))
+
+    def importers_of(self, rel: str) -> List[str]:
+        """
+        Reverse dependencies ("who imports me").
+        """
+        return self._known(self._importers.get(rel, []))
+
+    def centrality(self) -> Dict[str, float]:
+        """
+        PageRank computed at scan time (see _pagerank).
+        """
+        return self._rank
+
+    def neighbors(self, seeds: Iterable[str], hops: int = 1, reverse: bool = False) -> List[Tuple[str, int]]:
+        """
+        BFS up to `hops` away from seeds. Returns [(path, distance)] ordered
+        by distance, then centrality. reverse=True also follows importers.
+        """
+        seeds = list(seeds)
+        seen: Dict[str, int] = {s: 0 for s in seeds}
+        q = deque((s, 0) for s in seeds)
+        while q:
+            cur, dist = q.popleft()
+            if dist >= hops:
+                continue
+            nxt = list(self.imports_of(cur))
+            if reverse:
+                nxt += self.importers_of(cur)
+            for p in nxt:
+                if p not in seen:
+                    seen[p] = dist + 1
+                    q.append((p, dist + 1))
+
+        rank = self._rank
+        found = [(p, d) for p, d in seen.items() if d > 0]
+        found.sort(key=lambda x: (x[1], -rank.get(x[0], 0.0), x[0]))
+        return found
@@ -0,0 +1,157 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# ----------------------------
+# Background jobs (scan / diff / plan / apply / backup restore + gc)
+# ----------------------------
+#
+# Pipeline steps run on a bounded thread pool instead of inside the HTTP
+# request. Steps for the same repo are serialized by a per-repo lock (they
+# all read and write the same state), and a request for a job that is
+# already queued or running with the same kind + params joins that job
+# instead of starting a second one. Each job keeps a short progress log and
+# a version counter that pollers can long-poll on.
+
+_MAX_FINISHED = 100
+_MAX_PROGRESS = 200
+
+Reporter = Callable[[str], None]
+JobFn = Callable[[Reporter], Any]
+
+
+@dataclass
+class Job:
+    id: str
+    kind: str
+    key: str
+    repo: str
+    params: Dict[str, Any]
+    status: str = "queued"  # queued, running, done, failed
+    progress: List[str] = field(default_factory=list)
+    result: Any = None
+    error: str = ""
+    status_code: int = 0  # HTTP status carried by the failure, if any
+    created: float = field(default_factory=time.time)
+    started: float = 0.0
+    finished: float = 0.0
+    version: int = 0
+    future: Optional["Future[Any]"] = None
+    _cond: threading.Condition = field(default_factory=threading.Condition, repr=False)
+
+    @property
+    def done(self) -> bool:
+        return self.status in ("done", "failed")
+
+    def _changed(self) -> None:
+        with self._cond:
+            self.version += 1
+            self._cond.notify_all()
+
+    def report(self, msg: str) -> None:
+        self.progress.append(f"[{time.strftime('%H:%M:%S')}] {msg}")
+        del self.progress[:-_MAX_PROGRESS]
+        self._changed()
+
+    def wait_change(self, since_version: int, timeout: float) -> None:
+        """
+        Blocks until version > since_version, the job is done, or timeout.
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self.version > since_version or self.done, timeout=timeout)
+
+    def to_dict(self, result: bool = True) -> Dict[str, Any]:
+        end = self.finished or time.time()
+        out: Dict[str, Any] = {
+            "job_id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "done": self.done,
+            "params": self.params,
+            "progress": self.progress[-20:],
+            "version": self.version,
+            "queued_sec": round((self.started or end) - self.created, 3),
+            "elapsed_sec": round(end - self.started, 3) if self.started else 0.0,
+        }
+        if self.error:
+            out["error"] = self.error
+        if result and self.status == "done":
+            out["result"] = self.result
+        return out
+
+
+class JobQueue:
+    def __init__(self, workers: int = 2):
+        self._pool = ThreadPoolExecutor(max_workers=max(1, int(workers)), thread_name_prefix="job")
+        self._lock = threading.Lock()
+        self._repo_locks: Dict[str, threading.Lock] = {}
+        self.jobs: Dict[str, Job] = {}
+        self._active: Dict[str, Job] = {}  # dedup key -> queued/running job
+
+    @staticmethod
+    def _key(kind: str, repo: str, params: Dict[str, Any]) -> str:
+        return json.dumps([kind, repo, params], sort_keys=True, default=str)
+
+    def submit(self, kind: str, repo: str, params: Dict[str, Any], fn: JobFn) -> Tuple[Job, bool]:
+        """
+        Returns (job, deduplicated). fn(report) runs on the pool while holding
+        the repo's lock; its return value becomes job.result.
+        """
+        key = self._key(kind, repo, params)
+        with self._lock:
+            running = self._active.get(key)
+            if running is not None and not running.done:
+                return running, True
+            job = Job(id=uuid.uuid4().hex[:12], kind=kind, key=key, repo=repo, params=params)
+            self.jobs[job.id] = job
+            self._active[key] = job
+            self._repo_locks.setdefault(repo, threading.Lock())
+            self._prune()
+        job.future = self._pool.submit(self._run, job, fn)
+        return job, False
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self.jobs.get(job_id)
+
+    def list(self) -> List[Dict[str, Any]]:
+        return [j.to_dict(result=False) for j in sorted(self.jobs.values(), key=lambda j: j.created, reverse=True)]
+
+    async def wait(self, job: Job) -> Job:
+        if job.future is not None:
+            await asyncio.shield(asyncio.wrap_future(job.future))
+        return job
+
+    def shutdown(self) -> None:
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def _run(self, job: Job, fn: JobFn) -> Any:
+        try:
+            with self._repo_locks[job.repo]:
+                job.status = "running"
+                job.started = time.time()
+                job._changed()
+                job.result = fn(job.report)
+                job.status = "done"
+        except Exception as e:
+            job.status = "failed"
+            job.status_code = int(getattr(e, "status_code", 0) or 500)
+            job.error = str(getattr(e, "detail", "") or e)
+        finally:
+            job.finished = time.time()
+            with self._lock:
+                if self._active.get(job.key) is job:
+                    del self._active[job.key]
+            job._changed()
+        return job.result
+
+    def _prune(self) -> None:
+        done = sorted((j for j in self.jobs.values() if j.done), key=lambda j: j.finished)
+        for j in done[: max(0, len(done) - _MAX_FINISHED)]:
+            self.jobs.pop(j.id, None)
@@ -1,18 +1,34 @@
 from __future__ import annotations
 
+import asyncio
 import json
 import os
+import random
 import re
 import time
-from typing import Dict, Any, Optional, Tuple
+from typing import Dict, Any, Optional, Callable, List, Tuple
 
 try:
     from openai import OpenAI
 except ImportError:
     OpenAI = None  # fallback safety
 
+try:
+    from openai import AsyncOpenAI
+except ImportError:
+    AsyncOpenAI = None  # older SDKs: plan_patches_async falls back to a thread
+
 from config import SETTINGS
 from schemas import PATCH_PLAN_JSON_SCHEMA
+from plan_cache import PlanCache, cache_key
+from schema_validator import (
+    SchemaError,
+    Validator,
+    container_pointer,
+    parent_pointer,
+    resolve_pointer,
+    set_pointer,
+)
 
 SYSTEM_INSTRUCTIONS = """You are a code-change planner inside an offline IDE (Replit-like).
 You MUST output ONLY valid JSON matching the provided JSON Schema. No extra text.
@@ -55,23 +71,6 @@ def _extract_json_object(text: str) -> str:
     return "{}"
 
 
-def _basic_plan_sanity(plan: Dict[str, Any]) -> Tuple[bool, str]:
-    if not isinstance(plan, dict):
-        return False, "plan is not dict"
-
-    if "files" not in plan:
-        return False, "missing files key"
-
-    if not isinstance(plan["files"], list):
-        return False, "files is not list"
-
-    for i, f in enumerate(plan["files"]):
-        if not isinstance(f, dict):
-            return False, f"files[{i}] not object"
-
-    return True, "ok"
-
-
 # ----------------------------
 # Prompt Trimming
 # ----------------------------
@@ -94,10 +93,7 @@ def _trim_context(goal: str, context_text: str, max_chars: int) -> str:
 # OpenAI Client
 # ----------------------------
 
-def _client() -> OpenAI:
-    if OpenAI is None:
-        raise RuntimeError("openai package not installed. Run: pip install openai>=1.0.0")
-
+def _client_kwargs() -> Dict[str, Any]:
     api_key = (
         getattr(SETTINGS, "OPENAI_API_KEY", "") or
         os.getenv("OPENAI_API_KEY", "")
@@ -109,71 +105,598 @@ def _client() -> OpenAI:
     base_url = getattr(SETTINGS, "OPENAI_BASE_URL", "") or None
 
     if base_url:
-        return OpenAI(api_key=api_key, base_url=base_url)
+        return {"api_key": api_key, "base_url": base_url}
 
-    return OpenAI(api_key=api_key)
+    return {"api_key": api_key}
 
 
-def _call_model(client: OpenAI, prompt: str) -> str:
-    resp = client.responses.create(
-        model=SETTINGS.MODEL,
-        instructions=SYSTEM_INSTRUCTIONS,
-        input=prompt,
-        response_format={
-            "type": "json_schema",
-            "json_schema": PATCH_PLAN_JSON_SCHEMA
-        }
-    )
+def _client() -> OpenAI:
+    if OpenAI is None:
+        raise RuntimeError("openai package not installed. Run: pip install openai>=1.0.0")
+
+    return OpenAI(**_client_kwargs())
+
+
+def _async_client() -> "AsyncOpenAI":
+    if AsyncOpenAI is None:
+        raise RuntimeError("openai package not installed. Run: pip install openai>=1.0.0")
+
+    return AsyncOpenAI(**_client_kwargs())
+
+
+def _request_kwargs(
+    prompt: str,
+    schema: Optional[Dict[str, Any]] = None,
+    instructions: str = SYSTEM_INSTRUCTIONS
+) -> Dict[str, Any]:
+    schema = schema or PATCH_PLAN_JSON_SCHEMA
+    return {
+        "model": SETTINGS.MODEL,
+        "instructions": instructions,
+        "input": prompt,
+        # Responses API structured output (not chat's response_format);
+        # non-strict because most plan fields are optional
+        "text": {
+            "format": {
+                "type": "json_schema",
+                "name": schema["name"],
+                "schema": schema["schema"],
+                "strict": False,
+            }
+        },
+    }
+
+
+def _call_model(client: OpenAI, req: Dict[str, Any]) -> str:
+    resp = client.responses.create(**req)
     return resp.output_text or ""
 
 
 # ----------------------------
-# Main Planner
+# Streaming (AsyncOpenAI)
 # ----------------------------
 
-def plan_patches(goal: str, context_text: str) -> Dict[str, Any]:
+class PlanProgress:
+    """
+    Incremental reader for a streamed plan: tracks JSON nesting over the
+    deltas and reports each `files[]` entry as soon as its object closes,
+    without re-parsing the whole buffer.
+    """
+
+    def __init__(self, on_progress: Optional[Callable[[str], None]] = None):
+        self.on_progress = on_progress
+        self.text: List[str] = []
+        self.chars = 0
+        self.files_done = 0
+        self.first_delta_at: Optional[float] = None
+        self._t0 = time.time()
+        self._depth = 0
+        self._in_str = False
+        self._esc = False
+        self._entry: Optional[List[str]] = None
+        self._next_report = 2000
+
+    def _emit(self, msg: str) -> None:
+        if self.on_progress is not None:
+            try:
+                self.on_progress(msg)
+            except Exception:
+                pass  # progress is best effort, never fails the plan
+
+    def feed(self, delta: str) -> None:
+        if not delta:
+            return
+        if self.first_delta_at is None:
+            self.first_delta_at = time.time()
+            self._emit(f"Model responding (first token after {self.first_delta_at - self._t0:.1f}s)...")
+        self.text.append(delta)
+        self.chars += len(delta)
+
+        for ch in delta:
+            if self._entry is not None:
+                self._entry.append(ch)
+            if self._in_str:
+                if self._esc:
+                    self._esc = False
+                elif ch == "\\":
+                    self._esc = True
+                elif ch == '"':
+                    self._in_str = False
+                continue
+            if ch == '"':
+                self._in_str = True
+            elif ch in "{[":
+                self._depth += 1
+                # {"files": [ {  <- depth 3 is one file entry
+                if ch == "{" and self._depth == 3 and self._entry is None:
+                    self._entry = ["{"]
+            elif ch in "}]":
+                self._depth = max(0, self._depth - 1)
+                if self._depth == 2 and self._entry is not None:
+                    self._file_done("".join(self._entry))
+                    self._entry = None
+
+        if self.chars >= self._next_report:
+            self._next_report += 2000
+            self._emit(f"...received {self.chars:,} chars")
+
+    def _file_done(self, raw: str) -> None:
+        self.files_done += 1
+        try:
+            entry = json.loads(raw)
+        except Exception:
+            self._emit(f"File #{self.files_done} received")
+            return
+        path = entry.get("path", "?") if isinstance(entry, dict) else "?"
+        ops = entry.get("ops") if isinstance(entry, dict) else None
+        n_ops = len(ops) if isinstance(ops, list) else 0
+        self._emit(f"File #{self.files_done}: {path} ({n_ops} op{'s' if n_ops != 1 else ''})")
+
+    def result(self) -> str:
+        return "".join(self.text)
+
+
+async def _call_model_stream(
+    client: "AsyncOpenAI",
+    req: Dict[str, Any],
+    on_progress: Optional[Callable[[str], None]] = None
+) -> str:
+    progress = PlanProgress(on_progress)
+    stream = await client.responses.create(stream=True, **req)
+    final_text: Optional[str] = None
+    async for event in stream:
+        etype = getattr(event, "type", "")
+        if etype == "response.output_text.delta":
+            progress.feed(getattr(event, "delta", "") or "")
+        elif etype == "response.completed":
+            resp = getattr(event, "response", None)
+            final_text = getattr(resp, "output_text", None) if resp is not None else None
+        elif etype in ("error", "response.failed"):
+            raise RuntimeError(f"Model stream failed: {getattr(event, 'message', None) or etype}")
+    return final_text or progress.result()
 
-    client = _client()
 
+# ----------------------------
+# Validation + fragment repair
+# ----------------------------
+
+PLAN_VALIDATOR = Validator(PATCH_PLAN_JSON_SCHEMA["schema"])
+
+REPAIR_INSTRUCTIONS = """You fix one fragment of a JSON patch plan that failed schema validation.
+Return ONLY {"fragment": <corrected fragment>} as valid JSON. Keep the intent
+of the original fragment; change only what the errors require.
+"""
+
+_EXCERPT_RADIUS = 400
+
+
+def _backoff(attempt: int) -> float:
+    """
+    Jittered exponential backoff before retry `attempt` (1-based):
+    half of the exponential step is fixed, half is random.
+    """
+    base = float(getattr(SETTINGS, "PLANNER_BACKOFF_BASE_SEC", 0.25))
+    cap = float(getattr(SETTINGS, "PLANNER_BACKOFF_MAX_SEC", 4.0))
+    step = min(cap, base * (2 ** max(0, attempt - 1)))
+    return step / 2 + random.uniform(0, step / 2)
+
+
+def _fragment_schema(sub: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "name": "plan_fragment",
+        "schema": {
+            "type": "object",
+            "additionalProperties": False,
+            "properties": {"fragment": sub or {}},
+            "required": ["fragment"],
+        },
+    }
+
+
+class _RepairSession:
+    """
+    Drives one planning request through validation and repair. Instead of
+    resending the whole output, each repair round sends only the broken
+    piece: the JSON fragment around the first schema error (by JSON pointer),
+    or the raw text around a syntax error, and splices the answer back in.
+    Used by both the sync and the streaming planner.
+    """
+
+    def __init__(self, goal: str, prompt: str, extra: Optional[Dict[str, Any]] = None):
+        self.goal = goal
+        self.prompt = prompt
+        self.extra = extra or {}  # e.g. temperature, first request only
+        self.raw = ""
+        self.plan: Any = None
+        self.errors: List[SchemaError] = []
+        self.problem = ""  # what the last accept() found wrong
+        self._repair: Optional[Dict[str, Any]] = None
+
+    def first_request(self) -> Dict[str, Any]:
+        return {**_request_kwargs(self.prompt), **self.extra}
+
+    def accept(self, raw: str) -> Optional[Dict[str, Any]]:
+        """
+        Takes a model response. Returns the valid plan, or None after
+        preparing next_request() and logging what is wrong.
+        """
+        repair = self._repair
+        self._repair = None
+        self.errors = []
+        if repair is None:
+            self.raw = _extract_json_object(raw)
+            self.plan = None
+        elif not self._splice(repair, raw):
+            self.problem = "repair response unusable; retrying the same fragment"
+            _log(self.problem)
+            self._repair = repair
+            return None
+
+        if self.plan is None:
+            if repair is None and "{" in raw:
+                # the {...} extraction cuts a truncated document at its last
+                # "}"; repair the whole tail instead so nothing is lost
+                try:
+                    json.loads(self.raw)
+                except json.JSONDecodeError:
+                    self.raw = raw[raw.index("{"):].rstrip()
+            try:
+                self.plan = json.loads(self.raw)
+            except json.JSONDecodeError as e:
+                self.problem = f"JSON parse error: {e}"
+                _log(self.problem)
+                self._repair = self._text_repair(e)
+                return None
+
+        self.errors = PLAN_VALIDATOR.errors(self.plan)
+        if not self.errors:
+            return self.plan
+        self.problem = f"schema error at {self.errors[0]} ({len(self.errors)} total)"
+        for err in self.errors[:5]:
+            _log(f"Schema error at {err}")
+        self._repair = self._fragment_repair(self.errors)
+        return None
+
+    def next_request(self) -> Dict[str, Any]:
+        if self._repair is None:
+            return self.first_request()
+        return self._repair["request"]
+
+    # ----------------------------
+    # Repair requests
+    # ----------------------------
+
+    def _fragment_repair(self, errors: List[SchemaError]) -> Dict[str, Any]:
+        first = errors[0]
+        start = parent_pointer(first.pointer) if first.keyword == "additionalProperties" else first.pointer
+        ptr = container_pointer(self.plan, start)
+        if ptr == "" and isinstance(self.plan, dict) and first.keyword != "required":
+            ptr = start  # keep root-level type errors from resending the whole plan
+        try:
+            fragment = resolve_pointer(self.plan, ptr)
+        except (KeyError, IndexError, ValueError, TypeError):
+            ptr, fragment = "", self.plan
+
+        inside = [e for e in errors if e.pointer == ptr or e.pointer.startswith(ptr + "/") or not ptr]
+        rel = [f"{e.pointer[len(ptr):] or '/'}: {e.message}" for e in inside[:10]]
+        prompt = (
+            f"GOAL:\n{self.goal}\n\n"
+            f"Fragment at JSON pointer {ptr or '/'} of the plan failed validation:\n"
+            + "\n".join(f"- {r}" for r in rel)
+            + "\n\nFRAGMENT:\n"
+            + json.dumps(fragment, ensure_ascii=False, indent=1)
+        )
+        sub = PLAN_VALIDATOR.subschema(ptr)
+        return {
+            "mode": "fragment",
+            "pointer": ptr,
+            "validator": Validator(sub),
+            "request": _request_kwargs(prompt, _fragment_schema(sub), REPAIR_INSTRUCTIONS),
+        }
+
+    def _text_repair(self, e: json.JSONDecodeError) -> Dict[str, Any]:
+        start = max(0, e.pos - _EXCERPT_RADIUS)
+        end = min(len(self.raw), e.pos + _EXCERPT_RADIUS)
+        excerpt = self.raw[start:end]
+        prompt = (
+            f"This excerpt of a JSON document has a syntax error ({e.msg}) at offset {e.pos - start}.\n"
+            f"It starts at offset {start} and ends at offset {end} of {len(self.raw)} chars"
+            f"{' (the end of the document)' if end == len(self.raw) else ''}.\n"
+            "Return the corrected excerpt text as the fragment string; it replaces the excerpt verbatim.\n\n"
+            f"EXCERPT:\n{excerpt}"
+        )
+        return {
+            "mode": "text",
+            "span": (start, end),
+            "request": _request_kwargs(prompt, _fragment_schema({"type": "string"}), REPAIR_INSTRUCTIONS),
+        }
+
+    def _splice(self, repair: Dict[str, Any], raw: str) -> bool:
+        try:
+            fragment = json.loads(_extract_json_object(raw))["fragment"]
+        except Exception:
+            return False
+
+        if repair["mode"] == "text":
+            if not isinstance(fragment, str):
+                return False
+            start, end = repair["span"]
+            self.raw = self.raw[:start] + fragment + self.raw[end:]
+            self.plan = None
+            return True
+
+        errs = repair["validator"].errors(fragment)
+        if errs:
+            _log(f"Repaired fragment still invalid: {errs[0]}")
+        self.plan = set_pointer(self.plan, repair["pointer"], fragment)
+        return True
+
+
+# ----------------------------
+# Main Planner
+# ----------------------------
+
+def _plan_key(prompt: str, variant: Any = None) -> str:
+    return cache_key(SETTINGS.MODEL, SYSTEM_INSTRUCTIONS, PATCH_PLAN_JSON_SCHEMA, prompt, variant)
+
+
+def _cache_lookup(cache: Optional[PlanCache], key: str, no_cache: bool) -> Optional[Dict[str, Any]]:
+    if cache is None:
+        return None
+    if no_cache:
+        _log("Plan cache bypassed (no_cache).")
+        return None
+    plan = cache.get(key)
+    if plan is not None:
+        _log(f"Plan cache hit ({key[:12]}). Files: {len(plan.get('files', []))}")
+    return plan
+
+
+def _max_attempts() -> int:
+    return max(1, int(getattr(SETTINGS, "PLANNER_MAX_ATTEMPTS", 4)))
+
+
+def plan_patches(
+    goal: str,
+    context_text: str,
+    cache: Optional[PlanCache] = None,
+    no_cache: bool = False
+) -> Dict[str, Any]:
+    """
+    Plans patches for goal. With a cache, identical requests (same model,
+    instructions, schema and trimmed prompt) are answered from STATE_DIR;
+    no_cache skips the lookup but still stores the fresh plan.
+    """
     max_chars = int(getattr(SETTINGS, "PLANNER_MAX_CHARS", 200_000))
     prompt = _trim_context(goal, context_text, max_chars)
 
+    key = _plan_key(prompt)
+    cached = _cache_lookup(cache, key, no_cache)
+    if cached is not None:
+        return cached
+
+    client = _client()
+
     _log("Planning patches...")
     _log(f"Model: {SETTINGS.MODEL}")
     _log(f"Prompt size: {len(prompt):,} chars")
 
-    last_text: Optional[str] = None
+    session = _RepairSession(goal, prompt)
+    attempts = _max_attempts()
+
+    for attempt in range(1, attempts + 1):
+        if attempt > 1:
+            delay = _backoff(attempt - 1)
+            _log(f"Repair attempt {attempt-1} in {delay:.2f}s")
+            time.sleep(delay)
 
-    for attempt in range(1, 4):
+        req = session.next_request()
+        try:
+            raw = _call_model(client, req)
+        except Exception as e:
+            _log(f"Model call failed: {e}")
+            if attempt == attempts:
+                raise
+            continue
+
+        plan = session.accept(raw)
+        if plan is not None:
+            _log(f"Plan OK. Files: {len(plan.get('files', []))}")
+            if cache is not None:
+                cache.put(key, plan, {"model": SETTINGS.MODEL, "goal": goal})
+            return plan
 
-        if attempt == 1:
-            raw = _call_model(client, prompt)
-        else:
-            _log(f"Repair attempt {attempt-1}")
-            repair_prompt = (
-                "Return ONLY valid JSON matching the schema.\n\n"
-                f"GOAL:\n{goal}\n\n"
-                f"PREVIOUS OUTPUT:\n{last_text}"
-            )
-            raw = _call_model(client, repair_prompt)
+    _log("Failed after retries. Returning empty plan.")
+    return {"files": []}
 
-        last_text = raw
-        extracted = _extract_json_object(raw)
 
+async def _plan_streaming(
+    client: "AsyncOpenAI",
+    session: _RepairSession,
+    report: Callable[[str], None],
+    show_progress: bool = True
+) -> Optional[Dict[str, Any]]:
+    """
+    Streaming attempt/repair loop on a shared client. Returns the valid plan
+    or None after PLANNER_MAX_ATTEMPTS.
+    """
+    attempts = _max_attempts()
+    for attempt in range(1, attempts + 1):
+        if attempt > 1:
+            delay = _backoff(attempt - 1)
+            report(f"Repair attempt {attempt-1} in {delay:.2f}s")
+            await asyncio.sleep(delay)
+
+        req = session.next_request()
         try:
-            plan = json.loads(extracted)
+            # repair rounds are small; only the full plan gets per-file progress
+            raw = await _call_model_stream(client, req, report if (attempt == 1 and show_progress) else None)
         except Exception as e:
-            _log(f"JSON parse error: {e}")
-            time.sleep(0.4)
+            report(f"Model call failed: {e}")
+            if attempt == attempts:
+                raise
             continue
 
-        ok, reason = _basic_plan_sanity(plan)
-        if ok:
-            _log(f"Plan OK. Files: {len(plan.get('files', []))}")
+        plan = session.accept(raw)
+        if plan is not None:
             return plan
 
-        _log(f"Schema check failed: {reason}")
-        time.sleep(0.4)
+        report(f"Repairing: {session.problem}")
+    return None
+
+
+async def plan_patches_async(
+    goal: str,
+    context_text: str,
+    on_progress: Optional[Callable[[str], None]] = None,
+    cache: Optional[PlanCache] = None,
+    no_cache: bool = False
+) -> Dict[str, Any]:
+    """
+    Same contract as plan_patches, but never blocks the event loop:
+    streams the response and reports progress (first token, each finished
+    file entry, received size) through on_progress as it arrives.
+    """
+    def report(msg: str) -> None:
+        _log(msg)
+        if on_progress is not None:
+            on_progress(msg)
+
+    if AsyncOpenAI is None or not bool(getattr(SETTINGS, "PLANNER_STREAM", True)):
+        return await asyncio.to_thread(plan_patches, goal, context_text, cache, no_cache)
 
-    _log("Failed after retries. Returning empty plan.")
+    max_chars = int(getattr(SETTINGS, "PLANNER_MAX_CHARS", 200_000))
+    prompt = _trim_context(goal, context_text, max_chars)
+
+    key = _plan_key(prompt)
+    cached = _cache_lookup(cache, key, no_cache)
+    if cached is not None:
+        report(f"Plan served from cache ({key[:12]}).")
+        return cached
+
+    client = _async_client()
+
+    _log("Planning patches (streaming)...")
+    _log(f"Model: {SETTINGS.MODEL}")
+    _log(f"Prompt size: {len(prompt):,} chars")
+
+    try:
+        plan = await _plan_streaming(client, _RepairSession(goal, prompt), report)
+    finally:
+        await client.close()
+
+    if plan is not None:
+        _log(f"Plan OK. Files: {len(plan.get('files', []))}")
+        if cache is not None:
+            cache.put(key, plan, {"model": SETTINGS.MODEL, "goal": goal})
+        return plan
+
+    report("Failed after retries. Returning empty plan.")
     return {"files": []}
+
+
+# ----------------------------
+# Multi-candidate planning
+# ----------------------------
+
+# Appended to the prompt of candidate i (mod len) so candidates explore
+# different edit strategies; reasoning models ignore temperature.
+CANDIDATE_HINTS = [
+    "",
+    "\n\nSTRATEGY: make the smallest possible edit; anchor replace_text on unique lines.",
+    "\n\nSTRATEGY: prefer replace_range / insert_after using the line numbers shown in the snippets.",
+    "\n\nSTRATEGY: re-check every find/match string against the snippets before using it.",
+]
+
+
+async def plan_candidates_async(
+    goal: str,
+    context_text: str,
+    n: int,
+    evaluate: Callable[[Dict[str, Any]], Dict[str, Any]],
+    on_progress: Optional[Callable[[str], None]] = None,
+    cache: Optional[PlanCache] = None,
+    no_cache: bool = False
+) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+    """
+    Fires n planning requests concurrently over one pooled AsyncOpenAI client
+    (prompt variants, plus PLANNER_CANDIDATE_TEMPERATURES if set). Each plan
+    is scored by evaluate(plan) -> {"ok", "changed_lines", ...} as soon as it
+    arrives (e.g. a dry-run apply), and the valid plan with the fewest
+    changed lines wins; if none is valid, the plan is empty. Wall time is
+    that of the slowest single call.
+    Returns (plan, per-candidate summaries).
+    """
+    def report(msg: str) -> None:
+        _log(msg)
+        if on_progress is not None:
+            on_progress(msg)
+
+    n = max(1, int(n))
+    if n == 1 or AsyncOpenAI is None:
+        plan = await plan_patches_async(goal, context_text, on_progress, cache, no_cache)
+        return plan, []
+
+    max_chars = int(getattr(SETTINGS, "PLANNER_MAX_CHARS", 200_000))
+    prompt = _trim_context(goal, context_text, max_chars)
+
+    temps = list(getattr(SETTINGS, "PLANNER_CANDIDATE_TEMPERATURES", []) or [])
+    # a best-of-n winner is its own cache entry, apart from single-shot plans
+    used_temps = [float(temps[i % len(temps)]) for i in range(n)] if temps else []
+    key = _plan_key(prompt, {"candidates": n, "temperatures": used_temps})
+    cached = _cache_lookup(cache, key, no_cache)
+    if cached is not None:
+        report(f"Plan served from cache ({key[:12]}).")
+        return cached, []
+
+    _log(f"Planning {n} candidates concurrently (streaming)...")
+    _log(f"Model: {SETTINGS.MODEL}")
+    _log(f"Prompt size: {len(prompt):,} chars")
+
+    async def one(i: int) -> Dict[str, Any]:
+        tag = f"candidate {i+1}/{n}"
+
+        def sub_report(msg: str) -> None:
+            report(f"[{tag}] {msg}")
+
+        extra = {"temperature": float(temps[i % len(temps)])} if temps else {}
+        session = _RepairSession(goal, prompt + CANDIDATE_HINTS[i % len(CANDIDATE_HINTS)], extra)
+        t0 = time.time()
+        try:
+            plan = await _plan_streaming(client, session, sub_report, show_progress=False)
+        except Exception as e:
+            sub_report(f"failed: {e}")
+            return {"index": i, "plan": None, "ok": False, "reason": str(e)}
+        if plan is None:
+            sub_report("no valid plan")
+            return {"index": i, "plan": None, "ok": False, "reason": "invalid after retries"}
+
+        score = await asyncio.to_thread(evaluate, plan)
+        sub_report(
+            f"{'OK' if score.get('ok') else 'discarded'}: {score.get('changed_lines', 0)} changed lines, "
+            f"{len(plan.get('files', []))} files, {time.time() - t0:.1f}s"
+            + (f" ({score['reason']})" if score.get("reason") else "")
+        )
+        return {"index": i, "plan": plan, **score}
+
+    client = _async_client()
+    try:
+        results = await asyncio.gather(*(one(i) for i in range(n)))
+    finally:
+        await client.close()
+
+    valid = [r for r in results if r.get("ok")]
+    summaries = [{k: v for k, v in r.items() if k != "plan"} for r in results]
+    if valid:
+        best = min(valid, key=lambda r: (r.get("changed_lines", 0), r["index"]))
+        report(f"Picked candidate {best['index']+1}/{n} ({best.get('changed_lines', 0)} changed lines).")
+        plan = best["plan"]
+        if cache is not None:
+            cache.put(key, plan, {"model": SETTINGS.MODEL, "goal": goal, "candidates": n})
+        return plan, summaries
+
+    # nothing applies cleanly: every plan is known to fail, skip or conflict,
+    # so none is returned (and nothing is cached); summaries say why
+    report("No candidate applies cleanly. Returning empty plan.")
+    notes = [f"candidate {r['index']+1}: {r.get('reason') or 'does not apply cleanly'}" for r in results]
+    return {"summary": "No candidate plan applied cleanly; nothing to apply.", "notes": notes, "files": []}, summaries
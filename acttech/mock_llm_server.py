@@ -0,0 +1,257 @@
+# mock_llm_server.py - offline stand-in for the OpenAI Responses API (/v1/responses)
+# Usage:
+#   python mock_llm_server.py --port 8799 --latency 0.8 --error-rate 0.05 --malformed-rate 0.2
+#   then set OPENAI_BASE_URL = "http://127.0.0.1:8799/v1" (config.py or env) and any OPENAI_API_KEY.
+#
+# Plans: --plans file.json(l) with a list of entries, each either a plan or
+# {"when": "<substring of the request input>", "plan": {...}}. Matching "when"
+# entries win; plain entries are served round-robin. Without a file (or no
+# match) the mock appends a comment to the first code file in the context.
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import random
+import re
+import time
+import uuid
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+
+@dataclass
+class MockConfig:
+    latency: float = 0.5          # seconds before the first byte
+    jitter: float = 0.2           # +- uniform seconds on top of latency
+    error_rate: float = 0.0       # share of requests answered with HTTP 500
+    malformed_rate: float = 0.0   # share of plans truncated mid-JSON
+    chunk_chars: int = 24         # stream delta size
+    token_delay: float = 0.005    # seconds between stream deltas
+    seed: Optional[int] = None
+    plans: List[Any] = field(default_factory=list)
+
+
+CONFIG = MockConfig()
+STATS: Dict[str, int] = {"requests": 0, "streamed": 0, "errors": 0, "malformed": 0, "repairs": 0}
+
+_rnd = random.Random()
+_rr = 0
+
+app = FastAPI(title="Mock LLM (Responses API)")
+
+
+# ----------------------------
+# Plans
+# ----------------------------
+
+_RE_FILE_HDR = re.compile(r"^--- FILE: (\S+)", re.MULTILINE)
+_COMMENT = {".py": "#", ".js": "//", ".jsx": "//", ".ts": "//", ".tsx": "//", ".css": "/*", ".toml": "#", ".yml": "#", ".yaml": "#"}
+
+
+def load_plans(path: Path) -> List[Any]:
+    text = path.read_text(encoding="utf-8")
+    if path.suffix.lower() == ".jsonl":
+        return [json.loads(ln) for ln in text.splitlines() if ln.strip()]
+    data = json.loads(text)
+    return data if isinstance(data, list) else [data]
+
+
+def _default_plan(prompt: str) -> Dict[str, Any]:
+    for rel in _RE_FILE_HDR.findall(prompt):
+        mark = _COMMENT.get(Path(rel).suffix.lower())
+        if mark:
+            tail = " */" if mark == "/*" else ""
+            return {
+                "summary": "mock plan",
+                "files": [{"path": rel, "ops": [{"type": "append", "text": f"{mark} mock planner edit{tail}\n"}]}],
+            }
+    return {"summary": "mock plan (no code file in context)", "files": []}
+
+
+def _pick_plan(prompt: str) -> Dict[str, Any]:
+    global _rr
+    plain = []
+    for entry in CONFIG.plans:
+        if isinstance(entry, dict) and "when" in entry and "plan" in entry:
+            if str(entry["when"]) in prompt:
+                return entry["plan"]
+        else:
+            plain.append(entry)
+    if plain:
+        plan = plain[_rr % len(plain)]
+        _rr += 1
+        return plan
+    return _default_plan(prompt)
+
+
+def _autoclose(text: str) -> str:
+    """
+    Closes an unterminated string and open brackets: enough to answer the
+    planner's syntax-repair requests for truncated output.
+    """
+    stack: List[str] = []
+    in_str = esc = False
+    for ch in text:
+        if in_str:
+            if esc:
+                esc = False
+            elif ch == "\\":
+                esc = True
+            elif ch == '"':
+                in_str = False
+        elif ch == '"':
+            in_str = True
+        elif ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+        elif ch in "}]" and stack:
+            stack.pop()
+    out = text + ('"' if in_str else "")
+    out = out.rstrip().rstrip(",:")
+    return out + "".join(reversed(stack))
+
+
+def _answer(body: Dict[str, Any]) -> str:
+    prompt = str(body.get("input") or "")
+    fmt = ((body.get("text") or {}).get("format") or {})
+    if fmt.get("name") == "plan_fragment":
+        STATS["repairs"] += 1
+        if "EXCERPT:\n" in prompt:
+            return json.dumps({"fragment": _autoclose(prompt.split("EXCERPT:\n", 1)[1])})
+        frag = prompt.split("FRAGMENT:\n", 1)[1] if "FRAGMENT:\n" in prompt else "null"
+        try:
+            return json.dumps({"fragment": json.loads(frag)})
+        except Exception:
+            return json.dumps({"fragment": None})
+
+    text = json.dumps(_pick_plan(prompt), ensure_ascii=False)
+    if CONFIG.malformed_rate and _rnd.random() < CONFIG.malformed_rate:
+        STATS["malformed"] += 1
+        text = text[: max(1, int(len(text) * _rnd.uniform(0.5, 0.95)))]
+    return text
+
+
+# ----------------------------
+# Response objects
+# ----------------------------
+
+def _response_obj(resp_id: str, model: str, text: str, status: str = "completed") -> Dict[str, Any]:
+    return {
+        "id": resp_id,
+        "object": "response",
+        "created_at": int(time.time()),
+        "model": model,
+        "status": status,
+        "output": [{
+            "type": "message",
+            "id": f"msg_{resp_id[5:]}",
+            "role": "assistant",
+            "status": status,
+            "content": [{"type": "output_text", "text": text, "annotations": []}],
+        }] if status == "completed" else [],
+        "parallel_tool_calls": True,
+        "tool_choice": "auto",
+        "tools": [],
+        "usage": {
+            "input_tokens": 0,
+            "output_tokens": len(text) // 4,
+            "total_tokens": len(text) // 4,
+            "input_tokens_details": {"cached_tokens": 0},
+            "output_tokens_details": {"reasoning_tokens": 0},
+        },
+    }
+
+
+def _sse(event: Dict[str, Any]) -> str:
+    return f"event: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+
+async def _stream(resp_id: str, model: str, text: str):
+    seq = 0
+
+    def ev(**kw: Any) -> str:
+        nonlocal seq
+        seq += 1
+        return _sse({**kw, "sequence_number": seq})
+
+    item_id = f"msg_{resp_id[5:]}"
+    yield ev(type="response.created", response=_response_obj(resp_id, model, "", status="in_progress"))
+    step = max(1, CONFIG.chunk_chars)
+    for i in range(0, len(text), step):
+        yield ev(type="response.output_text.delta", item_id=item_id, output_index=0, content_index=0, delta=text[i:i + step])
+        if CONFIG.token_delay:
+            await asyncio.sleep(CONFIG.token_delay)
+    yield ev(type="response.output_text.done", item_id=item_id, output_index=0, content_index=0, text=text)
+    yield ev(type="response.completed", response=_response_obj(resp_id, model, text))
+
+
+# ----------------------------
+# Routes
+# ----------------------------
+
+@app.post("/v1/responses")
+async def responses(req: Request):
+    body = await req.json()
+    STATS["requests"] += 1
+
+    delay = max(0.0, CONFIG.latency + _rnd.uniform(-CONFIG.jitter, CONFIG.jitter))
+    await asyncio.sleep(delay)
+
+    if CONFIG.error_rate and _rnd.random() < CONFIG.error_rate:
+        STATS["errors"] += 1
+        return JSONResponse(
+            {"error": {"message": "mock: injected server error", "type": "server_error", "code": None, "param": None}},
+            status_code=500,
+        )
+
+    resp_id = "resp_" + uuid.uuid4().hex
+    model = str(body.get("model") or "mock")
+    text = _answer(body)
+
+    if body.get("stream"):
+        STATS["streamed"] += 1
+        return StreamingResponse(_stream(resp_id, model, text), media_type="text/event-stream")
+    return JSONResponse(_response_obj(resp_id, model, text))
+
+
+@app.get("/stats")
+def stats() -> JSONResponse:
+    return JSONResponse({**STATS, "config": {k: v for k, v in vars(CONFIG).items() if k != "plans"}, "plans": len(CONFIG.plans)})
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Mock OpenAI Responses API for offline planner tests")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8799)
+    ap.add_argument("--latency", type=float, default=CONFIG.latency)
+    ap.add_argument("--jitter", type=float, default=CONFIG.jitter)
+    ap.add_argument("--error-rate", type=float, default=CONFIG.error_rate)
+    ap.add_argument("--malformed-rate", type=float, default=CONFIG.malformed_rate)
+    ap.add_argument("--chunk-chars", type=int, default=CONFIG.chunk_chars)
+    ap.add_argument("--token-delay", type=float, default=CONFIG.token_delay)
+    ap.add_argument("--plans", type=Path, default=None)
+    ap.add_argument("--seed", type=int, default=None)
+    args = ap.parse_args()
+
+    CONFIG.latency = args.latency
+    CONFIG.jitter = args.jitter
+    CONFIG.error_rate = args.error_rate
+    CONFIG.malformed_rate = args.malformed_rate
+    CONFIG.chunk_chars = args.chunk_chars
+    CONFIG.token_delay = args.token_delay
+    CONFIG.seed = args.seed
+    if args.plans:
+        CONFIG.plans = load_plans(args.plans)
+    _rnd.seed(args.seed)
+
+    import uvicorn
+    print(f"Mock LLM on http://{args.host}:{args.port}/v1  (set OPENAI_BASE_URL to this)", flush=True)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
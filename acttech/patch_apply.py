@@ -1,14 +1,21 @@
 from __future__ import annotations
 
-import difflib
+import hashlib
 import json
+import os
 import shutil
 import subprocess
+import tempfile
 import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Dict, Any, List, Optional, Tuple
 
 from config import SETTINGS
+import repo_store
+from backup_store import BackupStore
+from patch_engine import RANGE_OPS, apply_ops
+from text_diff import diff_texts
 
 
 # ----------------------------
@@ -43,204 +50,392 @@ def _git_is_clean(repo_root: Path) -> bool:
     except Exception:
         return True
 
-def _backup_file(repo_root: Path, rel: str, backup_dir: Path) -> None:
-    src = repo_root / rel
-    dst = backup_dir / rel
-    dst.parent.mkdir(parents=True, exist_ok=True)
-    shutil.copy2(src, dst)
-
-def _unified_diff(rel: str, before: str, after: str, context_lines: int = 3) -> str:
-    a = before.splitlines(True)
-    b = after.splitlines(True)
-    diff = difflib.unified_diff(
-        a, b,
-        fromfile=f"a/{rel}",
-        tofile=f"b/{rel}",
-        n=context_lines
-    )
-    return "".join(diff)
-
-def _changed_line_count(before: str, after: str) -> int:
-    return sum(1 for _ in difflib.ndiff(before.splitlines(), after.splitlines())
-               if _.startswith("+ ") or _.startswith("- "))
-
 def _ensure_text_allowed(path: Path) -> bool:
     return path.suffix.lower() in SETTINGS.TEXT_EXT
 
 
 # ----------------------------
-# Patch ops (more complete)
+# Optimistic concurrency (baseline = "after" scan)
+# ----------------------------
+#
+# The planner's line numbers come from the scanned repo. Before a file is
+# patched, its current state is compared with the "after" snapshot: equal
+# size + mtime means unchanged without reading it; otherwise the sha256 of
+# the content decides. Files this tool wrote since that scan are tracked in
+# STATE_DIR/apply_baseline.json (valid for one snapshot id), so a second
+# plan/apply round does not see its own writes as conflicts.
+#
+# APPLY_CONFLICT_POLICY for a file that changed since the scan:
+#   "rebase" - content-matched ops (replace_text / insert_* / append) run on
+#              the current text; a file with line-range ops is a conflict
+#   "reject" - every changed file is a conflict
+#   "ignore" - no check (previous behaviour)
+
+_CONFLICT_POLICIES = ("rebase", "reject", "ignore")
+
+
+def _content_sha256(data: bytes) -> str:
+    # same normalization as repo_scan (decode with replacement, re-encode)
+    return hashlib.sha256(data.decode("utf-8", errors="replace").encode("utf-8", errors="replace")).hexdigest()
+
+def _baseline_path(repo_root: Path) -> Path:
+    return repo_root / SETTINGS.STATE_DIR / "apply_baseline.json"
+
+def _load_baseline(repo_root: Path) -> Optional[Dict[str, Any]]:
+    """
+    {"snapshot_id", "files": {rel: {size, mtime, sha256}}} or None without a scan.
+    """
+    snap = repo_store.load_repo_map(repo_root, "after", columns=("path", "size", "mtime", "sha256"))
+    if snap is None:
+        return None
+    files = {f["path"]: f for f in snap["files"]}
+    try:
+        own = json.loads(_baseline_path(repo_root).read_text(encoding="utf-8"))
+        if own.get("snapshot_id") == snap["snapshot_id"]:
+            files.update(own.get("files") or {})
+    except Exception:
+        pass
+    return {"snapshot_id": snap["snapshot_id"], "files": files}
+
+def _record_baseline(repo_root: Path, baseline: Dict[str, Any], rows: List[Dict[str, Any]]) -> None:
+    """
+    Makes files written by this apply the new baseline for their paths. The
+    hash is taken from the file as written: text-mode writes translate
+    newlines on Windows, so the in-memory text would not match it.
+    """
+    p = _baseline_path(repo_root)
+    try:
+        own = json.loads(p.read_text(encoding="utf-8"))
+        if own.get("snapshot_id") != baseline["snapshot_id"]:
+            own = {}
+    except Exception:
+        own = {}
+    files = own.get("files") or {}
+    for r in rows:
+        try:
+            st = r["_path"].stat()
+            sha = _content_sha256(r["_path"].read_bytes())
+        except OSError:
+            continue
+        files[r["file"]] = {
+            "size": int(st.st_size),
+            "mtime": float(st.st_mtime),
+            "sha256": sha,
+        }
+    p.parent.mkdir(parents=True, exist_ok=True)
+    p.write_text(json.dumps({"snapshot_id": baseline["snapshot_id"], "files": files}), encoding="utf-8")
+
+def _changed_since_scan(p: Path, base: Dict[str, Any]) -> bool:
+    st = p.stat()
+    if int(base.get("size") or -1) == st.st_size and base.get("mtime") == float(st.st_mtime):
+        return False  # stat pre-check: not rehashed
+    return _content_sha256(p.read_bytes()) != base.get("sha256")
+
+def _check_conflict(p: Path, rel: str, ops: List[Dict[str, Any]], baseline: Optional[Dict[str, Any]],
+                    policy: str) -> Tuple[Optional[str], bool]:
+    """
+    (conflict reason or None, changed since the scan).
+    """
+    if baseline is None or policy == "ignore":
+        return None, False
+    base = baseline["files"].get(rel)
+    if base is None or not _changed_since_scan(p, base):
+        return None, False  # not in the scan (nothing to compare) or unchanged
+    if policy == "reject":
+        return "changed since the last scan", True
+    ranges = sorted({str(op.get("type")) for op in ops if op.get("type") in RANGE_OPS})
+    if ranges:
+        return f"changed since the last scan; {', '.join(ranges)} line numbers are stale", True
+    return None, True
+
+
+# ----------------------------
+# Per-file compute (thread-safe: reads only)
+# ----------------------------
+
+def _prepare_file(repo_root: Path, f: Dict[str, Any], baseline: Optional[Dict[str, Any]] = None,
+                  policy: str = "ignore") -> Dict[str, Any]:
+    """
+    Result row for one plan entry. Rows with status "update" also carry the
+    private keys _path/_updated/_exists used by the write phase.
+    """
+    rel = (f.get("path") or "").replace("\\", "/")
+    ops = f.get("ops", [])
+    if not isinstance(ops, list):
+        ops = []
+
+    if not rel:
+        return {"file": "", "status": "skipped", "reason": "missing path"}
+    if not _is_safe_rel_path(rel):
+        return {"file": rel, "status": "skipped", "reason": "unsafe path"}
+
+    p = repo_root / rel
+
+    # Optional: allow create new file (off by default)
+    allow_create = bool(getattr(SETTINGS, "ALLOW_CREATE_FILES", False))
+    exists = p.exists()
+    rebased = False
+    if not exists:
+        if not allow_create:
+            return {"file": rel, "status": "skipped", "reason": "not found"}
+        original = ""  # empty baseline; parent dirs are created on write
+    else:
+        if not p.is_file():
+            return {"file": rel, "status": "skipped", "reason": "not a file"}
+        if not _ensure_text_allowed(p):
+            return {"file": rel, "status": "skipped", "reason": "file type not allowed"}
+        conflict, rebased = _check_conflict(p, rel, ops, baseline, policy)
+        if conflict:
+            return {"file": rel, "status": "conflict", "reason": conflict, "ops": len(ops)}
+        original = p.read_text(encoding="utf-8", errors="replace")
+
+    try:
+        updated, op_log = apply_ops(original, ops)
+    except Exception as e:
+        return {"file": rel, "status": "failed", "reason": str(e)}
+
+    if updated == original:
+        return {"file": rel, "status": "noop", "ops": len(ops)}
+
+    diff_txt, changed_lines = diff_texts(rel, original, updated, context_lines=3)
+    row = {
+        "file": rel,
+        "status": "update",
+        "ops": len(ops),
+        "changed_lines": changed_lines,
+        "diff_unified": diff_txt,
+        "_path": p,
+        "_updated": updated,
+        "_exists": exists,
+    }
+    if rebased:
+        row["rebased"] = True  # changed since the scan; content ops re-matched
+    return row
+
+
+def _prepare_all(repo_root: Path, files: List[Dict[str, Any]], baseline: Optional[Dict[str, Any]],
+                 policy: str) -> List[Dict[str, Any]]:
+    workers = max(1, int(getattr(SETTINGS, "APPLY_WORKERS", 8)))
+    entries = [f if isinstance(f, dict) else {} for f in files]
+    if workers == 1 or len(entries) < 2:
+        return [_prepare_file(repo_root, f, baseline, policy) for f in entries]
+    with ThreadPoolExecutor(max_workers=min(workers, len(entries))) as ex:
+        return list(ex.map(lambda f: _prepare_file(repo_root, f, baseline, policy), entries))  # keeps plan order
+
+
+def _public(row: Dict[str, Any], status: str, **extra: Any) -> Dict[str, Any]:
+    out = {k: v for k, v in row.items() if not k.startswith("_")}
+    out["status"] = status
+    out.update(extra)
+    return out
+
+
+# ----------------------------
+# Transactional write
 # ----------------------------
 
-def _replace_range(text: str, start_line: int, end_line: int, new_text: str) -> str:
-    lines = text.splitlines(True)
-    s = max(1, start_line) - 1
-    e = min(len(lines), max(1, end_line))
-    return "".join(lines[:s]) + new_text + "".join(lines[e:])
-
-def _delete_range(text: str, start_line: int, end_line: int) -> str:
-    return _replace_range(text, start_line, end_line, "")
-
-def _replace_text(text: str, find: str, replace: str, count: Optional[int]) -> str:
-    return text.replace(find, replace) if count is None else text.replace(find, replace, int(count))
-
-def _insert_after(text: str, match: str, insert_text: str, once: bool = True) -> str:
-    lines = text.splitlines(True)
-    out: List[str] = []
-    inserted = False
-    for ln in lines:
-        out.append(ln)
-        if match in ln and (not inserted or not once):
-            out.append(insert_text)
-            inserted = True
-    return "".join(out)
-
-def _insert_before(text: str, match: str, insert_text: str, once: bool = True) -> str:
-    lines = text.splitlines(True)
-    out: List[str] = []
-    inserted = False
-    for ln in lines:
-        if match in ln and (not inserted or not once):
-            out.append(insert_text)
-            inserted = True
-        out.append(ln)
-    return "".join(out)
-
-def _append_text(text: str, append_text: str) -> str:
-    if not text.endswith("\n") and append_text and not append_text.startswith("\n"):
-        return text + "\n" + append_text
-    return text + append_text
+# mkstemp creates 0600 files; new files get the mode open() would give them.
+# Read once: os.umask() can only be read by setting it (process-wide).
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+def _stage(path: Path, text: str, made_dirs: List[Path]) -> Path:
+    """
+    Writes text to a temp file in path's directory (same filesystem, so the
+    commit is a plain rename) with the target's permissions, or the default
+    ones for a new file. Directories it creates are appended to made_dirs.
+    """
+    missing: List[Path] = []
+    d = path.parent
+    while not d.exists():
+        missing.append(d)
+        d = d.parent
+    path.parent.mkdir(parents=True, exist_ok=True)
+    made_dirs.extend(reversed(missing))
+    fd, tmp = tempfile.mkstemp(dir=str(path.parent), prefix=f".{path.name}.", suffix=".stage")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as fh:
+            fh.write(text)
+        if path.exists():
+            shutil.copymode(path, tmp)
+        else:
+            os.chmod(tmp, 0o666 & ~_UMASK)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+    return Path(tmp)
+
+
+def _commit_all(rows: List[Dict[str, Any]], store: BackupStore, manifest: Dict[str, Any]) -> None:
+    """
+    Backs up, stages, then renames every row into place. On any error the
+    files already committed are restored from the backup store (created files
+    are removed), leftover stage files and directories created for new files
+    are deleted and the error is re-raised.
+    """
+    staged: List[Path] = []
+    made_dirs: List[Path] = []
+    committed: List[Dict[str, Any]] = []
+    try:
+        for row in rows:
+            store.add_file(manifest, row["file"])
+        for row in rows:
+            staged.append(_stage(row["_path"], row["_updated"], made_dirs))
+        for row, tmp in zip(rows, staged):
+            os.replace(tmp, row["_path"])
+            committed.append(row)
+    except BaseException:
+        for row in reversed(committed):
+            try:
+                store.restore_file(row["file"], manifest["files"][row["file"]])
+            except Exception:
+                pass  # best effort; the blob is still in the store
+        for tmp in staged[len(committed):]:
+            tmp.unlink(missing_ok=True)
+        for d in reversed(made_dirs):
+            try:
+                d.rmdir()
+            except OSError:
+                pass  # not empty (or already gone)
+        raise
 
 
 # ----------------------------
 # Main apply
 # ----------------------------
 
-def apply_patch_plan(repo_root: Path, plan: Dict[str, Any], dry_run: bool) -> Dict[str, Any]:
+def apply_patch_plan(repo_root: Path, plan: Dict[str, Any], dry_run: bool, record: bool = True) -> Dict[str, Any]:
     """
     Replit-like behavior:
     - validates paths
     - shows preview diff (unified)
     - supports extra ops (insert_before, append, delete_range)
-    - writes backups on real apply
+    - applies all ops of a file in one pass; line ranges refer to the original
+      numbering (see patch_engine.py)
+    - computes new contents for all files in parallel (APPLY_WORKERS)
+    - APPLY_TRANSACTIONAL: all files are written or none (rolled back on error)
+    - APPLY_CONFLICT_POLICY: files changed since the last scan are rebased or
+      reported as conflicts
+    - writes backups on real apply (content-addressed, see backup_store.py)
     - returns rich log for UI/terminal
+    record=False does not write last_apply_log.json: the caller keeps the log
+    (web_app stores it through AppState; score_plan's dry runs leave no trace).
     """
     if SETTINGS.REQUIRE_CLEAN_GIT and not _git_is_clean(repo_root):
         raise RuntimeError("Repo has uncommitted changes. Commit/stash or set REQUIRE_CLEAN_GIT=False.")
 
     state_dir = repo_root / SETTINGS.STATE_DIR
-    backup_root = repo_root / SETTINGS.BACKUP_DIR
-    state_dir.mkdir(parents=True, exist_ok=True)
-    backup_root.mkdir(parents=True, exist_ok=True)
+    if record:
+        state_dir.mkdir(parents=True, exist_ok=True)
 
-    run_id = _ts()
-    backup_dir = backup_root / run_id
-    backup_dir.mkdir(parents=True, exist_ok=True)
+    store = BackupStore(repo_root)
+    manifest = store.new_run(_ts(), meta={"kind": "apply", "summary": str(plan.get("summary") or "")})
+    run_id = manifest["run_id"]
+    backup_run: Optional[str] = None
 
-    results: List[Dict[str, Any]] = []
     files = plan.get("files", [])
     if not isinstance(files, list):
         files = []
 
-    for f in files:
-        rel = (f.get("path") or "").replace("\\", "/")
-        ops = f.get("ops", [])
-        if not isinstance(ops, list):
-            ops = []
-
-        if not rel:
-            results.append({"file": "", "status": "skipped", "reason": "missing path"})
-            continue
-
-        if not _is_safe_rel_path(rel):
-            results.append({"file": rel, "status": "skipped", "reason": "unsafe path"})
-            continue
+    policy = str(getattr(SETTINGS, "APPLY_CONFLICT_POLICY", "rebase")).lower()
+    if policy not in _CONFLICT_POLICIES:
+        raise ValueError(f"APPLY_CONFLICT_POLICY must be one of {_CONFLICT_POLICIES}, got {policy!r}")
+    baseline = _load_baseline(repo_root) if policy != "ignore" else None
 
-        p = repo_root / rel
-
-        # Optional: allow create new file (off by default)
-        allow_create = bool(getattr(SETTINGS, "ALLOW_CREATE_FILES", False))
-        if not p.exists():
-            if allow_create:
-                # create empty baseline
-                p.parent.mkdir(parents=True, exist_ok=True)
-                original = ""
-            else:
-                results.append({"file": rel, "status": "skipped", "reason": "not found"})
-                continue
-        else:
-            if not p.is_file():
-                results.append({"file": rel, "status": "skipped", "reason": "not a file"})
-                continue
-            if not _ensure_text_allowed(p):
-                results.append({"file": rel, "status": "skipped", "reason": "file type not allowed"})
-                continue
-            original = p.read_text(encoding="utf-8", errors="replace")
+    rows = _prepare_all(repo_root, files, baseline, policy)
+    updates = [r for r in rows if r["status"] == "update"]
+    transactional = bool(getattr(SETTINGS, "APPLY_TRANSACTIONAL", True))
+    transaction: Dict[str, Any] = {"mode": "transactional" if transactional else "per_file"}
+    written: List[Dict[str, Any]] = []
 
-        updated = original
-        op_log: List[Dict[str, Any]] = []
+    if dry_run:
+        results = [_public(r, "would_update") if r["status"] == "update" else r for r in rows]
 
+    elif not transactional:
+        results = []
         try:
-            for op in ops:
-                t = op.get("type")
-                if t == "replace_range":
-                    updated = _replace_range(
-                        updated,
-                        int(op["start_line"]),
-                        int(op["end_line"]),
-                        str(op["new_text"])
-                    )
-                elif t == "delete_range":
-                    updated = _delete_range(updated, int(op["start_line"]), int(op["end_line"]))
-                elif t == "replace_text":
-                    updated = _replace_text(updated, str(op["find"]), str(op["replace"]), op.get("count"))
-                elif t == "insert_after":
-                    updated = _insert_after(updated, str(op["match"]), str(op["insert_text"]), bool(op.get("once", True)))
-                elif t == "insert_before":
-                    updated = _insert_before(updated, str(op["match"]), str(op["insert_text"]), bool(op.get("once", True)))
-                elif t == "append":
-                    updated = _append_text(updated, str(op.get("text", "")))
-                else:
-                    raise ValueError(f"Unknown op type: {t}")
-
-                op_log.append({"type": t, "ok": True})
-        except Exception as e:
-            results.append({"file": rel, "status": "failed", "reason": str(e)})
-            continue
-
-        if updated == original:
-            results.append({"file": rel, "status": "noop", "ops": len(ops)})
-            continue
-
-        diff_txt = _unified_diff(rel, original, updated, context_lines=3)
-        changed_lines = _changed_line_count(original, updated)
-
-        if dry_run:
-            results.append({
-                "file": rel,
-                "status": "would_update",
-                "ops": len(ops),
-                "changed_lines": changed_lines,
-                "diff_unified": diff_txt,
-            })
+            for r in rows:
+                if r["status"] != "update":
+                    results.append(r)
+                    continue
+                store.add_file(manifest, r["file"])
+                _atomic_write(r["_path"], r["_updated"])
+                written.append(r)
+                results.append(_public(r, "updated"))
+        finally:
+            if manifest["files"]:
+                store.save_run(manifest)
+                backup_run = run_id
+
+    else:
+        # skipped entries (missing/unsafe path, not found) are reported and
+        # the rest applied, as before; only failures and conflicts abort
+        bad = [r for r in rows if r["status"] in ("failed", "conflict")]
+        error = ""
+        if bad:
+            error = f"{len(bad)} file(s) failed or conflicted; nothing written"
         else:
-            if p.exists():
-                _backup_file(repo_root, rel, backup_dir)
-            _atomic_write(p, updated)
-            results.append({
-                "file": rel,
-                "status": "updated",
-                "ops": len(ops),
-                "changed_lines": changed_lines,
-                "diff_unified": diff_txt,
-            })
+            try:
+                _commit_all(updates, store, manifest)
+                written = updates
+                if manifest["files"]:
+                    store.save_run(manifest)
+                    backup_run = run_id
+            except Exception as e:
+                error = f"write failed, rolled back: {e}"
+        status = "aborted" if error else "updated"
+        results = [_public(r, status) if r["status"] == "update" else r for r in rows]
+        transaction.update({"committed": not error, "error": error})
 
     log = {
         "run_id": run_id,
         "dry_run": bool(dry_run),
-        "backup_dir": str(backup_dir),
+        "backup_dir": str(store.root),
+        "backup_run": backup_run,
+        "transaction": transaction,
+        "conflict_check": {
+            "policy": policy,
+            "snapshot_id": baseline["snapshot_id"] if baseline else None,
+            "conflicts": [{"file": r["file"], "reason": r["reason"]} for r in rows if r["status"] == "conflict"],
+            "rebased": [r["file"] for r in rows if r.get("rebased")],
+        },
         "results": results
     }
 
-    (state_dir / "last_apply_log.json").write_text(json.dumps(log, indent=2), encoding="utf-8")
+    if backup_run:
+        try:
+            store.gc()
+        except Exception:
+            pass  # never fail an apply over housekeeping
+    if written and baseline is not None:
+        _record_baseline(repo_root, baseline, written)
+    if record:
+        (state_dir / "last_apply_log.json").write_text(json.dumps(log, indent=2), encoding="utf-8")
     return log
+
+
+def score_plan(repo_root: Path, plan: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Dry-runs plan without recording anything. A plan is ok if at least one
+    file would change and no file fails, is skipped or stays a no-op.
+    """
+    try:
+        log = apply_patch_plan(repo_root, plan, dry_run=True, record=False)
+    except Exception as e:
+        return {"ok": False, "changed_lines": 0, "reason": str(e)}
+
+    results = log["results"]
+    updates = [r for r in results if r["status"] == "would_update"]
+    bad = [r for r in results if r["status"] != "would_update"]
+    reason = ""
+    if bad:
+        reason = "; ".join(f"{r['file'] or '?'}: {r['status']}{' (' + r['reason'] + ')' if r.get('reason') else ''}" for r in bad[:3])
+    elif not updates:
+        reason = "no changes"
+    return {
+        "ok": bool(updates) and not bad,
+        "changed_lines": sum(int(r.get("changed_lines", 0)) for r in updates),
+        "files": len(updates),
+        "reason": reason,
+    }
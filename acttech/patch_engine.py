@@ -0,0 +1,258 @@
+from __future__ import annotations
+
+from typing import Dict, Any, List, Optional, Tuple
+
+# ----------------------------
+# Single-pass patch engine
+# ----------------------------
+#
+# A file is split into lines once. Line-range ops (replace_range /
+# delete_range) are validated and applied together against the ORIGINAL line
+# numbering (the numbers the planner saw in the snippets), so earlier inserts
+# never shift later ranges. Content ops (replace_text / insert_* / append)
+# then run in plan order on the line list. The text is joined once at the end;
+# only a replace_text whose `find` spans lines needs an intermediate join.
+
+RANGE_OPS = ("replace_range", "delete_range")
+CONTENT_OPS = ("replace_text", "insert_after", "insert_before", "append")
+
+# everything str.splitlines() treats as a line break
+_BREAKS = frozenset("\n\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029")
+
+
+class PatchError(ValueError):
+    pass
+
+
+def _ends_line(s: str) -> bool:
+    return bool(s) and s[-1] in _BREAKS
+
+
+def _crlf_split(a: str, b: str) -> bool:
+    # a bare "\r" line followed by a "\n" line: str.splitlines() on the
+    # joined text sees one "\r\n" line, so the buffer must too
+    return a.endswith("\r") and b.startswith("\n")
+
+
+class _Lines:
+    """
+    Line accumulator. Text without a trailing line break is carried over and
+    glued to the next line, exactly like joining and re-splitting would.
+    """
+
+    def __init__(self) -> None:
+        self.out: List[str] = []
+        self.carry = ""
+
+    def _extend(self, parts: List[str]) -> None:
+        if parts and self.out and _crlf_split(self.out[-1], parts[0]):
+            self.out[-1] += parts[0]
+            parts = parts[1:]
+        self.out.extend(parts)
+
+    def line(self, ln: str) -> None:
+        if self.carry:
+            ln = self.carry + ln
+            self.carry = ""
+        if _ends_line(ln):
+            self._extend([ln])
+        else:
+            self.carry = ln
+
+    def lines(self, lines: List[str]) -> None:
+        if not lines:
+            return
+        if self.carry:
+            self.line(lines[0])
+            lines = lines[1:]
+            if not lines:
+                return
+        if _ends_line(lines[-1]):
+            self._extend(lines)
+        else:
+            # only a file's last line can lack a break
+            self._extend(lines[:-1])
+            self.carry = lines[-1]
+
+    def text(self, t: str) -> None:
+        if not t:
+            return
+        parts = (self.carry + t).splitlines(True)
+        self.carry = ""
+        if not _ends_line(parts[-1]):
+            self.carry = parts.pop()
+        self._extend(parts)
+
+    def done(self) -> List[str]:
+        if self.carry:
+            self._extend([self.carry])
+            self.carry = ""
+        return self.out
+
+
+# ----------------------------
+# Range ops (original numbering)
+# ----------------------------
+
+def _range_edits(ops: List[Dict[str, Any]], n_lines: int) -> List[Tuple[int, int, str, int]]:
+    """
+    Validated (start, end, new_text, op_index), sorted by start line.
+    end < start marks an insertion at start (only past the last line).
+    """
+    edits: List[Tuple[int, int, str, int]] = []
+    for i, op in enumerate(ops):
+        t = op.get("type")
+        if t not in RANGE_OPS:
+            continue
+        start, end = int(op["start_line"]), int(op["end_line"])
+        if end < start:
+            raise PatchError(f"op {i} ({t}): end_line {end} < start_line {start}")
+        if start > n_lines + 1:
+            raise PatchError(f"op {i} ({t}): start_line {start} is past the end of the file ({n_lines} lines)")
+        s = max(1, start)
+        e = min(n_lines, end)
+        new_text = str(op["new_text"]) if t == "replace_range" else ""
+        edits.append((s, e, new_text, i))
+
+    edits.sort(key=lambda x: (x[0], x[3]))
+    for (s1, e1, _, i1), (s2, e2, _, i2) in zip(edits, edits[1:]):
+        if s2 <= e1:
+            raise PatchError(f"ops {i1} and {i2}: overlapping line ranges {s1}-{e1} and {s2}-{e2}")
+    return edits
+
+
+def _apply_ranges(lines: List[str], edits: List[Tuple[int, int, str, int]]) -> List[str]:
+    acc = _Lines()
+    pos = 1
+    for s, e, new_text, _ in edits:
+        acc.lines(lines[pos - 1:s - 1])
+        acc.text(new_text)
+        pos = max(pos, e + 1)
+    acc.lines(lines[pos - 1:])
+    return acc.done()
+
+
+# ----------------------------
+# Content ops (plan order)
+# ----------------------------
+
+def _splice(lines: List[str], start: int, end: int, text: str) -> int:
+    """
+    In place: lines[start:end] = text, keeping the list normalized (a piece
+    without a trailing break, or a "\r" and "\n" that meet, is glued to its
+    neighbour, as join + re-split would). Returns how many elements the list
+    grew by.
+    """
+    n0 = len(lines)
+    if start > 0 and not _ends_line(lines[start - 1]):
+        # only the last line can lack a break: extend it
+        start -= 1
+        text = lines[start] + text
+    parts = text.splitlines(True)
+    if parts and not _ends_line(parts[-1]) and end < len(lines):
+        parts[-1] += lines[end]
+        end += 1
+    lines[start:end] = parts
+    # the two seams, back to front so the first index stays valid
+    for i in (start + len(parts), start):
+        if 0 < i < len(lines) and _crlf_split(lines[i - 1], lines[i]):
+            lines[i - 1] += lines.pop(i)
+    return len(lines) - n0
+
+
+def _replace_text(lines: List[str], find: str, replace: str, count: Optional[int]) -> List[str]:
+    if not find:
+        raise PatchError("replace_text: empty find")
+    if count is not None and int(count) < 0:
+        count = None  # str.replace semantics: negative = all
+    left = None if count is None else int(count)
+
+    if any(ch in _BREAKS for ch in find):
+        # a match can span lines: rematerialize for this op
+        text = "".join(lines)
+        text = text.replace(find, replace) if left is None else text.replace(find, replace, left)
+        return text.splitlines(True)
+
+    # a match never spans lines, so per-line replace == whole-text replace
+    edits: List[Tuple[int, str]] = []
+    for i in [i for i, ln in enumerate(lines) if find in ln]:
+        if left is not None and left <= 0:
+            break
+        ln = lines[i]
+        if left is None:
+            new = ln.replace(find, replace)
+        else:
+            hits = min(left, ln.count(find))
+            new = ln.replace(find, replace, hits)
+            left -= hits
+        edits.append((i, new))
+
+    # front to back: a line keeps its trailing break, so a splice can only
+    # merge into the (already final) line before it
+    grown = 0
+    for i, new in edits:
+        i += grown
+        if _ends_line(new) and len(new.splitlines()) == 1 and not (i and _crlf_split(lines[i - 1], new)):
+            lines[i] = new
+        else:
+            grown += _splice(lines, i, i + 1, new)
+    return lines
+
+
+def _insert(lines: List[str], match: str, insert_text: str, once: bool, after: bool) -> List[str]:
+    if once:
+        hits = next(([i] for i, ln in enumerate(lines) if match in ln), [])
+    else:
+        hits = [i for i, ln in enumerate(lines) if match in ln]
+    if not insert_text:
+        return lines
+    # back to front, so earlier indices stay valid
+    for i in reversed(hits):
+        at = i + 1 if after else i
+        _splice(lines, at, at, insert_text)
+    return lines
+
+
+def _append(lines: List[str], append_text: str) -> List[str]:
+    # same rule as before: separate with a newline unless either side has one
+    # (note: "" does not end with "\n", so appending to an empty file starts with one)
+    last = lines[-1] if lines else ""
+    if not last.endswith("\n") and append_text and not append_text.startswith("\n"):
+        append_text = "\n" + append_text
+    if append_text:
+        _splice(lines, len(lines), len(lines), append_text)
+    return lines
+
+
+# ----------------------------
+# Entry point
+# ----------------------------
+
+def apply_ops(text: str, ops: List[Dict[str, Any]]) -> Tuple[str, List[Dict[str, Any]]]:
+    """
+    Applies all ops of one file. Returns (updated text, per-op log in plan
+    order). Raises PatchError/KeyError/ValueError on invalid ops; nothing is
+    half-applied since the input text is never modified.
+    """
+    for i, op in enumerate(ops):
+        t = op.get("type")
+        if t not in RANGE_OPS and t not in CONTENT_OPS:
+            raise PatchError(f"Unknown op type: {t}")
+
+    lines = text.splitlines(True)  # the only full split; content ops edit this list in place
+    edits = _range_edits(ops, len(lines))
+    if edits:
+        lines = _apply_ranges(lines, edits)
+
+    for op in ops:
+        t = op.get("type")
+        if t == "replace_text":
+            lines = _replace_text(lines, str(op["find"]), str(op["replace"]), op.get("count"))
+        elif t == "insert_after":
+            lines = _insert(lines, str(op["match"]), str(op["insert_text"]), bool(op.get("once", True)), after=True)
+        elif t == "insert_before":
+            lines = _insert(lines, str(op["match"]), str(op["insert_text"]), bool(op.get("once", True)), after=False)
+        elif t == "append":
+            lines = _append(lines, str(op.get("text", "")))
+
+    return "".join(lines), [{"type": op.get("type"), "ok": True} for op in ops]
@@ -0,0 +1,172 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Any, Optional, List, Tuple
+
+from config import SETTINGS
+
+
+# ----------------------------
+# Layout
+# ----------------------------
+#
+# STATE_DIR/plan_cache/<key[:2]>/<key>.json   one cached plan per request hash
+# STATE_DIR/plan_cache/stats.json              hit/miss/eviction counters
+#
+# The key is content-addressed: sha256 over (model, instructions, schema,
+# trimmed prompt, and for best-of-n plans the candidate count/temperatures), so an unchanged repo + same goal maps to the same entry and
+# any change in context or planner setup is a new key.
+
+_CACHE_VERSION = 1
+
+_lock = threading.Lock()
+
+
+def cache_key(model: str, instructions: str, schema: Dict[str, Any], prompt: str, variant: Any = None) -> str:
+    """
+    variant: anything else that shapes the plan (e.g. candidate count and
+    temperatures); None keeps single-shot keys as they were.
+    """
+    parts: List[Any] = [_CACHE_VERSION, model, instructions, schema, prompt]
+    if variant is not None:
+        parts.append(variant)
+    h = hashlib.sha256()
+    h.update(json.dumps(
+        parts,
+        sort_keys=True,
+        ensure_ascii=False,
+        separators=(",", ":"),
+    ).encode("utf-8"))
+    return h.hexdigest()
+
+
+class PlanCache:
+    """
+    Persistent plan cache in STATE_DIR. Entries expire after
+    PLAN_CACHE_MAX_AGE_SEC; the least recently used ones are evicted when the
+    cache grows past PLAN_CACHE_MAX_MB.
+    """
+
+    def __init__(self, repo_root: Path):
+        self.dir = repo_root / SETTINGS.STATE_DIR / "plan_cache"
+        self.max_age = float(getattr(SETTINGS, "PLAN_CACHE_MAX_AGE_SEC", 7 * 24 * 3600))
+        self.max_bytes = int(float(getattr(SETTINGS, "PLAN_CACHE_MAX_MB", 20)) * 1024 * 1024)
+        # outcome of the last get() on this instance (None = no lookup yet)
+        self.last_hit: Optional[bool] = None
+
+    def _path(self, key: str) -> Path:
+        return self.dir / key[:2] / f"{key}.json"
+
+    # ----------------------------
+    # Counters
+    # ----------------------------
+
+    def _stats_path(self) -> Path:
+        return self.dir / "stats.json"
+
+    def stats(self) -> Dict[str, int]:
+        try:
+            data = json.loads(self._stats_path().read_text(encoding="utf-8"))
+        except Exception:
+            data = {}
+        out = {k: int(data.get(k, 0)) for k in ("hits", "misses", "stores", "evictions")}
+        out["entries"] = sum(1 for _ in self._entries())
+        return out
+
+    def _bump(self, **deltas: int) -> None:
+        with _lock:
+            try:
+                data = json.loads(self._stats_path().read_text(encoding="utf-8"))
+            except Exception:
+                data = {}
+            for k, n in deltas.items():
+                data[k] = int(data.get(k, 0)) + n
+            self._write(self._stats_path(), data)
+
+    # ----------------------------
+    # Get / put
+    # ----------------------------
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        self.last_hit = False
+        p = self._path(key)
+        try:
+            st = p.stat()
+            if self.max_age > 0 and time.time() - st.st_mtime > self.max_age:
+                p.unlink()
+                self._bump(misses=1, evictions=1)
+                return None
+            entry = json.loads(p.read_text(encoding="utf-8"))
+        except Exception:
+            self._bump(misses=1)
+            return None
+
+        plan = entry.get("plan") if isinstance(entry, dict) else None
+        if not isinstance(plan, dict):
+            self._bump(misses=1)
+            return None
+
+        # atime is unreliable (noatime mounts); use mtime as "last used"
+        try:
+            os.utime(p, None)
+        except OSError:
+            pass
+        self.last_hit = True
+        self._bump(hits=1)
+        return plan
+
+    def put(self, key: str, plan: Dict[str, Any], meta: Optional[Dict[str, Any]] = None) -> None:
+        entry = {"version": _CACHE_VERSION, "key": key, "created": time.time(), "meta": meta or {}, "plan": plan}
+        with _lock:
+            self._write(self._path(key), entry)
+        self._bump(stores=1)
+        self.evict()
+
+    def evict(self) -> int:
+        """
+        Drops expired entries, then the least recently used ones until the
+        cache fits PLAN_CACHE_MAX_MB. Returns the number of entries removed.
+        """
+        now = time.time()
+        alive: List[Tuple[float, int, Path]] = []
+        removed = 0
+        with _lock:
+            for p in self._entries():
+                try:
+                    st = p.stat()
+                except OSError:
+                    continue
+                if self.max_age > 0 and now - st.st_mtime > self.max_age:
+                    p.unlink(missing_ok=True)
+                    removed += 1
+                else:
+                    alive.append((st.st_mtime, st.st_size, p))
+
+            total = sum(size for _, size, _ in alive)
+            alive.sort()
+            for _, size, p in alive:
+                if total <= self.max_bytes:
+                    break
+                p.unlink(missing_ok=True)
+                total -= size
+                removed += 1
+        if removed:
+            self._bump(evictions=removed)
+        return removed
+
+    def _entries(self):
+        if not self.dir.exists():
+            return iter(())
+        return self.dir.glob("??/*.json")
+
+    @staticmethod
+    def _write(p: Path, data: Dict[str, Any]) -> None:
+        p.parent.mkdir(parents=True, exist_ok=True)
+        tmp = p.with_suffix(p.suffix + f".{os.getpid()}.tmp")
+        tmp.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+        tmp.replace(p)
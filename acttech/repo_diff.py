@@ -2,7 +2,9 @@ from __future__ import annotations
 
 from collections import Counter, defaultdict
 from pathlib import Path
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional
+
+from repo_store import diff_snapshots
 
 
 def _index(repo_map: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
@@ -61,6 +63,44 @@ def diff_maps(before: Dict[str, Any], after: Dict[str, Any]) -> Dict[str, Any]:
         if p in b and a[p].get("sha256") != b[p].get("sha256")
     ])
 
+    return _build_diff(added, removed, modified, b, a, after.get("repo_root"), after.get("generated_at"))
+
+
+def diff_store(repo_root: Path, before_label: str = "before", after_label: str = "after") -> Optional[Dict[str, Any]]:
+    """
+    Same result as diff_maps, but the set difference runs in SQL against the
+    repo store, so only changed rows are loaded. None if a snapshot is missing.
+    """
+    d = diff_snapshots(repo_root, before_label, after_label)
+    if d is None:
+        return None
+
+    b: Dict[str, Dict[str, Any]] = {}
+    a: Dict[str, Dict[str, Any]] = {}
+    for r in d["added"]:
+        a[r["path"]] = r
+    for r in d["removed"]:
+        b[r["path"]] = r
+    for r in d["modified"]:
+        b[r["path"]] = r["before"]
+        a[r["path"]] = r["after"]
+
+    added = [r["path"] for r in d["added"]]
+    removed = [r["path"] for r in d["removed"]]
+    modified = [r["path"] for r in d["modified"]]
+
+    return _build_diff(added, removed, modified, b, a, d.get("repo_root"), d.get("generated_at"))
+
+
+def _build_diff(
+    added: List[str],
+    removed: List[str],
+    modified: List[str],
+    b: Dict[str, Dict[str, Any]],
+    a: Dict[str, Dict[str, Any]],
+    repo_root: Optional[str],
+    generated_at: Optional[str],
+) -> Dict[str, Any]:
     changed_all = added + removed + modified
 
     dir_summary = _top_dirs(changed_all, k=10)
@@ -92,8 +132,8 @@ def diff_maps(before: Dict[str, Any], after: Dict[str, Any]) -> Dict[str, Any]:
     )
 
     return {
-        "repo_root": after.get("repo_root"),
-        "generated_at": after.get("generated_at"),
+        "repo_root": repo_root,
+        "generated_at": generated_at,
 
         "added": added,
         "removed": removed,
@@ -2,10 +2,14 @@ from __future__ import annotations
 
 import os
 import re
+import json
+import stat
 import time
 import hashlib
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from pathlib import Path
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Tuple
 
 from config import SETTINGS
 
@@ -17,15 +21,6 @@ from config import SETTINGS
 def _is_probably_binary(b: bytes) -> bool:
     return b"\x00" in b[:2048]
 
-def _safe_read_text(p: Path) -> Optional[str]:
-    try:
-        b = p.read_bytes()
-        if _is_probably_binary(b):
-            return None
-        return b.decode("utf-8", errors="replace")
-    except Exception:
-        return None
-
 def _sha256_text(t: str) -> str:
     return hashlib.sha256(t.encode("utf-8", errors="replace")).hexdigest()
 
@@ -118,67 +113,395 @@ def _extract_symbols(text: str, lang: str, max_items: int = 40) -> List[Dict[str
 
 
 # ----------------------------
-# Main scan
+# Per-file entry
 # ----------------------------
 
-def scan_repo(repo_root: Path) -> Dict[str, Any]:
-    root = repo_root.resolve()
-    files: List[Dict[str, Any]] = []
-
+def _scan_options() -> Dict[str, Any]:
     # New optional tuning knobs (fallback defaults if not in config)
-    max_file_mb = float(getattr(SETTINGS, "MAX_FILE_MB", 1.0))
-    peek_head_chars = int(getattr(SETTINGS, "PEEK_HEAD_CHARS", 2200))
-    peek_tail_chars = int(getattr(SETTINGS, "PEEK_TAIL_CHARS", 1400))
-    enable_symbols = bool(getattr(SETTINGS, "ENABLE_SYMBOLS", True))
+    return {
+        "max_file_mb": float(getattr(SETTINGS, "MAX_FILE_MB", 1.0)),
+        "peek_head_chars": int(getattr(SETTINGS, "PEEK_HEAD_CHARS", 2200)),
+        "peek_tail_chars": int(getattr(SETTINGS, "PEEK_TAIL_CHARS", 1400)),
+        "enable_symbols": bool(getattr(SETTINGS, "ENABLE_SYMBOLS", True)),
+    }
 
-    for dirpath, dirnames, filenames in os.walk(root):
-        dirnames[:] = [d for d in dirnames if d not in SETTINGS.IGNORE_DIRS]
+def _read_file_obj(p: Path, rel: str, ext: str, st: os.stat_result, opts: Dict[str, Any]) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    """
+    I/O-bound part of an entry (read, decode, hash, peek). Returns (file_obj, text)
+    so the caller can decide where symbol extraction runs; (None, None) for
+    binary content. Read errors propagate, so callers can tell an unreadable
+    file (retry next scan) from a binary one (cacheable).
+    """
+    b = p.read_bytes()
+    if _is_probably_binary(b):
+        return None, None
+    text = b.decode("utf-8", errors="replace")
+
+    lang = _lang_from_ext(ext)
+    peek = _peek(text, head_chars=opts["peek_head_chars"], tail_chars=opts["peek_tail_chars"])
+
+    file_obj: Dict[str, Any] = {
+        # original fields (backwards compatible)
+        "path": rel,
+        "ext": ext,
+        "size": int(st.st_size),
+        "mtime": float(st.st_mtime),
+        "lines": int(text.count("\n") + 1),
+        "sha256": _sha256_text(text),
+
+        # new "Replit-like IDE intelligence"
+        "lang": lang,
+        "is_entrypoint": _is_entrypoint(rel),
+        "peek_head": peek["peek_head"],
+        "peek_tail": peek["peek_tail"],
+    }
+    return file_obj, text
 
-        for fn in filenames:
-            p = Path(dirpath) / fn
-            rel = p.relative_to(root).as_posix()
-            ext = p.suffix.lower()
+def _build_file_obj(p: Path, rel: str, ext: str, st: os.stat_result, opts: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    file_obj, text = _read_file_obj(p, rel, ext, st, opts)
+    if file_obj is None:
+        return None
+    if opts["enable_symbols"]:
+        file_obj["symbols"] = _extract_symbols(text, file_obj["lang"])
+    return file_obj
 
-            if ext not in SETTINGS.TEXT_EXT:
-                continue
 
-            try:
-                st = p.stat()
-                if st.st_size > max_file_mb * 1024 * 1024:
-                    continue
-
-                text = _safe_read_text(p)
-                if text is None:
-                    continue
-
-                lang = _lang_from_ext(ext)
-                peek = _peek(text, head_chars=peek_head_chars, tail_chars=peek_tail_chars)
-
-                file_obj: Dict[str, Any] = {
-                    # original fields (backwards compatible)
-                    "path": rel,
-                    "ext": ext,
-                    "size": int(st.st_size),
-                    "mtime": float(st.st_mtime),
-                    "lines": int(text.count("\n") + 1),
-                    "sha256": _sha256_text(text),
-
-                    # new "Replit-like IDE intelligence"
-                    "lang": lang,
-                    "is_entrypoint": _is_entrypoint(rel),
-                    "peek_head": peek["peek_head"],
-                    "peek_tail": peek["peek_tail"],
-                }
-
-                if enable_symbols:
-                    file_obj["symbols"] = _extract_symbols(text, lang)
-
-                files.append(file_obj)
+# ----------------------------
+# Stat cache (skip unchanged files)
+# ----------------------------
+
+_CACHE_VERSION = 1
+
+# Files touched this close to the scan start may still change within the same
+# mtime tick, so they are never trusted from (or written to) the cache.
+_RACY_WINDOW_NS = 2_000_000_000
+
+def _stat_key(st: os.stat_result) -> List[int]:
+    return [int(st.st_size), int(st.st_mtime_ns), int(st.st_ino)]
+
+def _stat_cache_path(root: Path) -> Path:
+    return root / SETTINGS.STATE_DIR / "scan_cache.json"
 
+def _load_stat_cache(root: Path, opts: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Returns {rel: {"stat": [size, mtime_ns, ino], "file": file_obj | None}}.
+    A cache written with different scan options is discarded as a whole.
+    """
+    p = _stat_cache_path(root)
+    try:
+        data = json.loads(p.read_text(encoding="utf-8"))
+    except Exception:
+        return {}
+    if not isinstance(data, dict) or data.get("version") != _CACHE_VERSION or data.get("options") != opts:
+        return {}
+    files = data.get("files")
+    return files if isinstance(files, dict) else {}
+
+def _save_stat_cache(root: Path, opts: Dict[str, Any], entries: Dict[str, Any]) -> None:
+    p = _stat_cache_path(root)
+    try:
+        p.parent.mkdir(parents=True, exist_ok=True)
+        tmp = p.with_suffix(p.suffix + ".tmp")
+        tmp.write_text(
+            json.dumps({"version": _CACHE_VERSION, "options": opts, "files": entries}, separators=(",", ":")),
+            encoding="utf-8",
+        )
+        tmp.replace(p)
+    except Exception:
+        # cache is an optimization only
+        pass
+
+
+# ----------------------------
+# Parallel read of cache misses
+# ----------------------------
+
+def _scan_workers() -> int:
+    """
+    SCAN_WORKERS: 0 = auto, 1 = serial (no pool), N = thread pool size.
+    """
+    n = int(getattr(SETTINGS, "SCAN_WORKERS", 0) or 0)
+    if n <= 0:
+        n = min(32, (os.cpu_count() or 1) + 4)
+    return max(1, n)
+
+def _build_many(jobs: List[Tuple[Path, str, str, os.stat_result]], opts: Dict[str, Any]) -> List[Tuple[Optional[Dict[str, Any]], bool]]:
+    """
+    Builds entries for cache misses, in input order, as (file_obj, read_ok).
+    read_ok is False when reading raised (permissions, I/O error, a lock):
+    such files are left out of the map but not cached as binary.
+    - serial when SCAN_WORKERS=1 or there is little to do
+    - thread pool for reading/hashing
+    - optional process pool (SCAN_SYMBOL_PROCESSES) for symbol extraction
+    """
+    workers = _scan_workers()
+    if workers <= 1 or len(jobs) < 2:
+        out: List[Tuple[Optional[Dict[str, Any]], bool]] = []
+        for p, rel, ext, st in jobs:
+            try:
+                out.append((_build_file_obj(p, rel, ext, st, opts), True))
             except Exception:
+                out.append((None, False))
+        return out
+
+    procs = int(getattr(SETTINGS, "SCAN_SYMBOL_PROCESSES", 0) or 0)
+    use_procs = procs > 0 and opts["enable_symbols"]
+
+    def read_one(job: Tuple[Path, str, str, os.stat_result]) -> Tuple[Optional[Dict[str, Any]], Optional[str], bool]:
+        p, rel, ext, st = job
+        try:
+            if use_procs:
+                return (*_read_file_obj(p, rel, ext, st, opts), True)
+            return _build_file_obj(p, rel, ext, st, opts), None, True
+        except Exception:
+            return None, None, False
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="scan") as pool:
+        read = list(pool.map(read_one, jobs))
+
+    if not use_procs:
+        return [(obj, ok) for obj, _, ok in read]
+
+    pending = [(obj, text) for obj, text, _ in read if obj is not None]
+    texts = [text for _, text in pending]
+    langs = [obj["lang"] for obj, _ in pending]
+    try:
+        with ProcessPoolExecutor(max_workers=procs) as pool:
+            symbols = list(pool.map(_extract_symbols, texts, langs, chunksize=32))
+    except Exception:
+        # no usable process pool (sandbox, no /dev/shm, spawn failure): use threads
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="scan") as pool:
+            symbols = list(pool.map(_extract_symbols, texts, langs))
+    for (obj, _), syms in zip(pending, symbols):
+        obj["symbols"] = syms
+    return [(obj, ok) for obj, _, ok in read]
+
+
+# ----------------------------
+# Candidate listing: os.walk or git index
+# ----------------------------
+
+def _walk_rels(root: Path, base: Path) -> List[str]:
+    out: List[str] = []
+    for dirpath, dirnames, filenames in os.walk(base):
+        dirnames[:] = [d for d in dirnames if d not in SETTINGS.IGNORE_DIRS]
+        for fn in filenames:
+            if Path(fn).suffix.lower() not in SETTINGS.TEXT_EXT:
+                continue
+            out.append((Path(dirpath) / fn).relative_to(root).as_posix())
+    return out
+
+def _git(root: Path, *args: str) -> Optional[bytes]:
+    try:
+        p = subprocess.run(
+            ["git", "--no-optional-locks", *args],
+            cwd=str(root),
+            capture_output=True,
+            timeout=60,
+        )
+    except Exception:
+        return None
+    if p.returncode != 0:
+        return None
+    return p.stdout
+
+def _git_candidates(root: Path) -> Optional[List[Tuple[str, Optional[str]]]]:
+    """
+    Lists scan candidates from the git index: [(rel, blob_id | None)].
+    blob_id is set only for tracked files git reports as clean, so their
+    content is known without reading them. Dirty, untracked and special
+    entries (symlinks, submodules, nested repos) get None and go through the
+    normal stat/read path. Returns None if root is not inside a git work tree.
+    Gitignored files are listed too (like the walk, only IGNORE_DIRS and
+    TEXT_EXT decide): ignored directories are walked with the same pruning.
+    """
+    prefix_out = _git(root, "rev-parse", "--show-prefix")
+    if prefix_out is None:
+        return None
+    prefix = prefix_out.decode("utf-8", errors="surrogateescape").strip()
+
+    ls = _git(root, "ls-files", "-s", "-z")
+    status = _git(root, "status", "--porcelain=v2", "-z", "--untracked-files=all", "--ignored=matching", ".")
+    if ls is None or status is None:
+        return None
+
+    def dec(b: bytes) -> str:
+        return b.decode("utf-8", errors="surrogateescape")
+
+    # git status paths are relative to the top level
+    def strip_prefix(path: str) -> Optional[str]:
+        if not prefix:
+            return path
+        return path[len(prefix):] if path.startswith(prefix) else None
+
+    dirty: set = set()
+    extra_dirs: List[str] = []
+    recs = status.split(b"\0")
+    i = 0
+    while i < len(recs):
+        rec = dec(recs[i])
+        i += 1
+        if not rec:
+            continue
+        kind = rec[0]
+        if kind == "1":
+            path = rec.split(" ", 8)[8]
+        elif kind == "2":
+            path = rec.split(" ", 9)[9]
+            i += 1  # original path of the rename/copy follows
+        elif kind == "u":
+            path = rec.split(" ", 10)[10]
+        elif kind in ("?", "!"):
+            path = rec[2:]
+        else:
+            continue
+        rel = strip_prefix(path)
+        if rel is None:
+            continue
+        if rel.endswith("/"):
+            # untracked nested repository or ignored directory: git does not descend into it
+            extra_dirs.append(rel.rstrip("/"))
+        else:
+            dirty.add(rel)
+
+    out: List[Tuple[str, Optional[str]]] = []
+    seen: set = set()
+    for rec in ls.split(b"\0"):
+        if not rec:
+            continue
+        meta, _, path = dec(rec).partition("\t")
+        mode, blob, stage = meta.split(" ")
+        if mode == "160000":
+            extra_dirs.append(path)
+            continue
+        if path in seen:
+            continue  # unmerged paths appear once per stage
+        seen.add(path)
+        clean = mode in ("100644", "100755") and stage == "0" and path not in dirty
+        out.append((path, blob if clean else None))
+        dirty.discard(path)
+
+    # untracked files
+    for rel in sorted(dirty):
+        if rel not in seen:
+            out.append((rel, None))
+            seen.add(rel)
+
+    for d in extra_dirs:
+        base = root / d
+        if base.is_dir() and not any(part in SETTINGS.IGNORE_DIRS for part in d.split("/")):
+            for rel in _walk_rels(root, base):
+                if rel not in seen:
+                    seen.add(rel)
+                    out.append((rel, None))
+
+    return [(rel, blob) for rel, blob in out if is_scannable_rel(rel)]
+
+def _scan_backend() -> str:
+    """
+    SCAN_BACKEND: "auto" (git index when available), "git" or "walk".
+    """
+    return str(getattr(SETTINGS, "SCAN_BACKEND", "auto") or "auto").lower()
+
+
+# ----------------------------
+# Main scan
+# ----------------------------
+
+def scan_repo(repo_root: Path, use_cache: Optional[bool] = None) -> Dict[str, Any]:
+    """
+    Builds the repo map.
+    - candidates come from the git index on git checkouts (SCAN_BACKEND), else os.walk
+    - clean tracked files whose git blob id matches the cache are reused without
+      being stat'ed or opened
+    - other files whose (size, mtime_ns, inode) match the previous scan reuse
+      their cached entry without being opened
+    - cache misses are read in parallel (see SCAN_WORKERS); output is sorted by path
+    """
+    root = repo_root.resolve()
+    files: List[Dict[str, Any]] = []
+
+    opts = _scan_options()
+    if use_cache is None:
+        use_cache = bool(getattr(SETTINGS, "SCAN_CACHE", True))
+
+    backend = _scan_backend()
+    candidates = _git_candidates(root) if backend in ("auto", "git") else None
+    if candidates is None:
+        backend = "walk"
+        candidates = [(rel, None) for rel in _walk_rels(root, root)]
+    else:
+        backend = "git"
+
+    old_cache = _load_stat_cache(root, opts) if use_cache else {}
+    new_cache: Dict[str, Any] = {}
+    hits = 0
+    racy_after_ns = time.time_ns() - _RACY_WINDOW_NS
+
+    # (path, rel, ext, stat, blob, cacheable) for files that must be read
+    misses: List[Tuple[Path, str, str, os.stat_result, Optional[str], bool]] = []
+
+    for rel, blob in candidates:
+        p = root / rel
+        ext = p.suffix.lower()
+        cached = old_cache.get(rel)
+
+        if blob is not None and cached is not None and cached.get("blob") == blob:
+            # git vouches the content is unchanged
+            hits += 1
+            new_cache[rel] = cached
+            if cached.get("file") is not None:
+                files.append(cached["file"])
+            continue
+
+        try:
+            st = p.stat()
+            if not stat.S_ISREG(st.st_mode) or st.st_size > opts["max_file_mb"] * 1024 * 1024:
                 continue
 
-    files.sort(key=lambda x: x["path"])
+            key = _stat_key(st)
+            racy = st.st_mtime_ns >= racy_after_ns
+
+            if cached is not None and not racy and cached.get("stat") == key:
+                hits += 1
+                file_obj = cached.get("file")
+                new_cache[rel] = {"stat": key, "blob": blob, "file": file_obj}
+                if file_obj is not None:
+                    files.append(file_obj)
+            else:
+                misses.append((p, rel, ext, st, blob, use_cache and not racy))
+
+        except Exception:
+            continue
+
+    built = _build_many([(p, rel, ext, st) for p, rel, ext, st, _, _ in misses], opts)
+    for (p, rel, ext, st, blob, cacheable), (file_obj, read_ok) in zip(misses, built):
+        if cacheable and read_ok:
+            # binary files are cached too (file=None) so they are not re-read;
+            # unreadable ones are not, so the next scan tries them again
+            new_cache[rel] = {"stat": _stat_key(st), "blob": blob, "file": file_obj}
+        if file_obj is not None:
+            files.append(file_obj)
+
+    if use_cache:
+        _save_stat_cache(root, opts, new_cache)
+
+    out = build_repo_map(root, files)
+    out["cache"] = {
+        "enabled": bool(use_cache),
+        "hits": hits,
+        "misses": len(misses),
+        "backend": backend,
+    }
+    return out
+
+
+def build_repo_map(root: Path, files: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Assembles the repo map (sorted files + summary) from file entries.
+    Shared by the full scan and the live watcher.
+    """
+    files = sorted(files, key=lambda x: x["path"])
 
     # Summary metrics (nice for UI)
     entrypoints = [f["path"] for f in files if f.get("is_entrypoint")]
@@ -194,5 +517,33 @@ def scan_repo(repo_root: Path) -> Dict[str, Any]:
         "summary": {
             "entrypoints": entrypoints[:20],
             "languages": langs,
-        }
+        },
     }
+
+
+def is_scannable_rel(rel: str) -> bool:
+    """
+    Same filter as the walk: allowed extension and no ignored directory on the way.
+    """
+    parts = rel.split("/")
+    if any(d in SETTINGS.IGNORE_DIRS for d in parts[:-1]):
+        return False
+    return Path(rel).suffix.lower() in SETTINGS.TEXT_EXT
+
+
+def scan_file(root: Path, rel: str) -> Optional[Dict[str, Any]]:
+    """
+    Builds the entry of a single file, or None if it is missing, ignored,
+    too large or binary.
+    """
+    if not is_scannable_rel(rel):
+        return None
+    p = root / rel
+    opts = _scan_options()
+    try:
+        st = p.stat()
+        if not p.is_file() or st.st_size > opts["max_file_mb"] * 1024 * 1024:
+            return None
+        return _build_file_obj(p, rel, p.suffix.lower(), st, opts)
+    except Exception:
+        return None
@@ -0,0 +1,250 @@
+from __future__ import annotations
+
+import json
+import sqlite3
+import time
+from contextlib import closing
+from pathlib import Path
+from typing import Dict, Any, Optional, List, Sequence
+
+from config import SETTINGS
+
+
+# ----------------------------
+# Layout
+# ----------------------------
+#
+# snapshots: one row per saved scan, tagged with a label ("before" / "after").
+#            Only the latest snapshot per label is kept.
+# files:     one row per file per snapshot (metadata only).
+# contents:  peek_head/peek_tail/symbols, stored once per sha256 and shared
+#            between snapshots, so unchanged files cost no extra space.
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    label TEXT NOT NULL,
+    repo_root TEXT,
+    generated_at TEXT,
+    file_count INTEGER,
+    summary TEXT,
+    created REAL
+);
+CREATE INDEX IF NOT EXISTS snapshots_label ON snapshots(label, id);
+
+CREATE TABLE IF NOT EXISTS files (
+    snapshot_id INTEGER NOT NULL,
+    path TEXT NOT NULL,
+    ext TEXT,
+    size INTEGER,
+    mtime REAL,
+    lines INTEGER,
+    sha256 TEXT,
+    lang TEXT,
+    is_entrypoint INTEGER,
+    PRIMARY KEY (snapshot_id, path)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS files_sha ON files(sha256);
+
+CREATE TABLE IF NOT EXISTS contents (
+    sha256 TEXT PRIMARY KEY,
+    peek_head TEXT,
+    peek_tail TEXT,
+    symbols TEXT
+) WITHOUT ROWID;
+"""
+
+FILE_COLUMNS = ("path", "ext", "size", "mtime", "lines", "sha256", "lang", "is_entrypoint")
+CONTENT_COLUMNS = ("peek_head", "peek_tail", "symbols")
+ALL_COLUMNS = FILE_COLUMNS + CONTENT_COLUMNS
+
+
+def store_path(repo_root: Path) -> Path:
+    return repo_root / SETTINGS.STATE_DIR / "repo_store.sqlite3"
+
+
+def connect(repo_root: Path) -> sqlite3.Connection:
+    p = store_path(repo_root)
+    p.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(str(p), timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(_SCHEMA)
+    return conn
+
+
+# ----------------------------
+# Write
+# ----------------------------
+
+def save_snapshot(repo_root: Path, label: str, repo_map: Dict[str, Any]) -> int:
+    """
+    Stores a repo map (as returned by scan_repo) under label and drops the
+    previous snapshot with the same label. Returns the new snapshot id.
+    """
+    files = repo_map.get("files", []) or []
+    with closing(connect(repo_root)) as conn, conn:
+        cur = conn.execute(
+            "INSERT INTO snapshots(label, repo_root, generated_at, file_count, summary, created) VALUES (?,?,?,?,?,?)",
+            (
+                label,
+                repo_map.get("repo_root"),
+                repo_map.get("generated_at"),
+                int(repo_map.get("file_count", len(files))),
+                json.dumps(repo_map.get("summary") or {}),
+                time.time(),
+            ),
+        )
+        sid = int(cur.lastrowid)
+
+        conn.executemany(
+            "INSERT OR REPLACE INTO files(snapshot_id, path, ext, size, mtime, lines, sha256, lang, is_entrypoint) "
+            "VALUES (?,?,?,?,?,?,?,?,?)",
+            (
+                (
+                    sid,
+                    f["path"],
+                    f.get("ext"),
+                    f.get("size"),
+                    f.get("mtime"),
+                    f.get("lines"),
+                    f.get("sha256"),
+                    f.get("lang"),
+                    1 if f.get("is_entrypoint") else 0,
+                )
+                for f in files if f.get("path")
+            ),
+        )
+        conn.executemany(
+            "INSERT OR REPLACE INTO contents(sha256, peek_head, peek_tail, symbols) VALUES (?,?,?,?)",
+            (
+                (
+                    f["sha256"],
+                    f.get("peek_head", ""),
+                    f.get("peek_tail", ""),
+                    json.dumps(f["symbols"]) if "symbols" in f else None,
+                )
+                for f in files if f.get("sha256")
+            ),
+        )
+
+        old = [r[0] for r in conn.execute("SELECT id FROM snapshots WHERE label = ? AND id < ?", (label, sid))]
+        for oid in old:
+            conn.execute("DELETE FROM files WHERE snapshot_id = ?", (oid,))
+            conn.execute("DELETE FROM snapshots WHERE id = ?", (oid,))
+        if old:
+            conn.execute("DELETE FROM contents WHERE sha256 NOT IN (SELECT sha256 FROM files)")
+    return sid
+
+
+# ----------------------------
+# Read
+# ----------------------------
+
+def latest_snapshot_id(repo_root: Path, label: str) -> Optional[int]:
+    if not store_path(repo_root).exists():
+        return None
+    with closing(connect(repo_root)) as conn:
+        row = conn.execute("SELECT MAX(id) FROM snapshots WHERE label = ?", (label,)).fetchone()
+    return int(row[0]) if row and row[0] is not None else None
+
+
+def has_snapshot(repo_root: Path, label: str) -> bool:
+    return latest_snapshot_id(repo_root, label) is not None
+
+
+def load_repo_map(repo_root: Path, label: str, columns: Optional[Sequence[str]] = None) -> Optional[Dict[str, Any]]:
+    """
+    Rebuilds a repo map for the latest snapshot with label, reading only the
+    requested file columns (default: all, including peeks and symbols).
+    Returns None if there is no such snapshot.
+    """
+    cols = list(columns or ALL_COLUMNS)
+    bad = [c for c in cols if c not in ALL_COLUMNS]
+    if bad:
+        raise ValueError(f"Unknown repo map columns: {bad}")
+    if "path" not in cols:
+        cols.insert(0, "path")
+
+    sid = latest_snapshot_id(repo_root, label)
+    if sid is None:
+        return None
+
+    need_contents = any(c in CONTENT_COLUMNS for c in cols)
+    select = ", ".join(("c." if c in CONTENT_COLUMNS else "f.") + c for c in cols)
+    sql = f"SELECT {select} FROM files f "
+    if need_contents:
+        sql += "LEFT JOIN contents c ON c.sha256 = f.sha256 "
+    sql += "WHERE f.snapshot_id = ? ORDER BY f.path"
+
+    with closing(connect(repo_root)) as conn:
+        snap = conn.execute(
+            "SELECT repo_root, generated_at, file_count, summary FROM snapshots WHERE id = ?", (sid,)
+        ).fetchone()
+        rows = conn.execute(sql, (sid,)).fetchall()
+
+    files: List[Dict[str, Any]] = []
+    for row in rows:
+        f = dict(zip(cols, row))
+        if "is_entrypoint" in f:
+            f["is_entrypoint"] = bool(f["is_entrypoint"])
+        if "symbols" in f:
+            if f["symbols"] is None:
+                del f["symbols"]
+            else:
+                f["symbols"] = json.loads(f["symbols"])
+        files.append(f)
+
+    return {
+        "repo_root": snap[0],
+        "generated_at": snap[1],
+        "file_count": snap[2],
+        "files": files,
+        "summary": json.loads(snap[3] or "{}"),
+        "snapshot_id": sid,
+    }
+
+
+def diff_snapshots(repo_root: Path, before_label: str = "before", after_label: str = "after") -> Optional[Dict[str, Any]]:
+    """
+    Set difference of two snapshots, computed in SQL.
+    Returns added/removed/modified rows with just the columns diffs need,
+    or None if either snapshot is missing.
+    """
+    b = latest_snapshot_id(repo_root, before_label)
+    a = latest_snapshot_id(repo_root, after_label)
+    if a is None or b is None:
+        return None
+
+    with closing(connect(repo_root)) as conn:
+        added = conn.execute(
+            "SELECT a.path, a.sha256, a.lines FROM files a "
+            "WHERE a.snapshot_id = ? AND NOT EXISTS "
+            "(SELECT 1 FROM files b WHERE b.snapshot_id = ? AND b.path = a.path) ORDER BY a.path",
+            (a, b),
+        ).fetchall()
+        removed = conn.execute(
+            "SELECT b.path, b.sha256, b.lines FROM files b "
+            "WHERE b.snapshot_id = ? AND NOT EXISTS "
+            "(SELECT 1 FROM files a WHERE a.snapshot_id = ? AND a.path = b.path) ORDER BY b.path",
+            (b, a),
+        ).fetchall()
+        modified = conn.execute(
+            "SELECT a.path, b.sha256, b.lines, a.sha256, a.lines FROM files a "
+            "JOIN files b ON b.snapshot_id = ? AND b.path = a.path "
+            "WHERE a.snapshot_id = ? AND a.sha256 IS NOT b.sha256 ORDER BY a.path",
+            (b, a),
+        ).fetchall()
+        snap = conn.execute("SELECT repo_root, generated_at FROM snapshots WHERE id = ?", (a,)).fetchone()
+
+    return {
+        "repo_root": snap[0],
+        "generated_at": snap[1],
+        "added": [{"path": r[0], "sha256": r[1], "lines": r[2]} for r in added],
+        "removed": [{"path": r[0], "sha256": r[1], "lines": r[2]} for r in removed],
+        "modified": [
+            {"path": r[0], "before": {"sha256": r[1], "lines": r[2]}, "after": {"sha256": r[3], "lines": r[4]}}
+            for r in modified
+        ],
+    }
+
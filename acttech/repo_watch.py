@@ -0,0 +1,384 @@
+from __future__ import annotations
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, Any, Optional, List, Set, Tuple
+
+from config import SETTINGS
+from repo_scan import scan_repo, scan_file, build_repo_map, is_scannable_rel
+
+
+# ----------------------------
+# inotify (Linux, via libc)
+# ----------------------------
+
+_IN_MODIFY = 0x00000002
+_IN_ATTRIB = 0x00000004
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_DELETE_SELF = 0x00000400
+_IN_MOVE_SELF = 0x00000800
+_IN_Q_OVERFLOW = 0x00004000
+_IN_IGNORED = 0x00008000
+_IN_ONLYDIR = 0x01000000
+_IN_ISDIR = 0x40000000
+_IN_NONBLOCK = 0o4000
+_IN_CLOEXEC = 0o2000000
+
+_WATCH_MASK = (
+    _IN_MODIFY | _IN_ATTRIB | _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO |
+    _IN_CREATE | _IN_DELETE | _IN_DELETE_SELF | _IN_MOVE_SELF | _IN_ONLYDIR
+)
+
+_EVENT_HDR = struct.Struct("iIII")
+
+
+class _Inotify:
+    """
+    Minimal inotify binding: one watch per directory, raw event decoding.
+    """
+
+    def __init__(self) -> None:
+        name = ctypes.util.find_library("c") or "libc.so.6"
+        self._libc = ctypes.CDLL(name, use_errno=True)
+        fd = self._libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.fd = fd
+
+    def add_watch(self, path: Path) -> int:
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(str(path)), _WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, f"inotify_add_watch failed: {os.strerror(err)}", str(path))
+        return wd
+
+    def read_events(self, timeout: float) -> List[Tuple[int, int, str]]:
+        """
+        Returns [(wd, mask, name)] or [] on timeout.
+        """
+        r, _, _ = select.select([self.fd], [], [], timeout)
+        if not r:
+            return []
+        try:
+            buf = os.read(self.fd, 256 * 1024)
+        except BlockingIOError:
+            return []
+        out: List[Tuple[int, int, str]] = []
+        i = 0
+        while i + _EVENT_HDR.size <= len(buf):
+            wd, mask, _cookie, ln = _EVENT_HDR.unpack_from(buf, i)
+            i += _EVENT_HDR.size
+            name = buf[i:i + ln].rstrip(b"\0").decode("utf-8", errors="surrogateescape")
+            i += ln
+            out.append((wd, mask, name))
+        return out
+
+    def close(self) -> None:
+        try:
+            os.close(self.fd)
+        except OSError:
+            pass
+
+
+# ----------------------------
+# Watcher
+# ----------------------------
+
+def _join(rel_dir: str, name: str) -> str:
+    return f"{rel_dir}/{name}" if rel_dir else name
+
+
+class RepoWatcher:
+    """
+    Keeps an in-memory repo map live in a background thread.
+    - inotify on Linux, stat polling elsewhere (or if inotify is unavailable)
+    - events only mark paths dirty; bursts (e.g. git checkout) are coalesced and
+      applied once things are quiet for WATCH_DEBOUNCE_SEC
+    - snapshot() flushes pending paths and returns a repo map like scan_repo()
+    - listeners get (paths, dirs) after every flush; paths=None after a full rescan
+    """
+
+    def __init__(self, root: Path) -> None:
+        self.root = root.resolve()
+        self.backend = ""
+        self.debounce_sec = float(getattr(SETTINGS, "WATCH_DEBOUNCE_SEC", 0.3))
+        self.max_delay_sec = max(self.debounce_sec, float(getattr(SETTINGS, "WATCH_MAX_DELAY_SEC", 3.0)))
+        self.poll_sec = float(getattr(SETTINGS, "WATCH_POLL_SEC", 2.0))
+
+        self._lock = threading.RLock()
+        self._files: Dict[str, Dict[str, Any]] = {}
+        self._pending: Set[str] = set()
+        self._pending_dirs: Set[str] = set()
+        self._first_pending_at = 0.0
+        self._last_event_at = 0.0
+        self._needs_rescan = False
+
+        self._ready = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._ino: Optional[_Inotify] = None
+        self._wd_to_dir: Dict[int, str] = {}
+        self._poll_stats: Dict[str, Tuple[int, int, int]] = {}
+        self._listeners: List[Callable[[Optional[Set[str]], Set[str]], None]] = []
+
+        self.applied_paths = 0
+        self.error = ""
+
+    # ---- lifecycle ----
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="repo-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        if self._ino is not None:
+            self._ino.close()
+            self._ino = None
+
+    def add_listener(self, fn: Callable[[Optional[Set[str]], Set[str]], None]) -> None:
+        """
+        fn(paths, dirs) runs on the watcher thread (under its lock) after each
+        flush: the changed file paths and the dirs that were created/removed.
+        paths is None after a full rescan (anything may have changed).
+        """
+        self._listeners.append(fn)
+
+    def is_ready(self) -> bool:
+        return self._ready.is_set() and not self._stop.is_set()
+
+    def wait_ready(self, timeout: Optional[float] = None) -> bool:
+        return self._ready.wait(timeout)
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "backend": self.backend,
+                "ready": self.is_ready(),
+                "files": len(self._files),
+                "pending": len(self._pending) + len(self._pending_dirs),
+                "applied_paths": self.applied_paths,
+                "error": self.error,
+            }
+
+    # ---- public read path ----
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        O(changed files): applies pending events, then assembles the repo map.
+        """
+        with self._lock:
+            self._flush()
+            files = list(self._files.values())
+        out = build_repo_map(self.root, files)
+        out["cache"] = {"enabled": True, "source": f"watcher:{self.backend}", "hits": len(files), "misses": 0}
+        return out
+
+    # ---- internals ----
+
+    def _run(self) -> None:
+        backend = str(getattr(SETTINGS, "WATCH_BACKEND", "auto")).lower()
+        if backend in ("auto", "inotify") and sys.platform.startswith("linux"):
+            try:
+                self._ino = _Inotify()
+                self._add_watches("")
+                self.backend = "inotify"
+            except Exception as e:
+                # e.g. fs.inotify.max_user_watches exhausted
+                self.error = f"inotify unavailable, polling instead: {e}"
+                if self._ino is not None:
+                    self._ino.close()
+                    self._ino = None
+                self._wd_to_dir.clear()
+        if self._ino is None:
+            self.backend = "poll"
+
+        # Watches are in place before the initial scan, so nothing is missed;
+        # files touched during the scan are simply re-read afterwards.
+        self._full_rescan()
+        self._ready.set()
+
+        while not self._stop.is_set():
+            try:
+                if self._ino is not None:
+                    self._inotify_tick()
+                else:
+                    self._poll_tick()
+                with self._lock:
+                    if self._due():
+                        self._flush()
+            except Exception as e:
+                self.error = str(e)
+                time.sleep(0.5)
+
+    def _ignored_dir(self, name: str) -> bool:
+        return name in SETTINGS.IGNORE_DIRS
+
+    def _walk(self, rel_dir: str):
+        base = self.root / rel_dir if rel_dir else self.root
+        for dirpath, dirnames, filenames in os.walk(base):
+            dirnames[:] = [d for d in dirnames if not self._ignored_dir(d)]
+            yield dirpath, dirnames, filenames
+
+    def _rel(self, dirpath: str, name: str) -> str:
+        return (Path(dirpath) / name).relative_to(self.root).as_posix()
+
+    def _full_rescan(self) -> None:
+        m = scan_repo(self.root)
+        with self._lock:
+            self._files = {f["path"]: f for f in m.get("files", [])}
+            self._needs_rescan = False
+            self._notify(None, set())
+        if self._ino is None:
+            self._poll_stats = self._stat_all()
+
+    def _notify(self, paths: Optional[Set[str]], dirs: Set[str]) -> None:
+        for fn in self._listeners:
+            try:
+                fn(paths, dirs)
+            except Exception as e:
+                self.error = f"listener failed: {e}"
+
+    def _mark(self, rel: str, is_dir: bool = False) -> None:
+        now = time.monotonic()
+        with self._lock:
+            if not self._pending and not self._pending_dirs:
+                self._first_pending_at = now
+            self._last_event_at = now
+            (self._pending_dirs if is_dir else self._pending).add(rel)
+
+    def _due(self) -> bool:
+        if self._needs_rescan:
+            return True
+        if not self._pending and not self._pending_dirs:
+            return False
+        now = time.monotonic()
+        quiet = now - self._last_event_at >= self.debounce_sec
+        starving = now - self._first_pending_at >= self.max_delay_sec
+        return quiet or starving
+
+    def _flush(self) -> None:
+        """
+        Applies coalesced events to the in-memory map (caller holds the lock).
+        """
+        if self._needs_rescan:
+            self._pending.clear()
+            self._pending_dirs.clear()
+            self._full_rescan()
+            return
+
+        dirs, self._pending_dirs = self._pending_dirs, set()
+        paths, self._pending = self._pending, set()
+
+        for d in dirs:
+            prefix = d + "/"
+            # drop whatever was known under the dir, then re-add what still exists
+            for rel in [p for p in self._files if p.startswith(prefix)]:
+                paths.add(rel)
+            if (self.root / d).is_dir():
+                for dirpath, _dirnames, filenames in self._walk(d):
+                    for fn in filenames:
+                        paths.add(self._rel(dirpath, fn))
+
+        for rel in paths:
+            if not is_scannable_rel(rel):
+                continue
+            obj = scan_file(self.root, rel)
+            if obj is None:
+                self._files.pop(rel, None)
+            else:
+                self._files[rel] = obj
+        self.applied_paths += len(paths)
+        if paths or dirs:
+            self._notify(paths, dirs)
+
+    # ---- inotify backend ----
+
+    def _add_watches(self, rel_dir: str) -> None:
+        for dirpath, _dirnames, _filenames in self._walk(rel_dir):
+            rel = Path(dirpath).relative_to(self.root).as_posix()
+            rel = "" if rel == "." else rel
+            wd = self._ino.add_watch(Path(dirpath))
+            self._wd_to_dir[wd] = rel
+
+    def _inotify_tick(self) -> None:
+        timeout = self.debounce_sec if (self._pending or self._pending_dirs) else 1.0
+        for wd, mask, name in self._ino.read_events(timeout):
+            if mask & _IN_Q_OVERFLOW:
+                # kernel queue overflowed: events were lost
+                with self._lock:
+                    self._needs_rescan = True
+                continue
+            if mask & _IN_IGNORED:
+                self._wd_to_dir.pop(wd, None)
+                continue
+
+            rel_dir = self._wd_to_dir.get(wd)
+            if rel_dir is None:
+                continue
+            if mask & (_IN_DELETE_SELF | _IN_MOVE_SELF):
+                if rel_dir:
+                    self._mark(rel_dir, is_dir=True)
+                else:
+                    with self._lock:
+                        self._needs_rescan = True
+                continue
+            if not name:
+                continue
+
+            rel = _join(rel_dir, name)
+            if mask & _IN_ISDIR:
+                if self._ignored_dir(name):
+                    continue
+                if mask & (_IN_CREATE | _IN_MOVED_TO):
+                    try:
+                        self._add_watches(rel)
+                    except OSError as e:
+                        self.error = str(e)
+                self._mark(rel, is_dir=True)
+            else:
+                self._mark(rel)
+
+    # ---- polling backend ----
+
+    def _stat_all(self) -> Dict[str, Tuple[int, int, int]]:
+        out: Dict[str, Tuple[int, int, int]] = {}
+        for dirpath, _dirnames, filenames in self._walk(""):
+            for fn in filenames:
+                if Path(fn).suffix.lower() not in SETTINGS.TEXT_EXT:
+                    continue
+                p = Path(dirpath) / fn
+                try:
+                    st = p.stat()
+                except OSError:
+                    continue
+                out[p.relative_to(self.root).as_posix()] = (st.st_size, st.st_mtime_ns, st.st_ino)
+        return out
+
+    def _poll_tick(self) -> None:
+        if self._stop.wait(self.poll_sec):
+            return
+        cur = self._stat_all()
+        old = self._poll_stats
+        for rel, key in cur.items():
+            if old.get(rel) != key:
+                self._mark(rel)
+        for rel in old:
+            if rel not in cur:
+                self._mark(rel)
+        self._poll_stats = cur
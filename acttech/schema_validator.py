@@ -0,0 +1,210 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Union
+
+# ----------------------------
+# Compiled JSON Schema validator
+# ----------------------------
+#
+# Covers the subset our schemas use: type (single or list), enum,
+# properties / required / additionalProperties, items, min/max, minItems,
+# maxItems, minLength. The schema is walked once into nested closures, so
+# validating a plan is a straight tree walk with no keyword dispatch.
+
+_TYPE_CHECKS: Dict[str, Callable[[Any], bool]] = {
+    "object": lambda v: isinstance(v, dict),
+    "array": lambda v: isinstance(v, list),
+    "string": lambda v: isinstance(v, str),
+    "integer": lambda v: isinstance(v, int) and not isinstance(v, bool),
+    "number": lambda v: isinstance(v, (int, float)) and not isinstance(v, bool),
+    "boolean": lambda v: isinstance(v, bool),
+    "null": lambda v: v is None,
+}
+
+
+@dataclass
+class SchemaError:
+    pointer: str  # RFC 6901 JSON pointer of the failing value ("" = root)
+    message: str
+    keyword: str = ""  # schema keyword that failed ("type", "required", ...)
+
+    def __str__(self) -> str:
+        return f"{self.pointer or '/'}: {self.message}"
+
+
+Check = Callable[[Any, str, List[SchemaError]], None]
+
+
+def _esc(key: str) -> str:
+    return key.replace("~", "~0").replace("/", "~1")
+
+
+def _unesc(part: str) -> str:
+    return part.replace("~1", "/").replace("~0", "~")
+
+
+def _compile(schema: Dict[str, Any]) -> Check:
+    checks: List[Check] = []
+
+    types = schema.get("type")
+    if types is not None:
+        names = [types] if isinstance(types, str) else list(types)
+        fns = [_TYPE_CHECKS[t] for t in names]
+        label = " or ".join(names)
+
+        def check_type(v: Any, ptr: str, errs: List[SchemaError]) -> None:
+            if not any(f(v) for f in fns):
+                errs.append(SchemaError(ptr, f"expected {label}, got {type(v).__name__}", "type"))
+        checks.append(check_type)
+
+    if "enum" in schema:
+        allowed = list(schema["enum"])
+
+        def check_enum(v: Any, ptr: str, errs: List[SchemaError]) -> None:
+            if v not in allowed:
+                errs.append(SchemaError(ptr, f"{v!r} is not one of {allowed}", "enum"))
+        checks.append(check_enum)
+
+    for kw, op, what in (("minimum", float.__lt__, "<"), ("maximum", float.__gt__, ">")):
+        if kw in schema:
+            bound = float(schema[kw])
+
+            def check_bound(v: Any, ptr: str, errs: List[SchemaError], bound=bound, op=op, what=what, kw=kw) -> None:
+                if _TYPE_CHECKS["number"](v) and op(float(v), bound):
+                    errs.append(SchemaError(ptr, f"{v} {what} {bound:g}", kw))
+            checks.append(check_bound)
+
+    if "minLength" in schema:
+        min_len = int(schema["minLength"])
+
+        def check_min_len(v: Any, ptr: str, errs: List[SchemaError]) -> None:
+            if isinstance(v, str) and len(v) < min_len:
+                errs.append(SchemaError(ptr, f"shorter than {min_len} chars", "minLength"))
+        checks.append(check_min_len)
+
+    props = {k: _compile(s) for k, s in (schema.get("properties") or {}).items()}
+    required = list(schema.get("required") or [])
+    closed = schema.get("additionalProperties") is False
+    if props or required or closed:
+        def check_object(v: Any, ptr: str, errs: List[SchemaError]) -> None:
+            if not isinstance(v, dict):
+                return
+            for k in required:
+                if k not in v:
+                    errs.append(SchemaError(ptr, f"missing required property {k!r}", "required"))
+            for k, item in v.items():
+                sub = props.get(k)
+                if sub is not None:
+                    sub(item, f"{ptr}/{_esc(k)}", errs)
+                elif closed:
+                    errs.append(SchemaError(f"{ptr}/{_esc(k)}", f"unexpected property {k!r}", "additionalProperties"))
+        checks.append(check_object)
+
+    items = schema.get("items")
+    min_items = schema.get("minItems")
+    max_items = schema.get("maxItems")
+    if items is not None or min_items is not None or max_items is not None:
+        item_check = _compile(items) if isinstance(items, dict) else None
+
+        def check_array(v: Any, ptr: str, errs: List[SchemaError]) -> None:
+            if not isinstance(v, list):
+                return
+            if min_items is not None and len(v) < int(min_items):
+                errs.append(SchemaError(ptr, f"fewer than {min_items} items", "minItems"))
+            if max_items is not None and len(v) > int(max_items):
+                errs.append(SchemaError(ptr, f"more than {max_items} items", "maxItems"))
+            if item_check is not None:
+                for i, item in enumerate(v):
+                    item_check(item, f"{ptr}/{i}", errs)
+        checks.append(check_array)
+
+    def check(v: Any, ptr: str, errs: List[SchemaError]) -> None:
+        for c in checks:
+            c(v, ptr, errs)
+    return check
+
+
+class Validator:
+    """
+    Validator compiled once from a JSON Schema (the "schema" part, not the
+    {"name", "schema"} wrapper used by the Responses API).
+    """
+
+    def __init__(self, schema: Dict[str, Any]):
+        self.schema = schema
+        self._check = _compile(schema)
+
+    def errors(self, value: Any, limit: int = 20) -> List[SchemaError]:
+        errs: List[SchemaError] = []
+        self._check(value, "", errs)
+        return errs[:limit]
+
+    def subschema(self, pointer: str) -> Dict[str, Any]:
+        """
+        Schema that applies at pointer ({} if the pointer leaves the schema).
+        """
+        cur: Dict[str, Any] = self.schema
+        for part in split_pointer(pointer):
+            if "properties" in cur and _unesc(part) in cur["properties"]:
+                cur = cur["properties"][_unesc(part)]
+            elif isinstance(cur.get("items"), dict) and part.isdigit():
+                cur = cur["items"]
+            else:
+                return {}
+        return cur
+
+
+# ----------------------------
+# JSON pointers
+# ----------------------------
+
+def split_pointer(pointer: str) -> List[str]:
+    return [p for p in pointer.split("/")[1:]] if pointer else []
+
+
+def parent_pointer(pointer: str) -> str:
+    return pointer.rsplit("/", 1)[0] if pointer else ""
+
+
+def resolve_pointer(doc: Any, pointer: str) -> Any:
+    cur = doc
+    for part in split_pointer(pointer):
+        if isinstance(cur, list):
+            cur = cur[int(part)]
+        else:
+            cur = cur[_unesc(part)]
+    return cur
+
+
+def set_pointer(doc: Any, pointer: str, value: Any) -> Any:
+    """
+    Replaces the value at pointer in place; returns the (possibly new) root.
+    """
+    if not pointer:
+        return value
+    parts = split_pointer(pointer)
+    parent = resolve_pointer(doc, "/" + "/".join(parts[:-1]) if len(parts) > 1 else "")
+    last = parts[-1]
+    if isinstance(parent, list):
+        parent[int(last)] = value
+    else:
+        parent[_unesc(last)] = value
+    return doc
+
+
+def container_pointer(doc: Any, pointer: str) -> str:
+    """
+    Smallest object/array at or above pointer that still exists in doc: the
+    unit a repair prompt sends back (e.g. one op, not the whole plan).
+    """
+    ptr: Optional[str] = pointer
+    while ptr:
+        try:
+            v: Union[Dict[str, Any], List[Any], Any] = resolve_pointer(doc, ptr)
+        except (KeyError, IndexError, ValueError, TypeError):
+            v = None
+        if isinstance(v, (dict, list)):
+            return ptr
+        ptr = parent_pointer(ptr)
+    return ""
@@ -0,0 +1,179 @@
+from __future__ import annotations
+
+import math
+import re
+from collections import Counter
+from contextlib import closing
+from pathlib import Path
+from typing import Dict, Any, List, Iterable
+
+from config import SETTINGS
+from repo_store import connect, store_path
+
+
+# ----------------------------
+# Persistent token index (lives in the repo store DB)
+# ----------------------------
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS idx_docs (
+    path TEXT PRIMARY KEY,
+    sha256 TEXT,
+    length INTEGER
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS idx_postings (
+    term TEXT NOT NULL,
+    path TEXT NOT NULL,
+    tf INTEGER NOT NULL,
+    PRIMARY KEY (term, path)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_postings_path ON idx_postings(path);
+"""
+
+_RE_IDENT = re.compile(r"[A-Za-z0-9_]+")
+_RE_CAMEL = re.compile(r"[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|[0-9]+")
+_RE_QUERY_SPLIT = re.compile(r"[^a-z0-9_]+")
+
+_MAX_TERM_LEN = 64
+
+
+def _split_ident(ident: str) -> List[str]:
+    """
+    'parseHTTPRequest_v2' -> ['parse', 'http', 'request', 'v2'] (parts only)
+    """
+    out: List[str] = []
+    for part in ident.split("_"):
+        if not part:
+            continue
+        subs = _RE_CAMEL.findall(part)
+        out.extend(s.lower() for s in (subs if len(subs) > 1 else [part]))
+    return out
+
+
+def tokenize_text(text: str) -> Counter:
+    """
+    Index terms of a file: every identifier (lowercased) plus its
+    snake_case/camelCase parts, so 'scan_repo' matches 'scan' and 'repo'.
+    """
+    c: Counter = Counter()
+    for ident in _RE_IDENT.findall(text):
+        if len(ident) < 2 or len(ident) > _MAX_TERM_LEN:
+            continue
+        low = ident.lower()
+        c[low] += 1
+        parts = _split_ident(ident)
+        if len(parts) > 1:
+            for p in parts:
+                if len(p) >= 2 and p != low:
+                    c[p] += 1
+    return c
+
+
+def query_terms(goal_tokens: Iterable[str]) -> List[str]:
+    """
+    Goal tokens ('foo/bar.py', 'api-key', 'scan_repo') -> index terms.
+    """
+    out: List[str] = []
+    seen = set()
+    for t in goal_tokens:
+        for piece in _RE_QUERY_SPLIT.split(t.lower()):
+            if len(piece) < 2:
+                continue
+            cands = [piece] + (_split_ident(piece) if "_" in piece else [])
+            for c in cands:
+                if len(c) >= 2 and c not in seen:
+                    seen.add(c)
+                    out.append(c)
+    return out
+
+
+def _open(repo_root: Path):
+    conn = connect(repo_root)
+    conn.executescript(_SCHEMA)
+    return conn
+
+
+# ----------------------------
+# Build / incremental update
+# ----------------------------
+
+def update_index(repo_root: Path, repo_map: Dict[str, Any]) -> Dict[str, int]:
+    """
+    Brings the index in line with repo_map: files whose sha256 is unchanged
+    are skipped, changed/new files are re-tokenized, vanished files dropped.
+    """
+    root = repo_root.resolve()
+    want = {f["path"]: f.get("sha256") for f in repo_map.get("files", []) if f.get("path")}
+
+    updated = 0
+    removed = 0
+    with closing(_open(root)) as conn, conn:
+        have = dict(conn.execute("SELECT path, sha256 FROM idx_docs").fetchall())
+
+        for path in have:
+            if path not in want:
+                conn.execute("DELETE FROM idx_postings WHERE path = ?", (path,))
+                conn.execute("DELETE FROM idx_docs WHERE path = ?", (path,))
+                removed += 1
+
+        for path, sha in want.items():
+            if have.get(path) == sha:
+                continue
+            try:
+                text = (root / path).read_text(encoding="utf-8", errors="replace")
+            except Exception:
+                text = ""
+            terms = tokenize_text(text)
+            conn.execute("DELETE FROM idx_postings WHERE path = ?", (path,))
+            conn.executemany(
+                "INSERT INTO idx_postings(term, path, tf) VALUES (?,?,?)",
+                ((t, path, n) for t, n in terms.items()),
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO idx_docs(path, sha256, length) VALUES (?,?,?)",
+                (path, sha, sum(terms.values())),
+            )
+            updated += 1
+
+    return {"docs": len(want), "updated": updated, "removed": removed, "unchanged": len(want) - updated}
+
+
+# ----------------------------
+# Query
+# ----------------------------
+
+def bm25_scores(repo_root: Path, goal_tokens: List[str], limit: int = 500) -> Dict[str, float]:
+    """
+    BM25 over the whole repo for the given goal tokens.
+    Returns {path: score} for the top `limit` files ({} if no index yet).
+    """
+    terms = query_terms(goal_tokens)
+    if not terms or not store_path(repo_root).exists():
+        return {}
+
+    k1 = float(getattr(SETTINGS, "BM25_K1", 1.2))
+    b = float(getattr(SETTINGS, "BM25_B", 0.75))
+
+    scores: Dict[str, float] = {}
+    with closing(_open(repo_root)) as conn:
+        n_docs, avgdl = conn.execute("SELECT COUNT(*), AVG(length) FROM idx_docs").fetchone()
+        if not n_docs:
+            return {}
+        avgdl = float(avgdl or 1.0) or 1.0
+
+        for term in terms:
+            rows = conn.execute(
+                "SELECT p.path, p.tf, d.length FROM idx_postings p JOIN idx_docs d ON d.path = p.path WHERE p.term = ?",
+                (term,),
+            ).fetchall()
+            if not rows:
+                continue
+            df = len(rows)
+            idf = math.log(1.0 + (n_docs - df + 0.5) / (df + 0.5))
+            for path, tf, length in rows:
+                norm = tf * (k1 + 1.0) / (tf + k1 * (1.0 - b + b * (length or 0) / avgdl))
+                scores[path] = scores.get(path, 0.0) + idf * norm
+
+    top = sorted(scores.items(), key=lambda x: x[1], reverse=True)[:limit]
+    return dict(top)
@@ -0,0 +1,267 @@
+from __future__ import annotations
+
+import ast
+import re
+from dataclasses import dataclass
+from typing import Callable, List, Optional
+
+from config import SETTINGS
+
+
+# ----------------------------
+# Chunks
+# ----------------------------
+
+@dataclass
+class Chunk:
+    """
+    A symbol-sized region of a file. Lines are 1-based and inclusive.
+    """
+    start: int
+    end: int
+    kind: str
+    name: str
+    score: float = 0.0
+
+
+def _max_chunk_lines() -> int:
+    return max(20, int(getattr(SETTINGS, "SNIPPET_MAX_CHUNK_LINES", 120)))
+
+
+def _split_long(chunks: List[Chunk], max_lines: int) -> List[Chunk]:
+    out: List[Chunk] = []
+    for c in chunks:
+        if c.end - c.start + 1 <= max_lines:
+            out.append(c)
+            continue
+        s = c.start
+        part = 1
+        while s <= c.end:
+            e = min(c.end, s + max_lines - 1)
+            out.append(Chunk(s, e, c.kind, f"{c.name} (part {part})"))
+            s = e + 1
+            part += 1
+    return out
+
+
+def _attach_leading_comments(chunks: List[Chunk], lines: List[str], prefix: str) -> None:
+    """
+    Pull comment lines directly above a chunk (docs, markers) into it.
+    """
+    floor = 1
+    for c in chunks:
+        s = c.start
+        while s - 1 >= floor and lines[s - 2].lstrip().startswith(prefix):
+            s -= 1
+        c.start = s
+        floor = c.end + 1
+
+
+# ----------------------------
+# Python (ast)
+# ----------------------------
+
+def _py_node_start(node: ast.AST) -> int:
+    decos = getattr(node, "decorator_list", []) or []
+    return min([node.lineno] + [d.lineno for d in decos])
+
+
+def _python_chunks(text: str, lines: List[str]) -> Optional[List[Chunk]]:
+    try:
+        tree = ast.parse(text)
+    except (SyntaxError, ValueError):
+        return None
+
+    max_lines = _max_chunk_lines()
+    chunks: List[Chunk] = []
+    pending_module: Optional[Chunk] = None
+
+    def flush() -> None:
+        nonlocal pending_module
+        if pending_module is not None:
+            chunks.append(pending_module)
+            pending_module = None
+
+    for node in tree.body:
+        start, end = _py_node_start(node), node.end_lineno or node.lineno
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            flush()
+            chunks.append(Chunk(start, end, "def", node.name))
+        elif isinstance(node, ast.ClassDef):
+            flush()
+            if end - start + 1 <= max_lines or not node.body:
+                chunks.append(Chunk(start, end, "class", node.name))
+                continue
+            # big class: header, then one chunk per member
+            first = _py_node_start(node.body[0])
+            if first > start:
+                chunks.append(Chunk(start, first - 1, "class", node.name))
+            for member in node.body:
+                ms, me = _py_node_start(member), member.end_lineno or member.lineno
+                if isinstance(member, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                    chunks.append(Chunk(ms, me, "def", f"{node.name}.{member.name}"))
+                elif chunks and chunks[-1].kind == "class" and chunks[-1].name == node.name and chunks[-1].end + 1 >= ms:
+                    chunks[-1].end = me
+                else:
+                    chunks.append(Chunk(ms, me, "class", node.name))
+        else:
+            # consecutive module-level statements (imports, constants, ...) form one chunk
+            if pending_module is None:
+                pending_module = Chunk(start, end, "module", "imports" if isinstance(node, (ast.Import, ast.ImportFrom)) else "module")
+            else:
+                pending_module.end = end
+    flush()
+
+    _attach_leading_comments(chunks, lines, "#")
+    return _split_long(chunks, max_lines)
+
+
+# ----------------------------
+# JS/TS (brace depth)
+# ----------------------------
+
+_RE_JS_NAME = re.compile(
+    r"(?:export\s+)?(?:default\s+)?(?:async\s+)?"
+    r"(?:function\s*\*?\s*([A-Za-z_$][\w$]*)|class\s+([A-Za-z_$][\w$]*)|"
+    r"(?:const|let|var)\s+([A-Za-z_$][\w$]*)|interface\s+([A-Za-z_$][\w$]*)|type\s+([A-Za-z_$][\w$]*))"
+)
+
+
+def _js_name(line: str) -> str:
+    m = _RE_JS_NAME.search(line)
+    if not m:
+        return line.strip()[:40]
+    return next(g for g in m.groups() if g)
+
+
+def _brace_chunks(lines: List[str]) -> List[Chunk]:
+    """
+    Top-level statements of a brace language: a chunk ends when the brace
+    depth is back to 0 at a line that ends a statement (or before a blank line).
+    Strings, template literals and comments are skipped.
+    """
+    chunks: List[Chunk] = []
+    depth = 0
+    start: Optional[int] = None
+    in_block_comment = False
+    quote = ""
+
+    for i, line in enumerate(lines, start=1):
+        j = 0
+        n = len(line)
+        while j < n:
+            ch = line[j]
+            if in_block_comment:
+                if line.startswith("*/", j):
+                    in_block_comment = False
+                    j += 1
+            elif quote:
+                if ch == "\\":
+                    j += 1
+                elif ch == quote:
+                    quote = ""
+            elif line.startswith("//", j):
+                break
+            elif line.startswith("/*", j):
+                in_block_comment = True
+                j += 1
+            elif ch in "'\"`":
+                quote = ch
+            elif ch in "{([":
+                depth += 1
+            elif ch in "})]":
+                depth = max(0, depth - 1)
+            j += 1
+        if quote in "'\"":
+            quote = ""  # unterminated plain strings do not span lines
+
+        stripped = line.strip()
+        if start is None and stripped and not stripped.startswith(("//", "/*", "*")):
+            start = i
+        if start is not None and depth == 0 and not in_block_comment and not quote:
+            nxt_blank = i == len(lines) or not lines[i].strip()
+            if stripped.endswith(("}", ";", "},", "});", ")", "];")) or nxt_blank:
+                chunks.append(Chunk(start, i, "block", _js_name(lines[start - 1])))
+                start = None
+    if start is not None:
+        chunks.append(Chunk(start, len(lines), "block", _js_name(lines[start - 1])))
+
+    # merge runs of one-liners (imports, small consts) into a single chunk
+    merged: List[Chunk] = []
+    for c in chunks:
+        if merged and c.start == c.end and merged[-1].kind == "module" and merged[-1].end + 2 >= c.start:
+            merged[-1].end = c.end
+        elif c.start == c.end:
+            merged.append(Chunk(c.start, c.end, "module", "imports" if lines[c.start - 1].lstrip().startswith("import") else "module"))
+        else:
+            merged.append(c)
+
+    _attach_leading_comments(merged, lines, "//")
+    return _split_long(merged, _max_chunk_lines())
+
+
+def _window_chunks(lines: List[str]) -> List[Chunk]:
+    size = _max_chunk_lines()
+    return [Chunk(s, min(len(lines), s + size - 1), "lines", f"L{s}") for s in range(1, len(lines) + 1, size)]
+
+
+def chunk_file(rel: str, text: str) -> List[Chunk]:
+    """
+    Carves a file into symbol-sized chunks: ast for Python, brace depth for
+    JS/TS, fixed windows otherwise (or if Python does not parse).
+    """
+    lines = text.splitlines(True)
+    if not lines:
+        return []
+    suf = rel.lower().rsplit(".", 1)[-1] if "." in rel else ""
+    chunks: Optional[List[Chunk]] = None
+    if suf == "py":
+        chunks = _python_chunks(text, lines)
+    elif suf in ("js", "jsx", "ts", "tsx", "mjs", "cjs"):
+        chunks = _brace_chunks(lines)
+    return chunks or _window_chunks(lines)
+
+
+# ----------------------------
+# Ranking + rendering
+# ----------------------------
+
+def rank_chunks(
+    chunks: List[Chunk],
+    lines: List[str],
+    goal_tokens: List[str],
+    score_fn: Callable[[str, List[str]], float]
+) -> List[Chunk]:
+    """
+    Scores chunks against the goal (content match + symbol-name match) and
+    returns them best first (ties: file order).
+    """
+    for c in chunks:
+        body = "".join(lines[c.start - 1:c.end])
+        name = c.name.lower()
+        c.score = score_fn(body, goal_tokens) + sum(6.0 for t in goal_tokens if t in name)
+    return sorted(chunks, key=lambda c: (-c.score, c.start))
+
+
+def render_lines(lines: List[str], start: int, end: int) -> str:
+    """
+    Lines start..end, prefixed with their line number when SNIPPET_LINE_NUMBERS is on.
+    """
+    sel = lines[start - 1:end]
+    if not bool(getattr(SETTINGS, "SNIPPET_LINE_NUMBERS", True)):
+        out = "".join(sel)
+    else:
+        width = len(str(end))
+        out = "".join(f"{n:>{width}}| {ln}" for n, ln in enumerate(sel, start=start))
+    return out if out.endswith("\n") or not out else out + "\n"
+
+
+def render_chunks(chunks: List[Chunk], lines: List[str]) -> str:
+    """
+    Chunks in file order, each with its line range and symbol.
+    """
+    parts: List[str] = []
+    for c in sorted(chunks, key=lambda c: c.start):
+        parts.append(f"@@ lines {c.start}-{c.end}: {c.kind} {c.name} @@\n")
+        parts.append(render_lines(lines, c.start, c.end))
+    return "".join(parts)
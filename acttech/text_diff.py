@@ -0,0 +1,297 @@
+from __future__ import annotations
+
+from bisect import bisect_left
+from typing import Dict, Hashable, Iterator, List, Sequence, Tuple
+
+# ----------------------------
+# Line diff backend
+# ----------------------------
+#
+# Opcodes are computed once per file and both the unified diff and the
+# changed-line count are derived from them:
+#   1. common prefix/suffix are stripped (most edits are local)
+#   2. gaps with no line in common are one replace; small gaps go to
+#      Myers O(ND) directly (minimal diff)
+#   3. large gaps use patience diff: lines unique in both sides anchor the
+#      alignment (LIS of their positions), recursing between anchors; gaps
+#      without unique lines fall back to Myers, and past _MYERS_MAX_D edits
+#      a gap is reported as one replace block
+# Opcodes use difflib.SequenceMatcher's format, and unified_diff() yields
+# exactly what difflib.unified_diff would for the same opcodes.
+
+Opcode = Tuple[str, int, int, int, int]
+
+_MYERS_MAX_D = 1000
+_SMALL_GAP = 400  # gaps up to this many lines (both sides) go straight to Myers
+
+
+def _myers(a: Sequence[int], b: Sequence[int], alo: int, ahi: int, blo: int, bhi: int,
+           out: List[Tuple[int, int]]) -> bool:
+    """
+    Appends matched (i, j) pairs of a[alo:ahi] / b[blo:bhi] to out (in order).
+    Returns False (and appends nothing) if the edit distance exceeds _MYERS_MAX_D.
+    """
+    n, m = ahi - alo, bhi - blo
+    max_d = min(n + m, _MYERS_MAX_D)
+    off = max_d + 1
+    v = [0] * (2 * max_d + 3)
+    trace: List[List[int]] = []
+
+    for d in range(max_d + 1):
+        # v[k] for k in -d-1..d+1 before this step (values of step d-1)
+        trace.append(v[off - d - 1: off + d + 2])
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and v[off + k - 1] < v[off + k + 1]):
+                x = v[off + k + 1]
+            else:
+                x = v[off + k - 1] + 1
+            y = x - k
+            while x < n and y < m and a[alo + x] == b[blo + y]:
+                x += 1
+                y += 1
+            v[off + k] = x
+            if x >= n and y >= m:
+                _myers_backtrack(trace, d, n, m, alo, blo, out)
+                return True
+    return False
+
+
+def _myers_backtrack(trace: List[List[int]], d_end: int, n: int, m: int, alo: int, blo: int,
+                     out: List[Tuple[int, int]]) -> None:
+    pairs: List[Tuple[int, int]] = []
+    x, y = n, m
+    for d in range(d_end, 0, -1):
+        snap = trace[d]  # index k maps to k + d + 1
+        k = x - y
+        if k == -d or (k != d and snap[k - 1 + d + 1] < snap[k + 1 + d + 1]):
+            prev_k = k + 1
+        else:
+            prev_k = k - 1
+        prev_x = snap[prev_k + d + 1]
+        prev_y = prev_x - prev_k
+        while x > prev_x and y > prev_y:
+            x -= 1
+            y -= 1
+            pairs.append((alo + x, blo + y))
+        x, y = prev_x, prev_y
+    while x > 0 and y > 0:
+        x -= 1
+        y -= 1
+        pairs.append((alo + x, blo + y))
+    pairs.reverse()
+    out.extend(pairs)
+
+
+def _lis_anchors(pairs: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """
+    Longest increasing subsequence (by j) of pairs sorted by i: patience sorting.
+    """
+    tails: List[int] = []          # j of the smallest tail per pile length
+    tail_idx: List[int] = []       # index into pairs of that tail
+    prev: List[int] = [-1] * len(pairs)
+    for idx, (_, j) in enumerate(pairs):
+        pos = bisect_left(tails, j)
+        if pos > 0:
+            prev[idx] = tail_idx[pos - 1]
+        if pos == len(tails):
+            tails.append(j)
+            tail_idx.append(idx)
+        else:
+            tails[pos] = j
+            tail_idx[pos] = idx
+    out: List[Tuple[int, int]] = []
+    idx = tail_idx[-1] if tail_idx else -1
+    while idx >= 0:
+        out.append(pairs[idx])
+        idx = prev[idx]
+    out.reverse()
+    return out
+
+
+def _patience(a: Sequence[int], b: Sequence[int], alo: int, ahi: int, blo: int, bhi: int,
+              out: List[Tuple[int, int]]) -> None:
+    # common prefix / suffix of this range
+    while alo < ahi and blo < bhi and a[alo] == b[blo]:
+        out.append((alo, blo))
+        alo += 1
+        blo += 1
+    tail: List[Tuple[int, int]] = []
+    while alo < ahi and blo < bhi and a[ahi - 1] == b[bhi - 1]:
+        ahi -= 1
+        bhi -= 1
+        tail.append((ahi, bhi))
+
+    if alo < ahi and blo < bhi and set(a[alo:ahi]).isdisjoint(b[blo:bhi]):
+        alo, blo = ahi, bhi  # nothing in common: one replace, no search needed
+
+    if alo < ahi and blo < bhi and (ahi - alo) + (bhi - blo) <= _SMALL_GAP:
+        # small gap: Myers gives the minimal diff cheaply
+        if _myers(a, b, alo, ahi, blo, bhi, out):
+            alo, blo = ahi, bhi
+
+    if alo < ahi and blo < bhi:
+        count_a: Dict[int, int] = {}
+        pos_a: Dict[int, int] = {}
+        for i in range(alo, ahi):
+            x = a[i]
+            count_a[x] = count_a.get(x, 0) + 1
+            pos_a[x] = i
+        count_b: Dict[int, int] = {}
+        pos_b: Dict[int, int] = {}
+        for j in range(blo, bhi):
+            x = b[j]
+            if count_a.get(x) == 1:
+                count_b[x] = count_b.get(x, 0) + 1
+                pos_b[x] = j
+        uniq = sorted((pos_a[x], pos_b[x]) for x, c in count_b.items() if c == 1)
+        anchors = _lis_anchors(uniq) if uniq else []
+
+        if anchors:
+            i0, j0 = alo, blo
+            for i, j in anchors:
+                _patience(a, b, i0, i, j0, j, out)
+                out.append((i, j))
+                i0, j0 = i + 1, j + 1
+            _patience(a, b, i0, ahi, j0, bhi, out)
+        else:
+            _myers(a, b, alo, ahi, blo, bhi, out)  # too different: left as one replace
+
+    out.extend(reversed(tail))
+
+
+def _intern(a: Sequence[Hashable], b: Sequence[Hashable]) -> Tuple[List[int], List[int]]:
+    ids: Dict[Hashable, int] = {}
+    ia = [ids.setdefault(x, len(ids)) for x in a]
+    ib = [ids.setdefault(x, len(ids)) for x in b]
+    return ia, ib
+
+
+def diff_opcodes(a: Sequence[Hashable], b: Sequence[Hashable]) -> List[Opcode]:
+    """
+    difflib.SequenceMatcher(None, a, b).get_opcodes()-style opcodes.
+    """
+    ia, ib = _intern(a, b)
+    matches: List[Tuple[int, int]] = []
+    _patience(ia, ib, 0, len(ia), 0, len(ib), matches)
+
+    codes: List[Opcode] = []
+    i = j = 0
+    k = 0
+    n_match = len(matches)
+    while k <= n_match:
+        if k < n_match:
+            mi, mj = matches[k]
+        else:
+            mi, mj = len(a), len(b)
+        if i < mi and j < mj:
+            codes.append(("replace", i, mi, j, mj))
+        elif i < mi:
+            codes.append(("delete", i, mi, j, mj))
+        elif j < mj:
+            codes.append(("insert", i, mi, j, mj))
+        if k == n_match:
+            break
+        # run of consecutive matches
+        run = 1
+        while k + run < n_match and matches[k + run] == (mi + run, mj + run):
+            run += 1
+        codes.append(("equal", mi, mi + run, mj, mj + run))
+        i, j = mi + run, mj + run
+        k += run
+    return codes
+
+
+def changed_line_count(codes: List[Opcode]) -> int:
+    """
+    Removed + added lines (what ndiff's "- "/"+ " lines counted).
+    """
+    n = 0
+    for tag, i1, i2, j1, j2 in codes:
+        if tag != "equal":
+            n += (i2 - i1) + (j2 - j1)
+    return n
+
+
+# ----------------------------
+# Unified output (difflib compatible)
+# ----------------------------
+
+def grouped_opcodes(codes: List[Opcode], n: int = 3) -> Iterator[List[Opcode]]:
+    """
+    Same grouping as SequenceMatcher.get_grouped_opcodes.
+    """
+    codes = list(codes) or [("equal", 0, 1, 0, 1)]
+    if codes[0][0] == "equal":
+        tag, i1, i2, j1, j2 = codes[0]
+        codes[0] = (tag, max(i1, i2 - n), i2, max(j1, j2 - n), j2)
+    if codes[-1][0] == "equal":
+        tag, i1, i2, j1, j2 = codes[-1]
+        codes[-1] = (tag, i1, min(i2, i1 + n), j1, min(j2, j1 + n))
+
+    nn = n + n
+    group: List[Opcode] = []
+    for tag, i1, i2, j1, j2 in codes:
+        if tag == "equal" and i2 - i1 > nn:
+            group.append((tag, i1, min(i2, i1 + n), j1, min(j2, j1 + n)))
+            yield group
+            group = []
+            i1, j1 = max(i1, i2 - n), max(j1, j2 - n)
+        group.append((tag, i1, i2, j1, j2))
+    if group and not (len(group) == 1 and group[0][0] == "equal"):
+        yield group
+
+
+def _format_range(start: int, stop: int) -> str:
+    beginning = start + 1
+    length = stop - start
+    if length == 1:
+        return f"{beginning}"
+    if not length:
+        beginning -= 1
+    return f"{beginning},{length}"
+
+
+def unified_diff(a: Sequence[str], b: Sequence[str], codes: List[Opcode],
+                 fromfile: str = "", tofile: str = "", n: int = 3) -> Iterator[str]:
+    started = False
+    for group in grouped_opcodes(codes, n):
+        if not started:
+            started = True
+            yield f"--- {fromfile}\n"
+            yield f"+++ {tofile}\n"
+        first, last = group[0], group[-1]
+        yield f"@@ -{_format_range(first[1], last[2])} +{_format_range(first[3], last[4])} @@\n"
+        for tag, i1, i2, j1, j2 in group:
+            if tag == "equal":
+                for line in a[i1:i2]:
+                    yield " " + line
+                continue
+            if tag in ("replace", "delete"):
+                for line in a[i1:i2]:
+                    yield "-" + line
+            if tag in ("replace", "insert"):
+                for line in b[j1:j2]:
+                    yield "+" + line
+
+
+def _all_newline_ended(text: str, lines: List[str]) -> bool:
+    # every line ends in a plain "\n" (no "\r\n", other breaks or open last line)
+    return "\r" not in text and len(lines) == text.count("\n")
+
+
+def diff_texts(rel: str, before: str, after: str, context_lines: int = 3) -> Tuple[str, int]:
+    """
+    (unified diff "a/rel" -> "b/rel", changed line count) from one opcode pass.
+    The count ignores line endings, like the ndiff count did: only if some
+    line differs from another in its ending alone ("a" vs "a\n", "\r\n" vs
+    "\n") is it taken from a second pass over the lines without endings.
+    """
+    a = before.splitlines(True)
+    b = after.splitlines(True)
+    codes = diff_opcodes(a, b)
+    text = "".join(unified_diff(a, b, codes, f"a/{rel}", f"b/{rel}", context_lines))
+    if not (_all_newline_ended(before, a) and _all_newline_ended(after, b)):
+        sa, sb = before.splitlines(), after.splitlines()
+        if len(set(a).union(b)) != len(set(sa).union(sb)):
+            codes = diff_opcodes(sa, sb)
+    return text, changed_line_count(codes)
@@ -1,27 +1,52 @@
 # web_app.py (UPGRADED: editable editor + save + terminal panel + run endpoint + auto-log plan/run_commands)
 from __future__ import annotations
 
+import asyncio
 import json
-import os
 import hashlib
-import subprocess
+import threading
 import time
 from pathlib import Path
-from typing import Any, List, Dict, Optional
+from typing import Any, Callable, List, Dict, Optional
 
 from fastapi import FastAPI, Request, HTTPException
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse
 
 from config import SETTINGS
 from repo_scan import scan_repo
-from repo_diff import diff_maps
-from context_builder import build_llm_context
-from llm_planner import plan_patches
-from patch_apply import apply_patch_plan
+from repo_watch import RepoWatcher
+from repo_diff import diff_store
+import repo_store
+from search_index import update_index
+from import_graph import update_import_graph
+from context_builder import build_llm_context_with_report
+from llm_planner import plan_candidates_async
+from plan_cache import PlanCache
+from patch_apply import apply_patch_plan, score_plan
+from backup_store import BackupStore
+from app_state import AppState
+from command_runner import CommandRunner, RunJob
+from jobs import JobQueue
+from file_index import FileIndex
 
 
 app = FastAPI(title="Local Repo LLM Updater (Replit-like)")
 
+# Live repo map (started on app startup if WATCH_REPO is on)
+WATCHER: Optional[RepoWatcher] = None
+
+# Parsed state per repo root (see app_state.py)
+_STATES: Dict[Path, AppState] = {}
+
+# Sidebar file listing per repo root (see file_index.py)
+_FILE_INDEXES: Dict[Path, FileIndex] = {}
+
+# Background command jobs (/api/run, /api/run_plan)
+RUNNER = CommandRunner()
+
+# Pipeline jobs (scan/diff/plan/apply), serialized per repo
+JOBS = JobQueue(int(getattr(SETTINGS, "JOB_WORKERS", 2)))
+
 
 # ----------------------------
 # Helpers
@@ -35,15 +60,25 @@ def state_dir() -> Path:
     d.mkdir(parents=True, exist_ok=True)
     return d
 
+def app_state() -> AppState:
+    root = repo_root()
+    st = _STATES.get(root)
+    if st is None:
+        st = _STATES.setdefault(root, AppState(root))
+    return st
+
+def file_index() -> FileIndex:
+    root = repo_root()
+    idx = _FILE_INDEXES.get(root)
+    if idx is None:
+        idx = _FILE_INDEXES.setdefault(root, FileIndex(root))
+    return idx
+
 def load_json(p: Path, default: Any = None) -> Any:
     if not p.exists():
         return default
     return json.loads(p.read_text(encoding="utf-8"))
 
-def save_json(p: Path, obj: Any) -> None:
-    p.parent.mkdir(parents=True, exist_ok=True)
-    p.write_text(json.dumps(obj, indent=2), encoding="utf-8")
-
 def require_token(req: Request) -> None:
     if not SETTINGS.ADMIN_TOKEN:
         return
@@ -56,17 +91,7 @@ def is_safe_rel_path(rel: str) -> bool:
     return rel and not (p.is_absolute() or ".." in p.parts)
 
 def list_repo_files() -> List[str]:
-    root = repo_root()
-    out: List[str] = []
-    for dirpath, dirnames, filenames in os.walk(root):
-        dirnames[:] = [d for d in dirnames if d not in SETTINGS.IGNORE_DIRS]
-        for fn in filenames:
-            p = Path(dirpath) / fn
-            rel = p.relative_to(root).as_posix()
-            if p.suffix.lower() in SETTINGS.TEXT_EXT:
-                out.append(rel)
-    out.sort()
-    return out
+    return file_index().paths()
 
 def read_file_text(rel_path: str, max_chars: int = 160_000) -> str:
     if not is_safe_rel_path(rel_path):
@@ -105,42 +130,90 @@ def file_meta(rel_path: str) -> Dict[str, Any]:
 def _ts() -> str:
     return time.strftime("%H:%M:%S")
 
+# ----------------------------
+# Terminal log
+# ----------------------------
+#
+# terminal.log is append-only between clears. Clients track a byte offset
+# plus an epoch that changes on every clear (and server restart): reads
+# return only the bytes past the offset, and term_append wakes the
+# /api/terminal/stream subscribers so they push them right away.
+
+_TERM_LOCK = threading.Lock()
+_TERM_EPOCH = int(time.time())
+_TERM_WAITERS: set = set()  # (event loop, asyncio.Event) per open stream
+
 def terminal_log_path() -> Path:
     return state_dir() / "terminal.log"
 
+def _term_notify() -> None:
+    for loop, ev in list(_TERM_WAITERS):
+        try:
+            loop.call_soon_threadsafe(ev.set)
+        except RuntimeError:
+            _TERM_WAITERS.discard((loop, ev))  # loop closed
+
 def term_append(text: str) -> None:
-    terminal_log_path().parent.mkdir(parents=True, exist_ok=True)
-    with terminal_log_path().open("a", encoding="utf-8", errors="replace") as f:
-        f.write(text)
+    if not text:
+        return
+    with _TERM_LOCK:
+        with terminal_log_path().open("a", encoding="utf-8", errors="replace") as f:
+            f.write(text)
+    _term_notify()
 
 def term_line(msg: str) -> None:
     term_append(f"[{_ts()}] {msg}\n")
 
 def term_clear() -> None:
-    terminal_log_path().write_text("", encoding="utf-8")
+    global _TERM_EPOCH
+    with _TERM_LOCK:
+        terminal_log_path().write_text("", encoding="utf-8")
+        _TERM_EPOCH += 1
+    _term_notify()
 
-def _run_command(cmd: str, cwd: Path, timeout: Optional[int] = None) -> Dict[str, Any]:
+def term_read(since: Optional[int] = None, epoch: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Log bytes after offset `since` of `epoch`. Without a usable offset (none,
+    old epoch, truncated log, too far behind) returns the last
+    TERMINAL_MAX_CHARS with reset=True. Nothing new costs one stat().
     """
-    Runs a shell command in repo_root. Captures stdout/stderr.
-    On Windows, shell=True lets users type like 'python -m uvicorn ...'
+    max_chars = int(getattr(SETTINGS, "TERMINAL_MAX_CHARS", 200_000))
+    p = terminal_log_path()
+    with _TERM_LOCK:
+        size = p.stat().st_size if p.exists() else 0
+        cur = _TERM_EPOCH
+        reset = since is None or epoch != cur or since > size or size - since > max_chars
+        start = max(0, size - max_chars) if reset else int(since)
+        data = b""
+        if start < size:
+            with p.open("rb") as f:
+                f.seek(start)
+                data = f.read(size - start)
+    text = data.decode("utf-8", errors="replace")
+    if reset and start > 0:
+        text = text[text.find("\n") + 1:]  # drop the partial first line
+    return {"text": text, "start": start, "offset": size, "epoch": cur, "reset": reset}
+
+def _start_run(cmds: List[str], timeout: Optional[float] = None) -> RunJob:
+    """
+    Starts cmds as a background job; output goes to the terminal line by line.
     """
-    t0 = time.time()
-    p = subprocess.run(
-        cmd,
-        cwd=str(cwd),
-        shell=True,
-        capture_output=True,
-        text=True,
-        timeout=timeout
+    return RUNNER.start(
+        cmds,
+        cwd=repo_root(),
+        on_output=term_append,
+        timeout=timeout or float(getattr(SETTINGS, "RUN_TIMEOUT_SEC", 0) or 0) or None,
+        memory_mb=int(getattr(SETTINGS, "RUN_MEMORY_MB", 0) or 0),
+        stop_on_fail=bool(getattr(SETTINGS, "STOP_ON_RUN_FAIL", True)),
     )
-    dt = time.time() - t0
-    return {
-        "cmd": cmd,
-        "returncode": p.returncode,
-        "elapsed_sec": round(dt, 3),
-        "stdout": p.stdout or "",
-        "stderr": p.stderr or "",
-    }
+
+def current_repo_map() -> Dict[str, Any]:
+    """
+    Live watcher snapshot when available (O(changed files)), else a full scan.
+    """
+    if WATCHER is not None and WATCHER.is_ready():
+        return WATCHER.snapshot()
+    return scan_repo(repo_root())
 
 def _format_plan_for_terminal(plan: Dict[str, Any]) -> str:
     lines = []
@@ -295,6 +368,8 @@ INDEX_HTML = r"""
     }
     .fileItem:hover{ border-color:rgba(255,255,255,.12); }
     .fileItem.active{ border-color:rgba(78,161,255,.55); background:rgba(78,161,255,.12); }
+    .fileItem b{ color:var(--accent); font-weight:700; }
+    .fileMore{ color:var(--muted); text-align:center; }
 
     .tabs{ display:flex; gap:8px; flex-wrap:wrap; }
     .tab{
@@ -484,7 +559,7 @@ INDEX_HTML = r"""
         <div>Terminal</div>
         <div class="btnrow">
           <button onclick="clearTerminal()">Clear</button>
-          <button onclick="refreshTerminal()">Refresh</button>
+          <button onclick="refreshTerminal(true)">Refresh</button>
         </div>
       </div>
       <div class="terminalBody">
@@ -493,12 +568,16 @@ INDEX_HTML = r"""
       <div class="cmdRow">
         <input id="cmd" placeholder="Run command in repo (e.g., python -m uvicorn web_app:app --reload --port 8787)" />
         <button class="primary" onclick="runCmd()">Run</button>
+        <button id="cancelRunBtn" onclick="cancelRun()" disabled>Cancel</button>
       </div>
     </div>
   </div>
 
 <script>
-  let ALL_FILES = [];
+  let FILES = {q: "", results: [], total: 0, count: 0};
+  let FILE_SEQ = 0;
+  let FILE_TIMER = null;
+  const FILE_PAGE = 200;
   let ACTIVE_FILE = "";
   let ACTIVE_SHA = "";
   let DIRTY = false;
@@ -554,29 +633,59 @@ INDEX_HTML = r"""
     setStatus("Ready.", "ok");
   }
 
-  async function loadFiles() {
-    const r = await fetch("/api/files", {headers: adminHeaders()});
+  // The file list is searched server-side (/api/files/search: ranked fuzzy
+  // match, paged); only the visible page is in the DOM.
+  async function loadFiles(more=false) {
+    const q = (document.getElementById("fileSearch").value || "").trim();
+    const offset = more ? FILES.results.length : 0;
+    const seq = ++FILE_SEQ;
+    const r = await fetch("/api/files/search?" + new URLSearchParams({q, offset, limit: FILE_PAGE}), {headers: adminHeaders()});
     const j = await r.json();
-    ALL_FILES = j.files || [];
-    document.getElementById("fileCount").textContent = (j.count ?? ALL_FILES.length) + " files";
+    if (seq !== FILE_SEQ || !r.ok) return;  // a newer query is in flight
+    FILES = {q, results: more ? FILES.results.concat(j.results) : j.results, total: j.total, count: j.count};
+    document.getElementById("fileCount").textContent =
+      q ? `${j.total} of ${j.count} files` : `${j.count} files`;
     renderFileList();
   }
 
+  function searchFilesSoon() {
+    clearTimeout(FILE_TIMER);
+    FILE_TIMER = setTimeout(() => loadFiles(), 150);
+  }
+
   function renderFileList() {
-    const q = (document.getElementById("fileSearch").value || "").trim().toLowerCase();
     const list = document.getElementById("fileList");
     list.innerHTML = "";
 
-    const filtered = q ? ALL_FILES.filter(p => p.toLowerCase().includes(q)) : ALL_FILES;
-    const show = filtered.slice(0, 900);
-
-    for (const p of show) {
+    for (const hit of FILES.results) {
+      const p = hit.path;
       const div = document.createElement("div");
       div.className = "fileItem" + (p === ACTIVE_FILE ? " active" : "");
-      div.textContent = p;
+      const marks = new Set(hit.positions || []);
+      let run = "", inMark = false;
+      const flush = () => {
+        if (!run) return;
+        const node = inMark ? document.createElement("b") : document.createTextNode("");
+        node.textContent = run;
+        div.appendChild(node);
+        run = "";
+      };
+      for (let i = 0; i < p.length; i++) {
+        if (marks.has(i) !== inMark) { flush(); inMark = !inMark; }
+        run += p[i];
+      }
+      flush();
       div.onclick = () => openFile(p);
       list.appendChild(div);
     }
+    const left = FILES.total - FILES.results.length;
+    if (left > 0) {
+      const more = document.createElement("div");
+      more.className = "fileItem fileMore";
+      more.textContent = `Show more (${left} left)`;
+      more.onclick = () => loadFiles(true);
+      list.appendChild(more);
+    }
   }
 
   async function openFile(path) {
@@ -634,11 +743,34 @@ INDEX_HTML = r"""
     setDirty(false);
   }
 
+  // Scan/diff/plan/apply run as server-side jobs: submit with ?background=1,
+  // then long-poll /api/jobs/{id}; the status line shows the latest progress.
+  async function pipelineJob(url, label, opts={}) {
+    const sep = url.includes("?") ? "&" : "?";
+    const r = await fetch(url + sep + "background=1", {method:"POST", ...opts,
+      headers: {...(opts.headers || {}), ...adminHeaders()}});
+    let j = await r.json();
+    if (!r.ok) return {error: j.detail || j.error || ("HTTP " + r.status)};
+    const poll = termLive() ? null : setInterval(refreshTerminal, 500);
+    try {
+      while (!j.done) {
+        const q = await fetch("/api/jobs/" + j.job_id + "?wait=20&version=" + j.version, {headers: adminHeaders()});
+        if (!q.ok) return {error: "lost job " + j.job_id};
+        j = await q.json();
+        const last = (j.progress || []).slice(-1)[0];
+        if (last) setStatus(label + " " + last.replace(/^\[[^\]]*\]\s*/, ""), "warn");
+      }
+    } finally {
+      if (poll) clearInterval(poll);
+    }
+    return j.status === "done" ? j.result : {error: j.error || "job failed"};
+  }
+
   async function scan() {
     setStatus("Scanning repo…", "warn");
-    const r = await fetch("/api/scan", {method:"POST", headers: adminHeaders()});
-    const j = await r.json();
+    const j = await pipelineJob("/api/scan", "Scan:");
     setOut(j);
+    if (j.error) { setStatus("Scan failed: " + j.error, "bad"); return; }
     setStatus("Scan saved. Now run Diff.", "ok");
     await loadFiles();
     if (ACTIVE_FILE) await fetchAndShowFile(ACTIVE_FILE);
@@ -647,9 +779,9 @@ INDEX_HTML = r"""
 
   async function diff() {
     setStatus("Computing diff…", "warn");
-    const r = await fetch("/api/diff", {method:"POST", headers: adminHeaders()});
-    const j = await r.json();
+    const j = await pipelineJob("/api/diff", "Diff:");
     setOut(j);
+    if (j.error) { setStatus("Diff failed: " + j.error, "bad"); return; }
     setStatus("Diff saved. Now Plan.", "ok");
     await refreshTerminal();
   }
@@ -658,13 +790,10 @@ INDEX_HTML = r"""
     const goal = document.getElementById("goal").value.trim();
     if (!goal) { alert("Write what you want to change first."); return; }
     setStatus("Asking LLM to plan patches…", "warn");
-
-    const r = await fetch("/api/plan", {
-      method:"POST",
-      headers: {"Content-Type":"application/json", ...adminHeaders()},
+    const j = await pipelineJob("/api/plan", "Plan:", {
+      headers: {"Content-Type":"application/json"},
       body: JSON.stringify({goal})
     });
-    const j = await r.json();
     setOut(j);
     if (j.error) {
       setStatus("Plan failed: " + j.error, "bad");
@@ -677,9 +806,9 @@ INDEX_HTML = r"""
 
   async function dryRunApply() {
     setStatus("Dry-run applying patches…", "warn");
-    const r = await fetch("/api/apply?dry_run=1", {method:"POST", headers: adminHeaders()});
-    const j = await r.json();
+    const j = await pipelineJob("/api/apply?dry_run=1", "Dry-run:");
     setOut(j);
+    if (j.error) { setStatus("Dry-run failed: " + j.error, "bad"); return; }
     setStatus("Dry-run done. Review terminal diff then Apply.", "ok");
     await loadFiles();
     if (ACTIVE_FILE) await fetchAndShowFile(ACTIVE_FILE);
@@ -689,23 +818,101 @@ INDEX_HTML = r"""
   async function applyReal() {
     if (!confirm("Apply patches for real? This edits files and creates backups.")) return;
     setStatus("Applying patches for real…", "warn");
-    const r = await fetch("/api/apply?dry_run=0", {method:"POST", headers: adminHeaders()});
-    const j = await r.json();
+    const j = await pipelineJob("/api/apply?dry_run=0", "Apply:");
     setOut(j);
+    if (j.error) { setStatus("Apply failed: " + j.error, "bad"); return; }
     setStatus("Applied. Backups saved.", "ok");
     await loadFiles();
     if (ACTIVE_FILE) await fetchAndShowFile(ACTIVE_FILE);
     await refreshTerminal();
   }
 
-  async function refreshTerminal() {
-    const r = await fetch("/api/terminal", {headers: adminHeaders()});
+  // Terminal: live via Server-Sent Events; falls back to offset polling
+  // (/api/terminal?since=) when EventSource is unavailable or rejected.
+  let TERM_OFFSET = 0;
+  let TERM_EPOCH = null;
+  let TERM_ES = null;
+  let TERM_POLL = null;
+  const TERM_MAX_CHARS = 200000;
+
+  function termWrite(j) {
+    const el = document.getElementById("terminalOut");
+    const body = el.parentElement;
+    const atBottom = body.scrollTop + body.clientHeight >= body.scrollHeight - 4;
+    if (j.reset) {
+      el.textContent = j.text || "";
+    } else if (j.start !== TERM_OFFSET || j.epoch !== TERM_EPOCH) {
+      return false;  // out of order: caller resyncs
+    } else if (j.text) {
+      let t = el.textContent + j.text;
+      if (t.length > TERM_MAX_CHARS) t = t.slice(t.length - TERM_MAX_CHARS);
+      el.textContent = t;
+    }
+    TERM_OFFSET = j.offset;
+    TERM_EPOCH = j.epoch;
+    if (atBottom) body.scrollTop = body.scrollHeight;
+    return true;
+  }
+
+  function termLive() {
+    return TERM_ES !== null && TERM_ES.readyState === EventSource.OPEN;
+  }
+
+  async function refreshTerminal(full) {
+    if (termLive() && !full) return;  // the stream already pushed everything
+    const q = (full || TERM_EPOCH === null) ? "" : `?since=${TERM_OFFSET}&epoch=${TERM_EPOCH}`;
+    const r = await fetch("/api/terminal" + q, {headers: adminHeaders()});
     const j = await r.json();
-    document.getElementById("terminalOut").textContent = j.text || "";
+    if (!termWrite(j)) await refreshTerminal(true);
+  }
+
+  function startTerminalStream() {
+    if (TERM_ES) { TERM_ES.close(); TERM_ES = null; }
+    if (!window.EventSource) { startTerminalPolling(); return; }
+    const t = (document.getElementById("token").value || "").trim();
+    const params = new URLSearchParams();
+    if (t) params.set("token", t);
+    if (TERM_EPOCH !== null) { params.set("since", TERM_OFFSET); params.set("epoch", TERM_EPOCH); }
+    const es = new EventSource("/api/terminal/stream?" + params.toString());
+    es.addEventListener("append", (e) => {
+      if (!termWrite(JSON.parse(e.data))) refreshTerminal(true);
+    });
+    es.onopen = () => { if (TERM_POLL) { clearInterval(TERM_POLL); TERM_POLL = null; } };
+    es.onerror = () => {
+      // EventSource retries by itself; a closed stream (e.g. 401) means polling
+      if (es.readyState === EventSource.CLOSED) { TERM_ES = null; startTerminalPolling(); }
+    };
+    TERM_ES = es;
+  }
+
+  function startTerminalPolling() {
+    if (!TERM_POLL) TERM_POLL = setInterval(refreshTerminal, 2000);
   }
 
   async function clearTerminal() {
     await fetch("/api/terminal_clear", {method:"POST", headers: adminHeaders()});
+    await refreshTerminal(true);
+  }
+
+  // Commands run as background jobs; output arrives through the terminal.
+  let RUN_JOB = null;
+
+  async function followRun(j, label) {
+    if (j.error || j.detail) { setOut(j); setStatus(label + " failed to start.", "bad"); return; }
+    RUN_JOB = j.job_id || null;
+    document.getElementById("cancelRunBtn").disabled = !RUN_JOB;
+    while (RUN_JOB && !j.done) {
+      await new Promise(res => setTimeout(res, 1000));
+      await refreshTerminal();
+      const r = await fetch("/api/runs/" + RUN_JOB, {headers: adminHeaders()});
+      j = await r.json();
+      if (!r.ok) break;
+    }
+    RUN_JOB = null;
+    document.getElementById("cancelRunBtn").disabled = true;
+    setOut(j);
+    const msg = {ok: "finished.", failed: "failed.", timeout: "timed out.", cancelled: "cancelled."}[j.status] || "finished.";
+    setStatus(label + " " + msg, j.ok ? "ok" : "bad");
     await refreshTerminal();
   }
 
@@ -718,19 +925,18 @@ INDEX_HTML = r"""
       headers: {"Content-Type":"application/json", ...adminHeaders()},
       body: JSON.stringify({cmd})
     });
-    const j = await r.json();
-    setOut(j);
-    setStatus(j.ok ? "Command finished." : "Command failed.", j.ok ? "ok" : "bad");
-    await refreshTerminal();
+    await followRun(await r.json(), "Command");
   }
 
   async function runPlanCommands() {
     setStatus("Running plan commands…", "warn");
     const r = await fetch("/api/run_plan", {method:"POST", headers: adminHeaders()});
-    const j = await r.json();
-    setOut(j);
-    setStatus(j.ok ? "Plan commands finished." : "Plan commands failed.", j.ok ? "ok" : "bad");
-    await refreshTerminal();
+    await followRun(await r.json(), "Plan commands");
+  }
+
+  async function cancelRun() {
+    if (!RUN_JOB) return;
+    await fetch("/api/runs/" + RUN_JOB + "/cancel", {method:"POST", headers: adminHeaders()});
   }
 
   // keyboard shortcuts
@@ -749,20 +955,21 @@ INDEX_HTML = r"""
     }
   });
 
-  document.getElementById("fileSearch").addEventListener("input", renderFileList);
+  document.getElementById("fileSearch").addEventListener("input", searchFilesSoon);
 
   document.getElementById("fileEditor").addEventListener("input", () => {
     if (!ACTIVE_FILE) return;
     setDirty(true);
   });
 
-  // Auto-refresh terminal every 2s
-  setInterval(refreshTerminal, 2000);
+  // new token: reconnect the terminal stream with it
+  document.getElementById("token").addEventListener("change", startTerminalStream);
 
   (async () => {
     await loadStatus();
     await loadFiles();
-    await refreshTerminal();
+    await refreshTerminal(true);
+    startTerminalStream();
   })();
 </script>
 </body>
@@ -770,10 +977,211 @@ INDEX_HTML = r"""
 """
 
 
+# ----------------------------
+# Pipeline jobs (scan / diff / plan / apply)
+# ----------------------------
+#
+# Each step runs on JOBS (see jobs.py); say() writes a progress line to both
+# the terminal and the job. Failures are raised as HTTPException so the
+# waiting request (or /api/jobs/{id}) reports the same status as before.
+
+def _tee(report: Callable[[str], None]) -> Callable[[str], None]:
+    def say(msg: str) -> None:
+        term_line(msg)
+        report(msg)
+    return say
+
+def _job_scan(say: Callable[[str], None]) -> Dict[str, Any]:
+    sd = state_dir()
+    root = repo_root()
+
+    if not app_state().has_snapshot("before"):
+        legacy = sd / "repo_map_before.json"
+        # keep the baseline of installs that predate the repo store
+        before = load_json(legacy) if legacy.exists() else current_repo_map()
+        repo_store.save_snapshot(root, "before", before)
+        say("Scan (before) created.")
+
+    after = current_repo_map()
+    after_id = repo_store.save_snapshot(root, "after", after)
+    cache = after.get("cache") or {}
+    say(f"Scan complete. Files: {after.get('file_count')} (cache hits={cache.get('hits', 0)} misses={cache.get('misses', 0)})")
+
+    index = update_index(root, after)
+    say(f"Search index: {index['updated']} updated, {index['removed']} removed, {index['unchanged']} unchanged.")
+    graph = update_import_graph(root, after)
+    say(f"Import graph: {graph['nodes']} files ({graph['parsed']} re-parsed).")
+    file_index().rebuild(source="scan")
+
+    return {
+        "saved_store": str(repo_store.store_path(root)),
+        "after_snapshot_id": after_id,
+        "after_file_count": after.get("file_count"),
+        "cache": cache,
+        "index": index,
+        "import_graph": graph,
+    }
+
+def _job_diff(say: Callable[[str], None]) -> Dict[str, Any]:
+    sd = state_dir()
+    d = diff_store(repo_root())
+    if d is None:
+        raise HTTPException(400, "Scan first.")
+
+    app_state().put("diff", d)
+    say(f"Diff computed. Added={d['counts']['added']} Modified={d['counts']['modified']} Removed={d['counts']['removed']}")
+    return {"diff": d, "saved": str(sd / "diff.json")}
+
+def _job_plan(say: Callable[[str], None], goal: str, no_cache: bool, n_candidates: int) -> Dict[str, Any]:
+    sd = state_dir()
+    root = repo_root()
+    # context selection only needs metadata, not the stored peeks
+    after = app_state().repo_map("after", columns=("path", "ext", "size", "lines", "sha256", "lang"))
+    diff = app_state().get("diff")
+
+    if after is None:
+        raise HTTPException(400, "Scan first.")
+    if diff is None:
+        raise HTTPException(400, "Diff first.")
+
+    context_text, chosen, budget = build_llm_context_with_report(root, after, diff, goal)
+    say(f"Context: {len(chosen)} files, {budget['used_tokens']}/{budget['budget_tokens']} tokens ({budget['tokenizer']}).")
+    say("Planning patches (LLM)...")
+    cache = PlanCache(root) if bool(getattr(SETTINGS, "PLAN_CACHE", True)) else None
+    # worker thread: the async planner gets its own event loop
+    plan, candidates = asyncio.run(plan_candidates_async(
+        goal,
+        context_text,
+        n_candidates,
+        evaluate=lambda p: score_plan(root, p),
+        on_progress=lambda msg: say(f"[planner] {msg}"),
+        cache=cache,
+        no_cache=no_cache,
+    ))
+    plan_cache = None
+    if cache is not None:
+        plan_cache = {"hit": bool(cache.last_hit), "bypassed": no_cache, **cache.stats()}
+        say(f"Plan cache: {'hit' if cache.last_hit else ('bypassed' if no_cache else 'miss')} (hits={plan_cache['hits']} misses={plan_cache['misses']} entries={plan_cache['entries']})")
+
+    app_state().put("patches", plan)
+    app_state().invalidate("plan_cache_stats")
+    app_state().put("chosen_files", {"chosen_files": chosen, "context_budget": budget})
+
+    # Replit-like: print plan summary/run_commands into terminal
+    term_append("\n" + "="*72 + "\n")
+    say("LLM PATCH PLAN READY")
+    term_append(_format_plan_for_terminal(plan))
+    term_append("="*72 + "\n\n")
+
+    return {
+        "chosen_files": chosen,
+        "context_budget": budget,
+        "patch_plan": plan,
+        "plan_cache": plan_cache,
+        "candidates": candidates,
+        "saved_patches": str(sd / "patches.json"),
+    }
+
+def _job_apply(say: Callable[[str], None], dry_run: bool) -> Dict[str, Any]:
+    plan = app_state().get("patches")
+    if plan is None:
+        raise HTTPException(400, "Plan patches first.")
+
+    say(f"Applying patches (dry_run={dry_run})...")
+    # AppState writes last_apply_log.json (behind); apply_patch_plan must not race it
+    log = apply_patch_plan(repo_root(), plan, dry_run=dry_run, record=False)
+    app_state().put("last_apply_log", log)
+    app_state().invalidate("backup_stats")
+    if not dry_run:
+        file_index().apply_changes(r["file"] for r in log.get("results", []) if r.get("status") == "updated")
+
+    # print diffs if available (from upgraded patch_apply.py)
+    term_append("\n")
+    term_line("APPLY RESULTS:")
+    for r in log.get("results", []):
+        term_line(f"- {r.get('status')}: {r.get('file')} (ops={r.get('ops')})"
+                  + (f" - {r['reason']}" if r.get("reason") else ""))
+        diff_txt = r.get("diff_unified")
+        if diff_txt:
+            term_append(diff_txt + "\n")
+    conflicts = (log.get("conflict_check") or {}).get("conflicts") or []
+    if conflicts:
+        say(f"{len(conflicts)} file(s) changed since the last scan: re-scan and re-plan them.")
+    txn = log.get("transaction") or {}
+    if txn.get("error"):
+        say(f"Apply aborted: {txn['error']}")
+    say(f"Apply done: {len(log.get('results', []))} file(s).")
+    return log
+
+def _job_restore(say: Callable[[str], None], run_id: str, paths: Optional[List[str]]) -> Dict[str, Any]:
+    try:
+        out = BackupStore(repo_root()).restore(run_id, paths)
+    except (ValueError, FileNotFoundError) as e:
+        raise HTTPException(404, str(e))
+    app_state().invalidate("backup_stats")
+
+    file_index().apply_changes(r["file"] for r in out["results"])
+    say(f"Restored backup run {run_id} (undo: {out['undo_run_id']}):")
+    for r in out["results"]:
+        term_line(f"- {r['status']}: {r['file']}" + (f" ({r['reason']})" if r.get("reason") else ""))
+    return out
+
+def _job_backup_gc(say: Callable[[str], None], keep: Optional[int]) -> Dict[str, Any]:
+    out = BackupStore(repo_root()).gc(keep)
+    app_state().invalidate("backup_stats")
+    say(f"Backup gc: {out['runs_removed']} run(s), {out['objects_removed']} object(s), {out['bytes_freed']} bytes freed.")
+    return out
+
+async def _submit_job(req: Request, kind: str, params: Dict[str, Any], fn: Callable[..., Dict[str, Any]]) -> JSONResponse:
+    """
+    Queues fn as a pipeline job. With ?background=1 the job is returned at
+    once (202; poll /api/jobs/{job_id}); otherwise the request waits for it
+    and returns its result as the route always did.
+    """
+    job, dedup = JOBS.submit(kind, str(repo_root()), params, lambda report: fn(_tee(report), **params))
+    if dedup:
+        term_line(f"{kind}: same request already {job.status}, joining job {job.id}.")
+    if req.query_params.get("background") in ("1", "true"):
+        return JSONResponse({**job.to_dict(result=False), "deduplicated": dedup}, status_code=202)
+    await JOBS.wait(job)
+    if job.status != "done":
+        raise HTTPException(job.status_code or 500, job.error)
+    return JSONResponse(job.result)
+
+
 # ----------------------------
 # Routes
 # ----------------------------
 
+@app.on_event("startup")
+def _start_watcher() -> None:
+    global WATCHER
+    if not bool(getattr(SETTINGS, "WATCH_REPO", True)):
+        return
+    WATCHER = RepoWatcher(repo_root())
+    WATCHER.add_listener(file_index().apply_changes)
+    file_index().live = True
+    WATCHER.start()
+
+@app.on_event("shutdown")
+def _stop_watcher() -> None:
+    if WATCHER is not None:
+        WATCHER.stop()
+
+@app.on_event("shutdown")
+async def _stop_runs() -> None:
+    for job_id in list(RUNNER.jobs):
+        await RUNNER.cancel(job_id)
+
+@app.on_event("shutdown")
+def _stop_jobs() -> None:
+    JOBS.shutdown()
+
+@app.on_event("shutdown")
+def _flush_state() -> None:
+    for st in list(_STATES.values()):
+        st.close()
+
 @app.get("/", response_class=HTMLResponse)
 def index() -> str:
     return INDEX_HTML
@@ -785,12 +1193,17 @@ def api_status(req: Request) -> JSONResponse:
     return JSONResponse({
         "repo_root": str(repo_root()),
         "state_dir": str(sd),
-        "has_before": (sd / "repo_map_before.json").exists(),
-        "has_after": (sd / "repo_map_after.json").exists(),
-        "has_diff": (sd / "diff.json").exists(),
-        "has_patches": (sd / "patches.json").exists(),
-        "last_apply_log": load_json(sd / "last_apply_log.json", default=None),
+        "has_before": app_state().has_snapshot("before"),
+        "has_after": app_state().has_snapshot("after"),
+        "has_diff": app_state().get("diff") is not None,
+        "has_patches": app_state().get("patches") is not None,
+        "last_apply_log": app_state().get("last_apply_log"),
         "terminal_log": str(terminal_log_path()),
+        "watcher": WATCHER.status() if WATCHER is not None else None,
+        # both walk a directory: served from a short-lived cache
+        "plan_cache": app_state().derived("plan_cache_stats", lambda: PlanCache(repo_root()).stats()),
+        "backups": app_state().derived("backup_stats", lambda: BackupStore(repo_root()).stats()),
+        "file_index": file_index().stats(),
         "viewer_limits": {
             "max_files_shown_in_list": 800,
             "max_chars_per_file_view": 160_000
@@ -803,6 +1216,15 @@ def api_files(req: Request) -> JSONResponse:
     files = list_repo_files()
     return JSONResponse({"files": files, "count": len(files)})
 
+@app.get("/api/files/search")
+def api_files_search(req: Request, q: str = "", offset: int = 0, limit: int = 200) -> JSONResponse:
+    """
+    One page of fuzzy-ranked paths (see file_index.py); an empty q pages
+    through all files in order.
+    """
+    require_token(req)
+    return JSONResponse(file_index().search(q, offset=offset, limit=max(1, min(1000, limit))))
+
 @app.get("/api/file")
 def api_file(req: Request, path: str) -> JSONResponse:
     require_token(req)
@@ -826,46 +1248,21 @@ async def api_save_file(req: Request) -> JSONResponse:
         raise HTTPException(400, "Missing path/content.")
     try:
         write_file_text(path, str(content))
+        file_index().apply_changes([path])
         term_line(f"Saved file: {path}")
         return JSONResponse({"ok": True, "saved": path, "meta": file_meta(path)})
     except HTTPException as e:
         return JSONResponse({"error": e.detail}, status_code=e.status_code)
 
 @app.post("/api/scan")
-def api_scan(req: Request) -> JSONResponse:
+async def api_scan(req: Request) -> JSONResponse:
     require_token(req)
-    sd = state_dir()
-    before_path = sd / "repo_map_before.json"
-    after_path = sd / "repo_map_after.json"
-
-    if not before_path.exists():
-        before = scan_repo(repo_root())
-        save_json(before_path, before)
-        term_line("Scan (before) created.")
-
-    after = scan_repo(repo_root())
-    save_json(after_path, after)
-    term_line(f"Scan complete. Files: {after.get('file_count')}")
-
-    return JSONResponse({
-        "saved_before": str(before_path),
-        "saved_after": str(after_path),
-        "after_file_count": after.get("file_count"),
-    })
+    return await _submit_job(req, "scan", {}, _job_scan)
 
 @app.post("/api/diff")
-def api_diff(req: Request) -> JSONResponse:
+async def api_diff(req: Request) -> JSONResponse:
     require_token(req)
-    sd = state_dir()
-    before = load_json(sd / "repo_map_before.json")
-    after = load_json(sd / "repo_map_after.json")
-    if before is None or after is None:
-        raise HTTPException(400, "Scan first.")
-
-    d = diff_maps(before, after)
-    save_json(sd / "diff.json", d)
-    term_line(f"Diff computed. Added={d['counts']['added']} Modified={d['counts']['modified']} Removed={d['counts']['removed']}")
-    return JSONResponse({"diff": d, "saved": str(sd / "diff.json")})
+    return await _submit_job(req, "diff", {}, _job_diff)
 
 @app.post("/api/plan")
 async def api_plan(req: Request) -> JSONResponse:
@@ -874,70 +1271,119 @@ async def api_plan(req: Request) -> JSONResponse:
     goal = (payload.get("goal") or "").strip()
     if not goal:
         raise HTTPException(400, "Missing goal.")
-
-    sd = state_dir()
-    after = load_json(sd / "repo_map_after.json")
-    diff = load_json(sd / "diff.json")
-
-    if after is None:
-        raise HTTPException(400, "Scan first.")
-    if diff is None:
-        raise HTTPException(400, "Diff first.")
-
-    context_text, chosen = build_llm_context(repo_root(), after, diff, goal)
-    term_line("Planning patches (LLM)...")
-    plan = plan_patches(goal, context_text)
-
-    save_json(sd / "patches.json", plan)
-    save_json(sd / "chosen_files.json", {"chosen_files": chosen})
-
-    # Replit-like: print plan summary/run_commands into terminal
-    term_append("\n" + "="*72 + "\n")
-    term_line("LLM PATCH PLAN READY")
-    term_append(_format_plan_for_terminal(plan))
-    term_append("="*72 + "\n\n")
-
-    return JSONResponse({
-        "chosen_files": chosen,
-        "patch_plan": plan,
-        "saved_patches": str(sd / "patches.json"),
-    })
+    no_cache = bool(payload.get("no_cache"))
+    try:
+        n_candidates = max(1, min(8, int(payload.get("candidates") or getattr(SETTINGS, "PLANNER_CANDIDATES", 1))))
+    except (TypeError, ValueError):
+        raise HTTPException(400, "candidates must be an integer.")
+    return await _submit_job(req, "plan", {"goal": goal, "no_cache": no_cache, "n_candidates": n_candidates}, _job_plan)
 
 @app.post("/api/apply")
-def api_apply(req: Request, dry_run: int = 1) -> JSONResponse:
+async def api_apply(req: Request, dry_run: int = 1) -> JSONResponse:
     require_token(req)
-    sd = state_dir()
-    plan = load_json(sd / "patches.json")
-    if plan is None:
-        raise HTTPException(400, "Plan patches first.")
+    return await _submit_job(req, "apply", {"dry_run": bool(dry_run)}, _job_apply)
 
-    term_line(f"Applying patches (dry_run={bool(dry_run)})...")
-    log = apply_patch_plan(repo_root(), plan, dry_run=bool(dry_run))
-    save_json(sd / "last_apply_log.json", log)
+@app.get("/api/jobs")
+def api_jobs(req: Request) -> JSONResponse:
+    require_token(req)
+    return JSONResponse({"jobs": JOBS.list()})
 
-    # print diffs if available (from upgraded patch_apply.py)
-    term_append("\n")
-    term_line("APPLY RESULTS:")
-    for r in log.get("results", []):
-        term_line(f"- {r.get('status')}: {r.get('file')} (ops={r.get('ops')})")
-        diff_txt = r.get("diff_unified")
-        if diff_txt:
-            term_append(diff_txt + "\n")
+@app.get("/api/jobs/{job_id}")
+async def api_job_status(req: Request, job_id: str, wait: float = 0, version: int = -1) -> JSONResponse:
+    """
+    Job state (result included once done). ?wait=<sec>&version=<v> long-polls:
+    returns as soon as the job's version moves past v or it finishes.
+    Command jobs from /api/run are found here too.
+    """
+    require_token(req)
+    job = JOBS.get(job_id)
+    if job is None:
+        run = RUNNER.get(job_id)
+        if run is None:
+            raise HTTPException(404, "Unknown job.")
+        return JSONResponse(run.to_dict())
+    if wait > 0 and not job.done and job.version <= version:
+        await asyncio.to_thread(job.wait_change, version, min(wait, 30.0))
+    return JSONResponse(job.to_dict())
+
+@app.get("/api/backups")
+def api_backups(req: Request) -> JSONResponse:
+    require_token(req)
+    store = BackupStore(repo_root())
+    return JSONResponse({"runs": store.list_runs(), "stats": store.stats()})
 
-    return JSONResponse(log)
+@app.post("/api/backups/restore")
+async def api_backups_restore(req: Request) -> JSONResponse:
+    require_token(req)
+    payload = await req.json()
+    run_id = str(payload.get("run_id") or "").strip()
+    paths = payload.get("paths")
+    if not run_id:
+        raise HTTPException(400, "Missing run_id.")
+    if paths is not None and not (isinstance(paths, list) and all(isinstance(p, str) for p in paths)):
+        raise HTTPException(400, "paths must be a list of repo-relative paths.")
+    # a job: restores write the repo, so they queue behind scan/plan/apply
+    return await _submit_job(req, "restore", {"run_id": run_id, "paths": paths}, _job_restore)
+
+@app.post("/api/backups/gc")
+async def api_backups_gc(req: Request) -> JSONResponse:
+    require_token(req)
+    payload = await req.json()
+    keep = payload.get("keep")
+    try:
+        keep = None if keep is None else max(0, int(keep))
+    except (TypeError, ValueError):
+        raise HTTPException(400, "keep must be an integer.")
+    # a job: gc must not drop blobs while an apply is adding them
+    return await _submit_job(req, "backup_gc", {"keep": keep}, _job_backup_gc)
 
 @app.get("/api/terminal")
-def api_terminal(req: Request) -> JSONResponse:
+def api_terminal(req: Request, since: Optional[int] = None, epoch: Optional[int] = None) -> JSONResponse:
+    """
+    Whole (bounded) log, or with ?since=<offset>&epoch=<epoch> only what was
+    appended since then (empty text if nothing changed).
+    """
     require_token(req)
-    p = terminal_log_path()
-    if not p.exists():
-        p.write_text("", encoding="utf-8")
-    txt = p.read_text(encoding="utf-8", errors="replace")
-    # keep response bounded
-    max_chars = int(getattr(SETTINGS, "TERMINAL_MAX_CHARS", 200_000))
-    if len(txt) > max_chars:
-        txt = txt[-max_chars:]
-    return JSONResponse({"text": txt})
+    return JSONResponse(term_read(since, epoch))
+
+@app.get("/api/terminal/stream")
+async def api_terminal_stream(req: Request, since: Optional[int] = None, epoch: Optional[int] = None) -> StreamingResponse:
+    """
+    Server-Sent Events: one "append" event per batch of new log bytes (same
+    payload as /api/terminal). Event ids are "<epoch>:<offset>", so a
+    reconnecting EventSource resumes where it stopped.
+    """
+    require_token(req)
+    last = req.headers.get("last-event-id") or ""
+    if ":" in last:
+        try:
+            epoch, since = (int(x) for x in last.split(":", 1))
+        except ValueError:
+            pass
+
+    waiter = (asyncio.get_running_loop(), asyncio.Event())
+    _TERM_WAITERS.add(waiter)
+
+    async def events():
+        nonlocal since, epoch
+        ev = waiter[1]
+        try:
+            yield "retry: 2000\n\n"
+            while not await req.is_disconnected():
+                ev.clear()
+                chunk = term_read(since, epoch)
+                if chunk["text"] or chunk["reset"]:
+                    since, epoch = chunk["offset"], chunk["epoch"]
+                    yield f"id: {epoch}:{since}\nevent: append\ndata: {json.dumps(chunk)}\n\n"
+                try:
+                    await asyncio.wait_for(ev.wait(), timeout=15)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"  # keeps proxies from closing an idle stream
+        finally:
+            _TERM_WAITERS.discard(waiter)
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 @app.post("/api/terminal_clear")
 def api_terminal_clear(req: Request) -> JSONResponse:
@@ -948,52 +1394,63 @@ def api_terminal_clear(req: Request) -> JSONResponse:
 
 @app.post("/api/run")
 async def api_run(req: Request) -> JSONResponse:
+    """
+    Starts the command and returns its job id at once; output streams to the
+    terminal. {"wait": true} blocks until it finishes (previous behaviour).
+    """
     require_token(req)
     payload = await req.json()
     cmd = (payload.get("cmd") or "").strip()
     if not cmd:
         raise HTTPException(400, "Missing cmd.")
+    timeout = payload.get("timeout")
+    try:
+        timeout = None if timeout is None else float(timeout)
+        if timeout is not None and not timeout >= 0:
+            raise ValueError(timeout)
+    except (TypeError, ValueError):
+        raise HTTPException(400, "timeout must be a number of seconds.")
     term_append("\n")
-    term_line(f"$ {cmd}")
-    res = _run_command(cmd, cwd=repo_root(), timeout=getattr(SETTINGS, "RUN_TIMEOUT_SEC", None))
-    if res["stdout"]:
-        term_append(res["stdout"] + ("\n" if not res["stdout"].endswith("\n") else ""))
-    if res["stderr"]:
-        term_append(res["stderr"] + ("\n" if not res["stderr"].endswith("\n") else ""))
-    ok = (res["returncode"] == 0)
-    term_line(f"Command exit code: {res['returncode']} (elapsed {res['elapsed_sec']}s)")
-    return JSONResponse({"ok": ok, **res})
+    job = _start_run([cmd], timeout=timeout)
+    if not payload.get("wait"):
+        return JSONResponse(job.to_dict())
+    await RUNNER.wait(job)
+    res = job.results[0] if job.results else {}
+    return JSONResponse({**job.to_dict(), **res, "ok": job.status == "ok"})
 
 @app.post("/api/run_plan")
-def api_run_plan(req: Request) -> JSONResponse:
+async def api_run_plan(req: Request) -> JSONResponse:
     require_token(req)
-    sd = state_dir()
-    plan = load_json(sd / "patches.json")
+    payload = await req.json() if (await req.body()) else {}
+    plan = app_state().get("patches")
     if not plan:
         raise HTTPException(400, "No patch plan found. Plan first.")
-    cmds = plan.get("run_commands") or []
-    if not isinstance(cmds, list) or not cmds:
-        return JSONResponse({"ok": True, "note": "Plan has no run_commands.", "results": []})
+    cmds = [str(c).strip() for c in (plan.get("run_commands") or []) if str(c).strip()] \
+        if isinstance(plan.get("run_commands"), list) else []
+    if not cmds:
+        return JSONResponse({"ok": True, "done": True, "note": "Plan has no run_commands.", "results": []})
 
-    results = []
     term_append("\n")
     term_line("RUNNING PLAN COMMANDS...")
-    for c in cmds:
-        c = str(c).strip()
-        if not c:
-            continue
-        term_line(f"$ {c}")
-        res = _run_command(c, cwd=repo_root(), timeout=getattr(SETTINGS, "RUN_TIMEOUT_SEC", None))
-        if res["stdout"]:
-            term_append(res["stdout"] + ("\n" if not res["stdout"].endswith("\n") else ""))
-        if res["stderr"]:
-            term_append(res["stderr"] + ("\n" if not res["stderr"].endswith("\n") else ""))
-        term_line(f"exit={res['returncode']} elapsed={res['elapsed_sec']}s")
-        results.append(res)
-        # stop if one fails
-        if res["returncode"] != 0 and bool(getattr(SETTINGS, "STOP_ON_RUN_FAIL", True)):
-            term_line("Stopping run_plan: command failed.")
-            break
-
-    ok = all(r.get("returncode") == 0 for r in results) if results else True
-    return JSONResponse({"ok": ok, "results": results})
+    job = _start_run(cmds)
+    if not payload.get("wait"):
+        return JSONResponse(job.to_dict())
+    await RUNNER.wait(job)
+    return JSONResponse(job.to_dict())
+
+@app.get("/api/runs/{job_id}")
+def api_run_status(req: Request, job_id: str) -> JSONResponse:
+    require_token(req)
+    job = RUNNER.get(job_id)
+    if job is None:
+        raise HTTPException(404, "Unknown job.")
+    return JSONResponse(job.to_dict())
+
+@app.post("/api/runs/{job_id}/cancel")
+async def api_run_cancel(req: Request, job_id: str) -> JSONResponse:
+    require_token(req)
+    job = await RUNNER.cancel(job_id)
+    if job is None:
+        raise HTTPException(404, "Unknown job.")
+    term_line(f"Cancel requested for job {job_id}.")
+    return JSONResponse(job.to_dict())